@@ -2,7 +2,8 @@
 名片OCR與客戶開發信系統 - 應用程式初始化
 """
 import os
-from flask import Flask
+import time
+from flask import Flask, Response
 from dotenv import load_dotenv
 from flask_cors import CORS
 
@@ -11,8 +12,14 @@ load_dotenv()
 
 def create_app(test_config=None):
     """創建並設定Flask應用程式"""
-    # 創建Flask應用程式
+    from app.lazy import record_phase, startup_report, warm_up
+    from app.config import WARMUP_ON_STARTUP, WARMUP_INSTANCES, OCR_JOBS_AUTOSTART
+    start = time.perf_counter()
+    
+    # 創建Flask應用程式（上傳檔案保存在記憶體，不寫入暫存檔）
+    from app.uploads import InMemoryRequest
     app = Flask(__name__, instance_relative_config=True)
+    app.request_class = InMemoryRequest
     
     # 啟用CORS，允許所有來源的跨域請求
     CORS(app)
@@ -36,9 +43,15 @@ def create_app(test_config=None):
     except OSError:
         pass
 
-    # 註冊藍圖
+    # 記錄各路由的請求數、耗時與錯誤數
+    from app import metrics
+    metrics.init_app(app)
+
+    # 註冊藍圖（API客戶端在第一次使用時才初始化）
+    blueprint_start = time.perf_counter()
     from app import main
     app.register_blueprint(main.bp)
+    record_phase('import_routes_ms', (time.perf_counter() - blueprint_start) * 1000)
 
     # 註冊路由
     @app.route('/health')
@@ -46,4 +59,29 @@ def create_app(test_config=None):
         """健康檢查路由"""
         return {'status': 'ok'}
 
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus指標路由"""
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.route('/health/startup')
+    def startup_check():
+        """啟動時間報告路由"""
+        return startup_report()
+
+    record_phase('create_app_ms', (time.perf_counter() - start) * 1000)
+
+    # 選擇性在背景預熱API客戶端
+    if WARMUP_ON_STARTUP:
+        warm_up([name.strip() for name in WARMUP_INSTANCES.split(',') if name.strip()])
+
+    # 啟動OCR工作佇列，接手上次行程未完成的工作
+    if OCR_JOBS_AUTOSTART:
+        from app.jobs import job_queue
+        job_queue.start()
+
+    # 定期回收過期的上傳圖片
+    from app.storage import storage_collector
+    storage_collector.start()
+
     return app 
\ No newline at end of file
@@ -1,18 +1,34 @@
 """
 名片OCR與客戶開發信系統 - 公司資訊分析模組
 """
-import os
+import hashlib
 import logging
-import requests
-import json
-from googleapiclient.discovery import build
-import google.generativeai as genai
-from app.config import GOOGLE_SEARCH_API_KEY, GOOGLE_CUSTOM_SEARCH_ENGINE_ID, GEMINI_API_KEY, GEMINI_MODEL
+from app.lazy import LazyInstance
+from app.company_cache import CompanyAnalysisCache
+from app.llm_json import parse_llm_json, parse_llm_json_async, LLMJSONError
+from app.metrics import observe_stage, record_fallback
+from app.ratelimit import GovernedModel, QuotaExceeded, gemini_limiter
+from app.config import (
+    GOOGLE_SEARCH_API_KEY, GOOGLE_CUSTOM_SEARCH_ENGINE_ID, GEMINI_API_KEY, GEMINI_MODEL,
+    COMPANY_CACHE_ENABLED, COMPANY_CACHE_PATH, COMPANY_CACHE_TTL, COMPANY_CACHE_STALE_TTL, COMPANY_CACHE_MAX_ENTRIES
+)
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 公司分析回覆的欄位定義
+COMPANY_SCHEMA = {
+    'fields': {'company_profile': str, 'company_type': str, 'industry': str, 'products': list},
+    'required': ('company_profile', 'company_type', 'industry', 'products')
+}
+
+# 開發信回覆的欄位定義
+EMAIL_SCHEMA = {
+    'fields': {'subject': str, 'content': str},
+    'required': ('subject', 'content')
+}
+
 class CompanyAnalyzer:
     """公司資訊分析類別"""
     
@@ -31,20 +47,58 @@ class CompanyAnalyzer:
             logger.warning("未設定Google Search API金鑰或搜尋引擎ID，搜尋功能可能無法正常運作")
         else:
             try:
+                from googleapiclient.discovery import build
+                # 使用套件內建的靜態探索文件，避免啟動時下載
                 self.google_search_client = build(
-                    "customsearch", "v1", developerKey=self.google_api_key
+                    "customsearch", "v1", developerKey=self.google_api_key,
+                    static_discovery=True, cache_discovery=False
                 )
                 logger.info("Google Custom Search API客戶端初始化成功")
             except Exception as e:
                 logger.error(f"初始化Google Custom Search API客戶端失敗: {str(e)}")
         
         try:
+            import google.generativeai as genai
             genai.configure(api_key=self.gemini_api_key)
-            self.gemini_model = genai.GenerativeModel(self.gemini_model_name)
+            # 經由共用的Gemini限流器呼叫（與OCR共用配額）
+            self.gemini_model = GovernedModel(genai.GenerativeModel(self.gemini_model_name), gemini_limiter)
             logger.info(f"Gemini API客戶端初始化成功，使用模型: {self.gemini_model_name}")
         except Exception as e:
             logger.error(f"初始化Gemini API客戶端失敗: {str(e)}")
             self.gemini_model = None
+        
+        # 初始化公司分析快取（同一家公司的名片共用分析結果）
+        self.company_cache = None
+        if COMPANY_CACHE_ENABLED:
+            try:
+                self.company_cache = CompanyAnalysisCache(
+                    COMPANY_CACHE_PATH,
+                    ttl=COMPANY_CACHE_TTL,
+                    stale_ttl=COMPANY_CACHE_STALE_TTL,
+                    max_entries=COMPANY_CACHE_MAX_ENTRIES
+                )
+            except Exception as e:
+                logger.error(f"初始化公司分析快取失敗: {str(e)}")
+    
+    @property
+    def cache_version(self):
+        """快取版本：模型或提示詞變更時，舊的快取結果自動失效"""
+        fingerprint = f"{self.gemini_model_name}\n{self._company_prompt('')}\n{self._details_prompt('')}"
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+    
+    def _cached(self, kind, company_name, tax_id, compute, *args):
+        """經由公司分析快取呼叫 compute(*args)（未啟用快取時直接呼叫）"""
+        if not self.company_cache:
+            return compute(*args)
+        key = CompanyAnalysisCache.make_key(kind, company_name, tax_id, self.cache_version)
+        return self.company_cache.fetch(key, compute, *args)
+    
+    async def _cached_async(self, kind, company_name, tax_id, compute_async, compute, *args):
+        """_cached 的非同步版本（背景更新使用同步的 compute）"""
+        if not self.company_cache:
+            return await compute_async(*args)
+        key = CompanyAnalysisCache.make_key(kind, company_name, tax_id, self.cache_version)
+        return await self.company_cache.fetch_async(key, compute_async, compute, *args)
     
     def search_company_info(self, company_name, tax_id=None, address=None):
         """搜尋公司資訊"""
@@ -84,15 +138,10 @@ class CompanyAnalyzer:
             logger.error(f"搜尋公司資訊失敗: {str(e)}")
             return None
     
-    def analyze_company(self, company_name, search_results=None, tax_id=None, address=None):
-        """使用Gemini分析公司資訊"""
-        if not self.gemini_model:
-            logger.error("Gemini API客戶端未初始化")
-            return self._get_mock_company_data(company_name)
-        
-        try:
-            # 準備提示詞 - 移除搜尋結果部分，直接根據公司名稱進行分析
-            prompt = f"""請根據公司名稱「{company_name}」，分析該公司的公司簡介、公司類型與產業。
+    @staticmethod
+    def _company_prompt(company_name, tax_id=None, address=None):
+        """公司分析的提示詞 - 不使用搜尋結果，直接根據公司名稱進行分析"""
+        return f"""請根據公司名稱「{company_name}」，分析該公司的公司簡介、公司類型與產業。
 請根據公司名稱進行合理推測，提供專業、可信的分析結果。
 
 公司名稱: {company_name}
@@ -109,62 +158,98 @@ class CompanyAnalyzer:
 
 只需回覆JSON，不需要其他說明。
 """
-            
-            # 呼叫Gemini API
-            response = self.gemini_model.generate_content(prompt)
-            
-            # 解析回應
-            response_text = response.text
-            
-            # 嘗試從回應中提取JSON
-            try:
-                # 移除可能的Markdown格式
-                if "```json" in response_text:
-                    response_text = response_text.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_text:
-                    response_text = response_text.split("```")[1].split("```")[0].strip()
-                
-                company_data = json.loads(response_text)
-                logger.info(f"成功分析公司資訊: {company_name}")
-                return company_data
-            
-            except json.JSONDecodeError:
-                logger.error(f"解析Gemini回應JSON失敗: {response_text}")
-                return self._get_mock_company_data(company_name)
-        
+
+    def analyze_company(self, company_name, search_results=None, tax_id=None, address=None):
+        """使用Gemini分析公司資訊（依統一編號或公司名稱快取，失敗時返回模擬資料）"""
+        try:
+            return self._cached(
+                'analysis', company_name, tax_id, self._analyze_company, company_name, tax_id, address
+            )
+        except QuotaExceeded:
+            raise
         except Exception as e:
             logger.error(f"分析公司資訊失敗: {str(e)}")
             return self._get_mock_company_data(company_name)
     
-    def generate_email(self, target_company, my_company):
-        """產生客戶開發信"""
+    async def analyze_company_async(self, company_name, search_results=None, tax_id=None, address=None):
+        """analyze_company 的非同步版本（等待Gemini回應時不佔用執行緒）"""
+        try:
+            return await self._cached_async(
+                'analysis', company_name, tax_id, self._analyze_company_async, self._analyze_company,
+                company_name, tax_id, address
+            )
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"分析公司資訊失敗: {str(e)}")
+            return self._get_mock_company_data(company_name)
+    
+    def _analyze_company(self, company_name, tax_id=None, address=None):
+        """呼叫Gemini分析公司資訊（失敗時拋出例外，結果不寫入快取）"""
         if not self.gemini_model:
-            logger.error("Gemini API客戶端未初始化")
-            return {"status": "error", "error": "Gemini API客戶端未初始化"}
+            raise RuntimeError("Gemini API客戶端未初始化")
         
+        prompt = self._company_prompt(company_name, tax_id, address)
+        
+        # 呼叫Gemini API
+        with observe_stage('gemini_analyze'):
+            response = self.gemini_model.generate_content(prompt)
+        
+        # 解析回應
+        response_text = response.text
+        
+        # 嘗試從回應中提取JSON（必要時以簡短提示詞請模型修正）
         try:
-            # 根據客戶產業選擇適合的寄件職稱
-            industry = target_company.get('industry', '').lower()
-            job_title = "資訊系統架構師"  # 預設職稱
-            
-            if "安全" in industry or "防護" in industry or "資安" in industry:
-                job_title = "資訊安全專家"
-            elif "轉型" in industry or "數位" in industry or "顧問" in industry:
-                job_title = "數位轉型顧問"
-            
-            # 根據客戶產業選擇適合的案例連結
-            case_link = "https://www.tech-genes.com.tw/系統建置流程"  # 預設案例
-            
-            if "網路" in industry or "通訊" in industry or "架構" in industry:
-                case_link = "https://www.chirue.com/en/case-report-oa-internet/"
-            elif "儲存" in industry or "資料" in industry or "伺服器" in industry:
-                case_link = "https://www.metaage.com.tw/news/technology/212"
-            
-            # 準備產品與服務列表
-            products = ', '.join(target_company.get('products', ['']))
-            
-            # 準備提示詞
-            prompt = f"""你是蓋斯克科技的資深資訊系統開發顧問，擅長分析客戶需求並提供客製化的解決方案。你的任務是生成一封能夠展現專業度、建立信任感，並提供具體價值的商務開發信。
+            company_data = parse_llm_json(response_text, COMPANY_SCHEMA, model=self.gemini_model)
+        except LLMJSONError:
+            logger.error(f"解析Gemini回應JSON失敗: {response_text}")
+            raise
+        logger.info(f"成功分析公司資訊: {company_name}")
+        return company_data
+    
+    async def _analyze_company_async(self, company_name, tax_id=None, address=None):
+        """_analyze_company 的非同步版本"""
+        if not self.gemini_model:
+            raise RuntimeError("Gemini API客戶端未初始化")
+        
+        prompt = self._company_prompt(company_name, tax_id, address)
+        with observe_stage('gemini_analyze'):
+            response = await self.gemini_model.generate_content_async(prompt)
+        response_text = response.text
+        
+        try:
+            company_data = await parse_llm_json_async(response_text, COMPANY_SCHEMA, model=self.gemini_model)
+        except LLMJSONError:
+            logger.error(f"解析Gemini回應JSON失敗: {response_text}")
+            raise
+        logger.info(f"成功分析公司資訊: {company_name}")
+        return company_data
+    
+    @staticmethod
+    def _email_prompt(target_company):
+        """開發信的提示詞（依客戶產業選擇寄件職稱與案例連結）"""
+        # 根據客戶產業選擇適合的寄件職稱
+        industry = target_company.get('industry', '').lower()
+        job_title = "資訊系統架構師"  # 預設職稱
+        
+        if "安全" in industry or "防護" in industry or "資安" in industry:
+            job_title = "資訊安全專家"
+        elif "轉型" in industry or "數位" in industry or "顧問" in industry:
+            job_title = "數位轉型顧問"
+        
+        # 根據客戶產業選擇適合的案例連結
+        case_link = "https://www.tech-genes.com.tw/系統建置流程"  # 預設案例
+        
+        if "網路" in industry or "通訊" in industry or "架構" in industry:
+            case_link = "https://www.chirue.com/en/case-report-oa-internet/"
+        elif "儲存" in industry or "資料" in industry or "伺服器" in industry:
+            case_link = "https://www.metaage.com.tw/news/technology/212"
+        
+        # 準備產品與服務列表
+        products = ', '.join(target_company.get('products', ['']))
+        
+        # 準備提示詞
+        return f"""你是蓋斯克科技的資深資訊系統開發顧問，擅長分析客戶需求並提供客製化的解決方案。你的任務是生成一封能夠展現專業度、建立信任感，並提供具體價值的商務開發信。
 
 你是蓋斯克科技的專業資訊系統開發顧問，需要根據以下資訊生成一封專業的開發信。
 
@@ -221,35 +306,69 @@ class CompanyAnalyzer:
 
 只需回覆JSON，不需要其他說明。
 """
+
+    def generate_email(self, target_company, my_company):
+        """產生客戶開發信"""
+        if not self.gemini_model:
+            logger.error("Gemini API客戶端未初始化")
+            return {"status": "error", "error": "Gemini API客戶端未初始化"}
+        
+        try:
+            prompt = self._email_prompt(target_company)
             
             # 呼叫Gemini API
-            response = self.gemini_model.generate_content(prompt)
+            with observe_stage('gemini_analyze'):
+                response = self.gemini_model.generate_content(prompt)
             
             # 解析回應
             response_text = response.text
             
-            # 嘗試從回應中提取JSON
+            # 嘗試從回應中提取JSON（必要時以簡短提示詞請模型修正）
             try:
-                # 移除可能的Markdown格式
-                if "```json" in response_text:
-                    response_text = response_text.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_text:
-                    response_text = response_text.split("```")[1].split("```")[0].strip()
-                
-                email_data = json.loads(response_text)
+                email_data = parse_llm_json(response_text, EMAIL_SCHEMA, model=self.gemini_model)
                 logger.info(f"成功產生客戶開發信: {email_data.get('subject', '')}")
                 return email_data
             
-            except json.JSONDecodeError:
+            except LLMJSONError:
                 logger.error(f"解析Gemini回應JSON失敗: {response_text}")
                 return {"status": "error", "error": f"解析Gemini回應JSON失敗: {response_text[:100]}..."}
         
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"產生客戶開發信失敗: {str(e)}")
+            return {"status": "error", "error": f"產生客戶開發信失敗: {str(e)}"}
+    
+    async def generate_email_async(self, target_company, my_company):
+        """generate_email 的非同步版本（等待Gemini回應時不佔用執行緒）"""
+        if not self.gemini_model:
+            logger.error("Gemini API客戶端未初始化")
+            return {"status": "error", "error": "Gemini API客戶端未初始化"}
+        
+        try:
+            prompt = self._email_prompt(target_company)
+            with observe_stage('gemini_analyze'):
+                response = await self.gemini_model.generate_content_async(prompt)
+            response_text = response.text
+            
+            try:
+                email_data = await parse_llm_json_async(response_text, EMAIL_SCHEMA, model=self.gemini_model)
+                logger.info(f"成功產生客戶開發信: {email_data.get('subject', '')}")
+                return email_data
+            
+            except LLMJSONError:
+                logger.error(f"解析Gemini回應JSON失敗: {response_text}")
+                return {"status": "error", "error": f"解析Gemini回應JSON失敗: {response_text[:100]}..."}
+        
+        except QuotaExceeded:
+            raise
         except Exception as e:
             logger.error(f"產生客戶開發信失敗: {str(e)}")
             return {"status": "error", "error": f"產生客戶開發信失敗: {str(e)}"}
     
     def _get_mock_company_data(self, company_name):
         """取得模擬公司資料（當API失敗時使用）"""
+        record_fallback('analyzer', 'mock_company_data')
         return {
             'company_profile': f'{company_name}是一家專注於提供優質產品和服務的企業，致力於滿足客戶需求並創造價值。',
             'company_type': '一般企業',
@@ -259,6 +378,7 @@ class CompanyAnalyzer:
     
     def _get_mock_email(self):
         """取得模擬郵件（當API失敗時使用）"""
+        record_fallback('analyzer', 'mock_email')
         return {
             'subject': '合作提案：提升貴公司業務效能的解決方案',
             'content': '''尊敬的客戶：
@@ -278,24 +398,10 @@ class CompanyAnalyzer:
 '''
         }
     
-    def analyze_company_details(self, company_name, tax_id=None, address=None):
-        """使用Gemini直接分析公司詳細資料
-        
-        Args:
-            company_name: 公司名稱
-            tax_id: 統一編號
-            address: 公司地址
-            
-        Returns:
-            dict: 包含公司描述、公司產品與服務、公司概況、產業類型的字典
-        """
-        if not self.gemini_model:
-            logger.error("Gemini API客戶端未初始化")
-            return {"status": "error", "error": "Gemini API客戶端未初始化"}
-        
-        try:
-            # 準備提示詞 - 要求提供更詳細的公司分析
-            prompt = f"""請對「{company_name}」進行深入的公司分析，提供詳盡的資訊。
+    @staticmethod
+    def _details_prompt(company_name, tax_id=None, address=None):
+        """公司詳細分析的提示詞（要求提供更詳細的公司分析）"""
+        return f"""請對「{company_name}」進行深入的公司分析，提供詳盡的資訊。
 你是一位專業的商業分析師，請根據公司名稱進行合理推測和分析，提供專業、詳細且可信的分析結果。
 即使資訊有限，也請盡可能提供詳細的分析，包括營運模式、產品服務、市場競爭和財務狀況等方面。
 
@@ -355,30 +461,82 @@ class CompanyAnalyzer:
 
 請盡可能提供詳盡的分析，如果某些資訊無法確定，請進行合理的推測並標明。分析應具有專業性、深度和洞見，能幫助讀者全面了解該公司。
 """
-            
-            # 呼叫Gemini API
-            response = self.gemini_model.generate_content(prompt)
-            
-            # 解析回應
-            response_text = response.text
-            
-            # 提取各部分資訊
-            company_data = {}
-            
-            # 提取公司描述 - 將整個回應存入 company_description
-            company_data["company_description"] = response_text
-            
-            # 保留其他欄位以保持兼容性
-            company_data["company_products"] = "請參見完整分析"
-            company_data["company_overview"] = "請參見完整分析"
-            company_data["industry_type"] = "請參見完整分析"
-            
-            logger.info(f"成功分析公司詳細資料: {company_name}")
-            return company_data
+
+    @staticmethod
+    def _details_result(response_text):
+        """將詳細分析的回應整理為前端期望的格式"""
+        company_data = {}
+        
+        # 提取公司描述 - 將整個回應存入 company_description
+        company_data["company_description"] = response_text
         
+        # 保留其他欄位以保持兼容性
+        company_data["company_products"] = "請參見完整分析"
+        company_data["company_overview"] = "請參見完整分析"
+        company_data["industry_type"] = "請參見完整分析"
+        return company_data
+
+    def analyze_company_details(self, company_name, tax_id=None, address=None):
+        """使用Gemini直接分析公司詳細資料（依統一編號或公司名稱快取）
+        
+        Args:
+            company_name: 公司名稱
+            tax_id: 統一編號
+            address: 公司地址
+            
+        Returns:
+            dict: 包含公司描述、公司產品與服務、公司概況、產業類型的字典
+        """
+        try:
+            return self._cached(
+                'details', company_name, tax_id, self._analyze_company_details, company_name, tax_id, address
+            )
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"分析公司詳細資料失敗: {str(e)}")
+            return {"status": "error", "error": f"分析公司詳細資料失敗: {str(e)}"}
+
+    async def analyze_company_details_async(self, company_name, tax_id=None, address=None):
+        """analyze_company_details 的非同步版本（等待Gemini回應時不佔用執行緒）"""
+        try:
+            return await self._cached_async(
+                'details', company_name, tax_id, self._analyze_company_details_async, self._analyze_company_details,
+                company_name, tax_id, address
+            )
+        except QuotaExceeded:
+            raise
         except Exception as e:
             logger.error(f"分析公司詳細資料失敗: {str(e)}")
             return {"status": "error", "error": f"分析公司詳細資料失敗: {str(e)}"}
 
-# 建立全域實例
-company_analyzer = CompanyAnalyzer() 
\ No newline at end of file
+    def _analyze_company_details(self, company_name, tax_id=None, address=None):
+        """呼叫Gemini分析公司詳細資料（失敗時拋出例外，結果不寫入快取）"""
+        if not self.gemini_model:
+            raise RuntimeError("Gemini API客戶端未初始化")
+        
+        prompt = self._details_prompt(company_name, tax_id, address)
+        
+        # 呼叫Gemini API
+        with observe_stage('gemini_analyze'):
+            response = self.gemini_model.generate_content(prompt)
+        
+        # 解析回應
+        company_data = self._details_result(response.text)
+        logger.info(f"成功分析公司詳細資料: {company_name}")
+        return company_data
+
+    async def _analyze_company_details_async(self, company_name, tax_id=None, address=None):
+        """_analyze_company_details 的非同步版本"""
+        if not self.gemini_model:
+            raise RuntimeError("Gemini API客戶端未初始化")
+        
+        prompt = self._details_prompt(company_name, tax_id, address)
+        with observe_stage('gemini_analyze'):
+            response = await self.gemini_model.generate_content_async(prompt)
+        company_data = self._details_result(response.text)
+        logger.info(f"成功分析公司詳細資料: {company_name}")
+        return company_data
+
+# 建立全域實例（第一次使用時才初始化API客戶端）
+company_analyzer = LazyInstance('company_analyzer', CompanyAnalyzer) 
\ No newline at end of file
@@ -0,0 +1,674 @@
+"""
+名片OCR與客戶開發信系統 - ASGI非同步服務模式
+
+Gemini呼叫常需數秒；同步的Flask伺服器中，每個等待回應的請求都佔用一個執行緒，
+可同時處理的請求數受限於執行緒數。非同步模式以 asyncio 處理等待外部API的路由：
+- POST /api/ocr（單面、非串流）、/api/analyze、/api/analyze-details、/api/generate-email
+  以原生非同步客戶端呼叫Gemini與Vision API，等待期間不佔用執行緒，
+  單一行程可同時處理數百個請求；
+- 其他路由（上傳、批次、串流、工作佇列等）經由WSGI橋接在執行緒池中交給Flask處理，
+  行為與同步模式完全相同。
+
+使用方式:
+    python -m app.asgi                  # 已安裝 uvicorn 時使用 uvicorn，否則使用內建的HTTP/1.1伺服器
+    uvicorn app.asgi:application
+"""
+import asyncio
+import http
+import io
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+from app import create_app
+from app.main import card_ocr, company_analyzer, to_card_data, load_image
+from app.metrics import http_requests, http_request_seconds, http_errors, idempotency_requests
+from app.ratelimit import QuotaExceeded
+from app.idempotency import (
+    IdempotencyError, REPLAYED_HEADER, error_payload, idempotency_store, request_fingerprint, scoped_key
+)
+from app.config import ASGI_HOST, ASGI_PORT, ASGI_MAX_IN_FLIGHT, ASGI_WSGI_THREADS, ASGI_MAX_JSON_BYTES
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 已註冊的非同步路由：{(方法, 路徑): (端點名稱, 處理函式)}
+ASYNC_ROUTES = {}
+
+# 處理函式返回此值時，改由WSGI橋接交給Flask處理
+DELEGATE = object()
+
+
+def async_route(path, endpoint, methods=('POST',)):
+    """註冊非同步路由的裝飾器
+
+    端點名稱與對應的Flask路由相同，兩種模式的指標可以合併檢視。
+    處理函式接收 AsyncRequest，返回 (payload, 狀態碼) 或 DELEGATE。
+    """
+    def decorator(handler):
+        for method in methods:
+            ASYNC_ROUTES[(method, path)] = (endpoint, handler)
+        return handler
+    return decorator
+
+
+class BodyTooLarge(Exception):
+    """請求本文超過上限"""
+
+
+class AsyncRequest:
+    """非同步路由的請求（本文已完整讀取）"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {}
+        for name, value in scope.get('headers', []):
+            self.headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+        self.body = body
+
+    @property
+    def json(self):
+        """解析後的JSON本文，格式錯誤時為None"""
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+
+async def read_body(receive, limit):
+    """讀取完整的請求本文
+
+    Raises:
+        BodyTooLarge: 超過 limit
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def json_body(payload):
+    """JSON回應本文（格式與Flask的 jsonify 相同）"""
+    return (json.dumps(payload, separators=(',', ':'), sort_keys=True) + '\n').encode('utf-8')
+
+
+async def send_body(send, body, status=200, content_type='application/json', cors=False, headers=None):
+    """送出完整的回應本文"""
+    headers = [
+        (b'content-type', content_type.encode('latin-1')),
+        (b'content-length', str(len(body)).encode('latin-1'))
+    ] + list(headers or [])
+    if cors:
+        headers.append((b'access-control-allow-origin', b'*'))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, payload, status=200, cors=False, headers=None):
+    """送出JSON回應"""
+    await send_body(send, json_body(payload), status, cors=cors, headers=headers)
+
+
+class _ReceiveStream(io.RawIOBase):
+    """在工作執行緒中讀取ASGI請求本文的 wsgi.input（邊接收邊讀取，不先緩衝整個本文）"""
+
+    def __init__(self, receive, loop, body=None):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = body or b''
+        self._more = body is None
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self._more = False
+                break
+            self._buffer = message.get('body', b'')
+            self._more = message.get('more_body', False)
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class WSGIBridge:
+    """在執行緒池中以WSGI介面執行Flask應用程式
+
+    回應本文每產生一段就送出，SSE與NDJSON串流路由維持逐段推送。
+    """
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-wsgi')
+
+    async def __call__(self, scope, receive, send, body=None):
+        """處理請求；body 不為None時表示本文已被讀取"""
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, _ReceiveStream(receive, loop, body))
+        state = {'started': False}
+
+        def send_threadsafe(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        self.in_flight += 1
+        try:
+            await loop.run_in_executor(self._executor, self._run, environ, send_threadsafe, state)
+        except Exception as e:
+            logger.error(f"WSGI橋接處理失敗: {scope['path']}, {str(e)}")
+            if not state['started']:
+                await send_json(send, {'status': 'error', 'error': '伺服器錯誤'}, 500)
+        finally:
+            self.in_flight -= 1
+
+    def _environ(self, scope, stream):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            # PEP 3333：PATH_INFO 為以latin-1解碼的原始位元組
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'REMOTE_ADDR': str(client[0]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BufferedReader(stream),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for raw_name, raw_value in scope.get('headers', []):
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+        if 'CONTENT_LENGTH' not in environ:
+            environ['wsgi.input_terminated'] = True
+        return environ
+
+    def _run(self, environ, send, state):
+        """在工作執行緒中呼叫WSGI應用程式並逐段送出回應"""
+        def start_response(status, headers, exc_info=None):
+            state['status'] = int(status.split(' ', 1)[0])
+            state['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        def start():
+            send({'type': 'http.response.start', 'status': state['status'], 'headers': state['headers']})
+            state['started'] = True
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if not state['started']:
+                    start()
+                if chunk:
+                    send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not state['started']:
+                start()
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class AsyncApplication:
+    """ASGI應用程式：已註冊的路由以 asyncio 處理，其他路由交給Flask"""
+
+    def __init__(self, wsgi_app, max_in_flight=ASGI_MAX_IN_FLIGHT, wsgi_threads=ASGI_WSGI_THREADS):
+        self.bridge = WSGIBridge(wsgi_app, wsgi_threads)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        route = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if route is None:
+            await self.bridge(scope, receive, send)
+            return
+        await self._handle(route, scope, receive, send)
+
+    async def _handle(self, route, scope, receive, send):
+        endpoint, handler = route
+        start = time.perf_counter()
+        headers = []
+        content_type = 'application/json'
+        request = None
+        try:
+            body = await read_body(receive, ASGI_MAX_JSON_BYTES)
+        except BodyTooLarge:
+            response_body, status = json_body({'status': 'error', 'error': '請求內容過大'}), 413
+        else:
+            request = AsyncRequest(scope, body)
+            try:
+                claim, record = await self._begin_idempotent(endpoint, request)
+            except IdempotencyError as e:
+                idempotency_requests.inc(endpoint=endpoint, outcome=e.reason)
+                payload, status, extra = error_payload(e)
+                claim, record, outcome = None, None, (payload, status)
+                headers.extend((name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in extra.items())
+            else:
+                try:
+                    outcome = None if record else await self._run_handler(endpoint, handler, request, headers)
+                except BaseException:
+                    # 例如用戶端中斷連線而取消
+                    if claim:
+                        idempotency_store.abandon(*claim)
+                    raise
+
+            if outcome is DELEGATE:
+                if claim:
+                    # 交由Flask的路由以同一個鍵處理
+                    await asyncio.to_thread(idempotency_store.abandon, *claim)
+                # 由Flask處理（並由Flask記錄指標）
+                await self.bridge(scope, receive, send, body=body)
+                return
+
+            if record:
+                idempotency_requests.inc(endpoint=endpoint, outcome='replayed')
+                status, content_type, response_body = record['status_code'], record['content_type'], record['body']
+                headers.append((REPLAYED_HEADER.lower().encode('latin-1'), b'true'))
+            else:
+                payload, status = outcome
+                response_body = json_body(payload)
+                if claim:
+                    idempotency_requests.inc(endpoint=endpoint, outcome='started')
+                    await asyncio.to_thread(idempotency_store.complete, *claim, status, response_body, content_type)
+
+        await send_body(
+            send, response_body, status, content_type,
+            cors=request is not None and 'origin' in request.headers, headers=headers
+        )
+        self.completed += 1
+        http_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+        http_requests.inc(endpoint=endpoint, method=scope['method'], status=status)
+        if status >= 500:
+            http_errors.inc(endpoint=endpoint, kind='server')
+        elif status >= 400:
+            http_errors.inc(endpoint=endpoint, kind='client')
+
+    async def _begin_idempotent(self, endpoint, request):
+        """處理 Idempotency-Key 標頭（同 app.idempotency.idempotent）
+
+        Returns:
+            tuple: ((鍵, 擁有者代碼) 或 None, 重播的回應或None)
+        """
+        raw_key = request.headers.get('idempotency-key')
+        if idempotency_store is None or raw_key is None:
+            return None, None
+        view = self.bridge.wsgi_app.view_functions.get(endpoint)
+        if not getattr(view, 'idempotent', False):
+            return None, None
+
+        key = scoped_key(endpoint, raw_key)
+        owner, record = await idempotency_store.begin_async(
+            key, request_fingerprint(request.method, request.path, request.body)
+        )
+        return ((key, owner) if owner is not None else None), record
+
+    async def _run_handler(self, endpoint, handler, request, headers):
+        """在並行上限內執行處理函式，返回 (payload, 狀態碼) 或 DELEGATE"""
+        self.waiting += 1
+        async with self._semaphore:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                return await handler(request)
+            except QuotaExceeded as e:
+                # 同 main.quota_response
+                logger.warning(f"Gemini配額不足: {str(e)}")
+                headers.append((b'retry-after', str(e.retry_after).encode('latin-1')))
+                return {'status': 'error', 'error': str(e), 'retry_after': e.retry_after}, 429
+            except Exception as e:
+                logger.error(f"非同步路由處理失敗: {endpoint}, {str(e)}")
+                http_errors.inc(endpoint=endpoint, kind='exception')
+                return {'status': 'error', 'error': f'伺服器錯誤: {str(e)}'}, 500
+            finally:
+                self.in_flight -= 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.bridge.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def stats(self):
+        """取得並行處理統計"""
+        return {
+            'mode': 'asgi',
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'max_in_flight': self.max_in_flight,
+            'wsgi_threads': self.bridge.threads,
+            'wsgi_in_flight': self.bridge.in_flight
+        }
+
+
+@async_route('/api/ocr', 'main.process_ocr')
+async def process_ocr(request):
+    """處理OCR請求（同 main.process_ocr；雙面名片與串流模式交給Flask處理）"""
+    data = request.json
+    if not data or 'image_path' not in data:
+        return {'error': '缺少圖片路徑'}, 400
+
+    if data.get('back_image_path') or data.get('stream') or 'text/event-stream' in request.headers.get('accept', ''):
+        return DELEGATE
+
+    image_path = data['image_path']
+    try:
+        content = await asyncio.to_thread(load_image, image_path)
+    except OSError as e:
+        logger.error(f"讀取圖片失敗: {image_path}, {str(e)}")
+        return {'status': 'error', 'error': '無法讀取圖片'}, 400
+
+    try:
+        logger.info(f"開始處理OCR: {image_path}")
+        ocr = await asyncio.to_thread(card_ocr.get)
+        stats = {}
+        result = await ocr.process_image_bytes_async(content, stats=stats, source=image_path)
+
+        if not result:
+            return {'status': 'error', 'error': '無法辨識名片資訊'}, 400
+
+        logger.info(f"OCR處理成功: {image_path}")
+        return {'status': 'success', 'data': to_card_data(result), 'stats': stats}, 200
+
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"OCR處理失敗: {str(e)}")
+        return {'status': 'error', 'error': f'OCR處理失敗: {str(e)}'}, 500
+
+
+@async_route('/api/analyze', 'main.analyze_company')
+async def analyze_company(request):
+    """分析公司資訊（同 main.analyze_company）"""
+    data = request.json
+    if not data or 'company_name' not in data:
+        return {'error': '缺少公司名稱'}, 400
+
+    company_name = data['company_name']
+    try:
+        logger.info(f"開始分析公司資訊: {company_name}")
+        analyzer = await asyncio.to_thread(company_analyzer.get)
+        result = await analyzer.analyze_company_async(
+            company_name, None, data.get('tax_id', ''), data.get('address', '')
+        )
+
+        if not result:
+            return {'status': 'error', 'error': '無法分析公司資訊'}, 400
+
+        logger.info(f"公司分析成功: {company_name}")
+        return {'status': 'success', 'data': result}, 200
+
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"公司分析失敗: {str(e)}")
+        return {'status': 'error', 'error': f'公司分析失敗: {str(e)}'}, 500
+
+
+@async_route('/api/generate-email', 'main.generate_email')
+async def generate_email(request):
+    """生成開發信（同 main.generate_email）"""
+    data = request.json
+    if not data or 'target_company' not in data or 'my_company' not in data:
+        return {'error': '缺少必要資訊'}, 400
+
+    target_company = data['target_company']
+    try:
+        logger.info(f"開始生成開發信: 目標公司 {target_company.get('name', '')}")
+        analyzer = await asyncio.to_thread(company_analyzer.get)
+        result = await analyzer.generate_email_async(target_company, data['my_company'])
+
+        if result and 'status' in result and result['status'] == 'error':
+            error_message = result.get('error', '無法生成開發信')
+            logger.error(f"開發信生成失敗: {error_message}")
+            return {'status': 'error', 'error': error_message}, 500
+
+        if not result or not ('subject' in result and 'content' in result):
+            logger.error("開發信生成失敗: 返回格式無效")
+            return {'status': 'error', 'error': '開發信生成失敗: API 返回格式無效'}, 500
+
+        logger.info(f"開發信生成成功: {result.get('subject', '')}")
+        return {'status': 'success', 'data': result}, 200
+
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"開發信生成失敗: {str(e)}")
+        return {'status': 'error', 'error': f'開發信生成失敗: {str(e)}'}, 500
+
+
+@async_route('/api/analyze-details', 'main.analyze_company_details')
+async def analyze_company_details(request):
+    """分析公司詳細資料（同 main.analyze_company_details）"""
+    data = request.json
+    if not data or 'company_name' not in data:
+        return {'error': '缺少公司名稱'}, 400
+
+    company_name = data['company_name']
+    try:
+        logger.info(f"開始分析公司詳細資料: {company_name}")
+        analyzer = await asyncio.to_thread(company_analyzer.get)
+        result = await analyzer.analyze_company_details_async(
+            company_name, data.get('tax_id', ''), data.get('address', '')
+        )
+
+        if result and 'status' in result and result['status'] == 'error':
+            error_message = result.get('error', '無法分析公司詳細資料')
+            logger.error(f"公司詳細分析失敗: {error_message}")
+            return {'status': 'error', 'error': error_message}, 500
+
+        if not result or 'company_description' not in result:
+            logger.error("公司詳細分析失敗: 返回格式無效")
+            return {'status': 'error', 'error': '公司詳細分析失敗: API 返回格式無效'}, 500
+
+        logger.info(f"公司詳細分析成功: {company_name}")
+        return {'status': 'success', 'data': result}, 200
+
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"公司詳細分析失敗: {str(e)}")
+        return {'status': 'error', 'error': f'公司詳細分析失敗: {str(e)}'}, 500
+
+
+@async_route('/api/asgi', 'asgi.stats', methods=('GET',))
+async def asgi_stats(request):
+    """取得非同步模式的並行處理統計"""
+    return {'status': 'success', 'data': application.stats()}, 200
+
+
+async def _serve_connection(app, reader, writer):
+    """內建伺服器：處理一個HTTP/1.1連線上的一個請求（回應後關閉連線）"""
+    disconnected = asyncio.Event()
+    try:
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, target, version = request_line.split(' ', 2)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            return
+
+        headers = []
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+        header_map = dict(headers)
+        if b'chunked' in header_map.get(b'transfer-encoding', b''):
+            writer.write(b'HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return
+
+        path, _, query = target.partition('?')
+        remaining = int(header_map.get(b'content-length', b'0') or 0)
+        body_done = False
+
+        async def receive():
+            nonlocal remaining, body_done
+            if not body_done:
+                chunk = await reader.read(min(remaining, 65536)) if remaining else b''
+                if remaining and not chunk:
+                    body_done = True
+                    return {'type': 'http.disconnect'}
+                remaining -= len(chunk)
+                body_done = remaining <= 0
+                return {'type': 'http.request', 'body': chunk, 'more_body': not body_done}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        response = {'started': False, 'chunked': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = [
+                    (name, value) for name, value in message.get('headers', [])
+                    if name.lower() not in (b'connection', b'transfer-encoding')
+                ]
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if not response['started']:
+                response['started'] = True
+                status = response['status']
+                try:
+                    phrase = http.HTTPStatus(status).phrase
+                except ValueError:
+                    phrase = ''
+                lines = [f'HTTP/1.1 {status} {phrase}'.encode('latin-1')]
+                has_length = any(name.lower() == b'content-length' for name, _ in response['headers'])
+                if not has_length and more_body:
+                    response['chunked'] = True
+                    lines.append(b'Transfer-Encoding: chunked')
+                elif not has_length:
+                    lines.append(b'Content-Length: ' + str(len(body)).encode('latin-1'))
+                lines.extend(name + b': ' + value for name, value in response['headers'])
+                lines.append(b'Connection: close')
+                writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+
+            if response['chunked']:
+                if body:
+                    writer.write(b'%x\r\n' % len(body) + body + b'\r\n')
+                if not more_body:
+                    writer.write(b'0\r\n\r\n')
+            elif body:
+                writer.write(body)
+            await writer.drain()
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.3'},
+            'http_version': version.partition('/')[2] or '1.1',
+            'method': method.upper(),
+            'scheme': 'http',
+            'path': unquote(path),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'),
+            'root_path': '',
+            'headers': headers,
+            'client': (writer.get_extra_info('peername') or ('', 0))[:2],
+            'server': (writer.get_extra_info('sockname') or ('localhost', 80))[:2]
+        }
+        await app(scope, receive, send)
+    except ConnectionError:
+        pass
+    except Exception as e:
+        logger.error(f"處理連線失敗: {str(e)}")
+    finally:
+        disconnected.set()
+        writer.close()
+
+
+async def start_server(app=None, host=ASGI_HOST, port=ASGI_PORT):
+    """啟動內建的非同步HTTP/1.1伺服器（開發與測試用；正式環境建議使用 uvicorn）
+
+    Returns:
+        asyncio.Server: 已開始接受連線的伺服器
+    """
+    app = app or application
+    return await asyncio.start_server(
+        lambda reader, writer: _serve_connection(app, reader, writer),
+        host, port, backlog=1024
+    )
+
+
+def serve(host=ASGI_HOST, port=ASGI_PORT):
+    """以非同步模式啟動服務"""
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+
+    if uvicorn is not None:
+        logger.info(f"以 uvicorn 啟動非同步模式於 {host}:{port}")
+        uvicorn.run(application, host=host, port=port, lifespan='on')
+        return
+
+    async def run():
+        server = await start_server(application, host, port)
+        logger.info(f"以內建伺服器啟動非同步模式於 {host}:{port}（未安裝 uvicorn）")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        application.bridge.shutdown()
+
+
+# 建立全域ASGI應用程式
+application = AsyncApplication(create_app())
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,295 @@
+"""
+名片OCR與客戶開發信系統 - OCR後端註冊模組
+
+BusinessCardOCR 依設定的順序逐一嘗試OCR後端，前一個失敗時改用下一個：
+- gemini：Gemini多模態模型（支援串流）
+- vision：Google Vision API文字偵測＋規則解析
+- stub：重播錄製的回應，可設定延遲與錯誤率分佈，供離線壓力測試與基準測試使用
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+from app.ratelimit import gemini_limiter, estimate_tokens
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 已註冊的後端類別
+BACKENDS = {}
+
+
+def register_backend(name):
+    """註冊OCR後端類別的裝飾器"""
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def create_backends(names, ocr, **options):
+    """依名稱建立OCR後端
+
+    Args:
+        names: 後端名稱列表（依嘗試順序）
+        ocr: BusinessCardOCR 實例
+        **options: 傳給各後端的設定，以後端名稱為鍵（例如 stub={...}）
+
+    Returns:
+        list: 後端實例列表，未知的名稱會被略過
+    """
+    backends = []
+    for name in names:
+        cls = BACKENDS.get(name)
+        if cls is None:
+            logger.error(f"未知的OCR後端: {name}")
+            continue
+        try:
+            backends.append(cls(ocr, **options.get(name, {})))
+        except Exception as e:
+            logger.error(f"初始化OCR後端失敗: {name}, {str(e)}")
+    logger.info(f"OCR後端順序: {[backend.name for backend in backends]}")
+    return backends
+
+
+class OCRBackend:
+    """OCR後端介面"""
+
+    name = None
+    # 是否支援以 stream 逐段產生模型回應文字
+    streaming = False
+
+    def __init__(self, ocr):
+        self.ocr = ocr
+
+    @property
+    def available(self):
+        """後端是否可用（例如API客戶端已初始化）"""
+        return True
+
+    def recognize(self, content, mime_type, source):
+        """辨識圖片
+
+        Returns:
+            dict: 名片資訊，無法辨識時返回None
+
+        Raises:
+            Exception: 後端呼叫失敗（由呼叫端改用下一個後端）
+        """
+        raise NotImplementedError
+
+    def stream(self, content, mime_type, source):
+        """逐段產生模型回應的JSON文字（只有 streaming 為True的後端需要實作）"""
+        raise NotImplementedError
+
+    async def recognize_async(self, content, mime_type, source):
+        """非同步辨識圖片（ASGI模式使用）
+
+        預設在執行緒中呼叫 recognize；呼叫外部API的後端應改用原生的非同步客戶端，
+        等待回應時才不會佔用執行緒。
+        """
+        return await asyncio.to_thread(self.recognize, content, mime_type, source)
+
+
+@register_backend('gemini')
+class GeminiBackend(OCRBackend):
+    """Gemini多模態模型"""
+
+    streaming = True
+
+    @property
+    def available(self):
+        return self.ocr.gemini_model is not None
+
+    def recognize(self, content, mime_type, source):
+        return self.ocr._timed_gemini(content, mime_type, source)
+
+    async def recognize_async(self, content, mime_type, source):
+        return await self.ocr._timed_gemini_async(content, mime_type, source)
+
+    def stream(self, content, mime_type, source):
+        start = time.perf_counter()
+        for text in self.ocr._stream_gemini(content, mime_type):
+            yield text
+        self.ocr.gemini_latency.record((time.perf_counter() - start) * 1000)
+
+
+@register_backend('vision')
+class VisionBackend(OCRBackend):
+    """Google Vision API文字偵測＋規則解析"""
+
+    @property
+    def available(self):
+        return self.ocr.vision_client is not None
+
+    def recognize(self, content, mime_type, source):
+        return self.ocr._process_with_vision_api(content, source)
+
+    async def recognize_async(self, content, mime_type, source):
+        return await self.ocr._process_with_vision_api_async(content, source)
+
+
+_record_lock = threading.Lock()
+
+
+def record_response(path, response_text, latency_ms):
+    """將模型回應附加到錄製檔（JSONL），供重播後端使用"""
+    line = json.dumps({'response': response_text, 'latency_ms': round(latency_ms, 2)}, ensure_ascii=False)
+    with _record_lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+class StubBackendError(RuntimeError):
+    """模擬的OCR後端暫時性錯誤"""
+
+
+def parse_latency(spec):
+    """解析延遲分佈設定
+
+    支援：
+        fixed:毫秒
+        uniform:最小毫秒:最大毫秒
+        lognormal:中位數毫秒:sigma
+        recorded（使用錄製時的延遲，未記錄時為0）
+
+    Returns:
+        function: (隨機數產生器, 錄製項目) -> 延遲毫秒數
+    """
+    kind, _, args = (spec or 'fixed:0').partition(':')
+    values = [float(value) for value in args.split(':') if value]
+    if kind == 'fixed':
+        return lambda rng, entry: values[0] if values else 0.0
+    if kind == 'uniform':
+        return lambda rng, entry: rng.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        median, sigma = values
+        return lambda rng, entry: rng.lognormvariate(math.log(median), sigma)
+    if kind == 'recorded':
+        return lambda rng, entry: float(entry.get('latency_ms', 0.0))
+    raise ValueError(f"不支援的延遲分佈: {spec}")
+
+
+@register_backend('stub')
+class StubBackend(OCRBackend):
+    """重播錄製回應的本地後端
+
+    錄製檔為JSONL，每行一個項目：
+        {"response": "Gemini的原始回覆", "latency_ms": 820}
+        {"text": "Vision API辨識出的純文字"}
+        {"card": {...名片欄位...}}
+    同一張圖片固定對應同一個項目（依內容雜湊選擇）；延遲與錯誤由固定種子的
+    隨機數產生器決定，相同的請求順序會得到相同的結果。
+    模擬的呼叫與Gemini一樣經由共用的Gemini限流器，壓力測試可一併驗證限流行為。
+    """
+
+    streaming = True
+
+    def __init__(self, ocr, recordings_path=None, latency='fixed:0', error_rate=0.0, seed=0,
+                 chunk_chars=48):
+        """初始化重播後端
+
+        Args:
+            ocr: BusinessCardOCR 實例（用於解析錄製的回應）
+            recordings_path: 錄製檔路徑
+            latency: 延遲分佈設定（見 parse_latency）
+            error_rate: 請求失敗的機率（0-1）
+            seed: 隨機數種子
+            chunk_chars: 串流模式每段回應的字元數
+        """
+        super().__init__(ocr)
+        self.recordings = []
+        if recordings_path:
+            with open(recordings_path, encoding='utf-8') as f:
+                self.recordings = [json.loads(line) for line in f if line.strip()]
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.chunk_chars = chunk_chars
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        logger.info(
+            f"OCR重播後端已載入 {len(self.recordings)} 筆錄製回應，延遲 {latency}，錯誤率 {error_rate}"
+        )
+
+    @property
+    def available(self):
+        return bool(self.recordings)
+
+    def _draw(self, content):
+        """選擇錄製項目並抽樣延遲與是否失敗"""
+        digest = hashlib.sha256(content).digest()
+        entry = self.recordings[int.from_bytes(digest[:8], 'big') % len(self.recordings)]
+        with self._lock:
+            self.requests += 1
+            latency_ms = max(0.0, self.latency(self._rng, entry))
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return entry, latency_ms, failed
+
+    def _reply_text(self, entry):
+        """錄製項目對應的模型回覆文字"""
+        if 'response' in entry:
+            return entry['response']
+        return json.dumps(entry.get('card', {}), ensure_ascii=False)
+
+    @staticmethod
+    def _tokens(content, mime_type):
+        """模擬呼叫的預估token數（同 GovernedModel）"""
+        return estimate_tokens([{'mime_type': mime_type, 'data': content}]) + gemini_limiter.output_tokens
+
+    def recognize(self, content, mime_type, source):
+        with gemini_limiter.slot(self._tokens(content, mime_type)):
+            entry, latency_ms, failed = self._draw(content)
+            time.sleep(latency_ms / 1000)
+        return self._replay(entry, failed, source)
+
+    async def recognize_async(self, content, mime_type, source):
+        async with gemini_limiter.slot_async(self._tokens(content, mime_type)):
+            entry, latency_ms, failed = self._draw(content)
+            await asyncio.sleep(latency_ms / 1000)
+        return self._replay(entry, failed, source)
+
+    def _replay(self, entry, failed, source):
+        """依錄製項目產生辨識結果"""
+        if failed:
+            raise StubBackendError(f"模擬的OCR後端錯誤: {source}")
+
+        if 'text' in entry:
+            return self.ocr._parse_business_card(entry['text'])
+        return self.ocr._parse_gemini_reply(self._reply_text(entry), source)
+
+    def stream(self, content, mime_type, source):
+        with gemini_limiter.slot(self._tokens(content, mime_type)):
+            entry, latency_ms, failed = self._draw(content)
+            if 'text' in entry:
+                text = json.dumps(self.ocr._parse_business_card(entry['text']), ensure_ascii=False)
+            else:
+                text = self._reply_text(entry)
+            chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or ['']
+            delay = latency_ms / 1000 / len(chunks)
+            for index, chunk in enumerate(chunks):
+                time.sleep(delay)
+                if failed and index == len(chunks) // 2:
+                    raise StubBackendError(f"模擬的OCR後端錯誤: {source}")
+                yield chunk
+
+    def stats(self):
+        """取得重播統計"""
+        with self._lock:
+            return {
+                'recordings': len(self.recordings),
+                'latency': self.latency_spec,
+                'error_rate': self.error_rate,
+                'requests': self.requests,
+                'errors': self.errors
+            }
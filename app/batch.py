@@ -0,0 +1,98 @@
+"""
+名片OCR與客戶開發信系統 - 批次並行處理模組
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _timed_call(func, item):
+    """執行單一項目並記錄狀態與耗時"""
+    start = time.perf_counter()
+    try:
+        result = func(item)
+        status = 'success' if result else 'error'
+        error = None if result else '無法取得結果'
+    except Exception as e:
+        logger.error(f"批次項目處理失敗: {str(e)}")
+        result = None
+        status = 'error'
+        error = str(e)
+
+    return {
+        'status': status,
+        'result': result,
+        'error': error,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+def run_bounded(func, items, max_workers=4):
+    """以有限大小的執行緒池並行處理項目
+
+    Args:
+        func: 處理單一項目的函式，返回假值視為失敗
+        items: 要處理的項目列表
+        max_workers: 同時執行的最大數量
+
+    Returns:
+        list: 依輸入順序排列的結果dict，包含index、status、result、error、elapsed_ms
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    workers = max(1, min(max_workers, len(items)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+        outcomes = list(executor.map(lambda item: _timed_call(func, item), items))
+
+    for index, outcome in enumerate(outcomes):
+        outcome['index'] = index
+    return outcomes
+
+
+def iter_bounded(func, items, max_workers=4, max_in_flight=None):
+    """以有限大小的執行緒池並行處理逐步產生的項目，依完成順序產生結果
+
+    與 run_bounded 不同，items 可以是產生器：只有在處理中的項目少於 max_in_flight 時
+    才會取出下一個項目，因此同時存在記憶體中的項目數量固定，與輸入總數無關。
+
+    Args:
+        func: 處理單一項目的函式，返回假值視為失敗
+        items: 要處理的項目（可迭代物件）
+        max_workers: 同時執行的最大數量
+        max_in_flight: 已取出但尚未產生結果的最大項目數（預設為 max_workers）
+
+    Yields:
+        dict: 結果dict，包含index（輸入順序）、status、result、error、elapsed_ms
+    """
+    workers = max(1, max_workers)
+    limit = max(workers, max_in_flight or workers)
+    iterator = iter(items)
+    exhausted = False
+    pending = {}
+    index = 0
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+        while True:
+            while not exhausted and len(pending) < limit:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(_timed_call, func, item)] = index
+                index += 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcome = future.result()
+                outcome['index'] = pending.pop(future)
+                yield outcome
@@ -0,0 +1,131 @@
+"""
+名片OCR與客戶開發信系統 - OCR結果快取模組
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from app.dbutil import open_sqlite
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class OCRResultCache:
+    """以圖片內容SHA-256為鍵的磁碟OCR結果快取，採LRU淘汰"""
+
+    def __init__(self, db_path, max_entries=5000, max_bytes=50 * 1024 * 1024):
+        """初始化快取
+
+        Args:
+            db_path: SQLite資料庫檔案路徑
+            max_entries: 最多保留的快取筆數
+            max_bytes: 快取內容總大小上限（位元組）
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache (last_access)'
+        )
+        self._conn.commit()
+        logger.info(f"OCR結果快取初始化成功: {db_path}")
+
+    @staticmethod
+    def make_key(content, version):
+        """由圖片內容與提示詞/模型版本產生快取鍵"""
+        digest = hashlib.sha256(content).hexdigest()
+        return f"{digest}:{version}"
+
+    def get(self, key):
+        """取得快取結果，未命中時返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM ocr_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                'UPDATE ocr_cache SET last_access = ? WHERE key = ?', (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """寫入快取結果，超過上限時淘汰最久未使用的項目"""
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ocr_cache (key, value, size, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, payload, len(payload.encode('utf-8')), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """淘汰最久未使用的項目直到符合筆數與大小上限（需持有鎖）"""
+        count, total = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache'
+        ).fetchone()
+
+        while count > self.max_entries or total > self.max_bytes:
+            row = self._conn.execute(
+                'SELECT key, size FROM ocr_cache ORDER BY last_access ASC LIMIT 1'
+            ).fetchone()
+            if row is None:
+                break
+            self._conn.execute('DELETE FROM ocr_cache WHERE key = ?', (row[0],))
+            count -= 1
+            total -= row[1]
+            self.evictions += 1
+
+    def clear(self):
+        """清除所有快取項目"""
+        with self._lock:
+            self._conn.execute('DELETE FROM ocr_cache')
+            self._conn.commit()
+
+    def stats(self):
+        """取得快取命中統計"""
+        with self._lock:
+            count, total = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache'
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': count,
+                'bytes': total,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes
+            }
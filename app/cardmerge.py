@@ -0,0 +1,115 @@
+"""
+名片OCR與客戶開發信系統 - 雙面名片合併模組
+
+台灣名片常見正面中文、背面英文。雙面辨識結果依欄位合併為一張名片，
+人名、職稱、公司名稱保留中英文兩種版本（英文版本存於 *_en 欄位）。
+"""
+import re
+from app.router import validate_email, validate_phone, validate_mobile, validate_tax_id
+
+# 保留中英文版本的欄位
+BILINGUAL_FIELDS = ('name', 'title', 'company')
+
+# 單一值欄位的格式檢查（雙面都有值時優先採用格式正確的一面）
+FIELD_VALIDATORS = {
+    'email': validate_email,
+    'phone': validate_phone,
+    'mobile': validate_mobile,
+    'tax_id': lambda value: validate_tax_id(value.strip())
+}
+
+_CJK_RE = re.compile(r'[㐀-鿿豈-﫿]')
+_LATIN_RE = re.compile(r'[A-Za-z]')
+
+
+def has_cjk(text):
+    """文字是否含有中日韓漢字"""
+    return bool(text) and _CJK_RE.search(text) is not None
+
+
+def is_latin(text):
+    """文字是否為英文（含拉丁字母且不含漢字）"""
+    return bool(text) and not has_cjk(text) and _LATIN_RE.search(text) is not None
+
+
+def _text(card, field):
+    """取得欄位的字串值（去除前後空白）"""
+    value = card.get(field)
+    return value.strip() if isinstance(value, str) else ''
+
+
+def normalize_bilingual(card):
+    """整理中英文欄位：英文值放在 *_en，中文值放在原欄位
+
+    模型有時把英文姓名放在 name、中文放在 name_en，這裡依文字種類對調。
+    """
+    card = dict(card or {})
+    for field in BILINGUAL_FIELDS:
+        english = f'{field}_en'
+        value = _text(card, field)
+        value_en = _text(card, english)
+
+        if is_latin(value) and (not value_en or has_cjk(value_en)):
+            value, value_en = value_en, value
+        card[field] = value or value_en
+        card[english] = value_en
+    return card
+
+
+def merge_card_sides(front, back):
+    """合併正反面的辨識結果
+
+    Args:
+        front: 正面的名片dict（可為None）
+        back: 背面的名片dict（可為None）
+
+    Returns:
+        dict: 合併後的名片，含 name_en、title_en、company_en；兩面皆無結果時返回None
+    """
+    if not front and not back:
+        return None
+    front = front or {}
+    back = back or {}
+    merged = {}
+
+    # 中英文欄位：依文字種類分配到中文與英文欄位
+    for field in BILINGUAL_FIELDS:
+        english = f'{field}_en'
+        candidates = [
+            _text(front, field), _text(front, english),
+            _text(back, field), _text(back, english)
+        ]
+        chinese = next((value for value in candidates if has_cjk(value)), '')
+        latin = next((value for value in candidates if is_latin(value)), '')
+        merged[field] = chinese or latin or next((value for value in candidates if value), '')
+        merged[english] = latin
+
+    # 其他欄位：只有一面有值時直接採用，兩面都有值時優先採用格式正確的一面
+    fields = [
+        key for key in list(front) + list(back)
+        if key not in merged and key != 'raw_text' and not key.endswith('_en')
+    ]
+    for field in dict.fromkeys(fields):
+        front_value = _text(front, field)
+        back_value = _text(back, field)
+        if front_value and back_value and field in FIELD_VALIDATORS:
+            if not FIELD_VALIDATORS[field](front_value) and FIELD_VALIDATORS[field](back_value):
+                front_value = back_value
+        elif front_value and back_value and has_cjk(front_value) != has_cjk(back_value):
+            # 例如正面中文地址、背面英文地址
+            chinese, latin = (front_value, back_value) if has_cjk(front_value) else (back_value, front_value)
+            merged[f'{field}_en'] = latin
+            front_value = chinese
+        merged[field] = front_value or back_value or ''
+
+    # 其餘英文欄位（例如 address_en）直接保留
+    for side in (front, back):
+        for key, value in side.items():
+            if key.endswith('_en') and value and not merged.get(key):
+                merged[key] = value
+
+    raw_texts = [side.get('raw_text') for side in (front, back) if side.get('raw_text')]
+    if raw_texts:
+        merged['raw_text'] = '\n---\n'.join(raw_texts)
+
+    return merged
@@ -0,0 +1,261 @@
+"""
+名片OCR與客戶開發信系統 - 公司分析快取模組
+
+同一家公司的多張名片（例如展場上掃描同公司的多位聯絡人）共用公司分析結果：
+有8碼統一編號時以統一編號為鍵，否則以正規化後的公司名稱為鍵。
+每筆快取有各自的有效期限；過期但仍在寬限期內的結果會直接返回，
+同時在背景重新分析（stale-while-revalidate），使用者不必等待Gemini。
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from app.dbutil import open_sqlite
+from app.ratelimit import QuotaExceeded
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 正規化公司名稱時移除的公司型態字樣
+COMPANY_SUFFIXES = ('股份有限公司', '有限責任公司', '有限公司', '公司')
+ENGLISH_SUFFIX_RE = re.compile(
+    r'[\s,.]*\b(?:co\.?,?\s*ltd|corporation|company|limited|corp|inc|ltd|llc|co)\.?$'
+)
+
+# 正規化公司名稱時移除的空白與標點
+NAME_PUNCTUATION_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def normalize_tax_id(tax_id):
+    """正規化統一編號（全形數字轉半形、移除分隔符號），不是8碼數字時返回None"""
+    digits = re.sub(r'\D', '', unicodedata.normalize('NFKC', str(tax_id or '')))
+    return digits if len(digits) == 8 else None
+
+
+def normalize_company_name(company_name):
+    """正規化公司名稱：全形轉半形、不分大小寫、臺/台視為相同，並移除公司型態字樣與標點"""
+    name = unicodedata.normalize('NFKC', company_name or '').casefold().replace('臺', '台').strip()
+    previous = None
+    while name != previous:
+        previous = name
+        name = ENGLISH_SUFFIX_RE.sub('', name).strip()
+        for suffix in COMPANY_SUFFIXES:
+            if name.endswith(suffix) and len(name) > len(suffix):
+                name = name[:-len(suffix)].strip()
+                break
+    return NAME_PUNCTUATION_RE.sub('', name)
+
+
+class CompanyAnalysisCache:
+    """以統一編號或正規化公司名稱為鍵的磁碟公司分析快取，支援過期後背景更新"""
+
+    def __init__(self, db_path, ttl=7 * 24 * 3600, stale_ttl=30 * 24 * 3600, max_entries=20000,
+                 refresh_workers=2):
+        """初始化快取
+
+        Args:
+            db_path: SQLite資料庫檔案路徑
+            ttl: 預設有效秒數（put 可為個別項目指定）
+            stale_ttl: 過期後仍可返回舊結果並在背景更新的秒數，0表示過期即重新分析
+            max_entries: 最多保留的快取筆數
+            refresh_workers: 背景更新的執行緒數
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='company-refresh')
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS company_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                fresh_until REAL NOT NULL,
+                stale_until REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_company_cache_stale_until ON company_cache (stale_until)'
+        )
+        self._conn.commit()
+        logger.info(f"公司分析快取初始化成功: {db_path}")
+
+    @staticmethod
+    def make_key(kind, company_name, tax_id, version):
+        """由分析類型、統一編號（優先）或正規化公司名稱與模型版本產生快取鍵
+
+        Returns:
+            str: 快取鍵；沒有統一編號且公司名稱正規化後為空時返回None（不快取）
+        """
+        normalized_tax_id = normalize_tax_id(tax_id)
+        if normalized_tax_id:
+            identity = f'tax:{normalized_tax_id}'
+        else:
+            name = normalize_company_name(company_name)
+            if not name:
+                return None
+            identity = f'name:{name}'
+        return f'{kind}:{version}:{identity}'
+
+    def get(self, key):
+        """取得快取結果
+
+        Returns:
+            tuple: (結果, 狀態)，狀態為 fresh、stale 或 miss（miss 時結果為None）
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, fresh_until, stale_until FROM company_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or row[2] <= now:
+                self.misses += 1
+                return None, 'miss'
+            if row[1] > now:
+                self.hits += 1
+                state = 'fresh'
+            else:
+                self.stale_hits += 1
+                state = 'stale'
+
+        return json.loads(row[0]), state
+
+    def put(self, key, value, ttl=None):
+        """寫入快取結果（ttl 為此項目的有效秒數），超過筆數上限時淘汰最早過期的項目"""
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        fresh_until = now + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO company_cache (key, value, size, created_at, fresh_until, stale_until) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, payload, len(payload.encode('utf-8')), now, fresh_until, fresh_until + self.stale_ttl)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """清除寬限期已過的項目，並淘汰最早過期的項目直到符合筆數上限（需持有鎖）"""
+        cursor = self._conn.execute('DELETE FROM company_cache WHERE stale_until <= ?', (now,))
+        self.evictions += max(cursor.rowcount, 0)
+
+        count = self._conn.execute('SELECT COUNT(*) FROM company_cache').fetchone()[0]
+        if count > self.max_entries:
+            cursor = self._conn.execute(
+                'DELETE FROM company_cache WHERE key IN '
+                '(SELECT key FROM company_cache ORDER BY stale_until ASC LIMIT ?)',
+                (count - self.max_entries,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def fetch(self, key, compute, *args):
+        """取得快取結果，未命中時呼叫 compute(*args) 並寫入快取
+
+        過期但仍在寬限期內的結果直接返回，並在背景以 compute 更新。
+        compute 拋出的例外直接傳給呼叫端（失敗的結果不寫入快取）。
+        """
+        if key is None:
+            return compute(*args)
+        value, state = self.get(key)
+        if state == 'stale':
+            self.revalidate(key, compute, *args)
+        if state != 'miss':
+            return value
+
+        value = compute(*args)
+        self.put(key, value)
+        return value
+
+    async def fetch_async(self, key, compute_async, compute, *args):
+        """fetch 的非同步版本：未命中時等待 compute_async(*args)，背景更新使用 compute"""
+        if key is None:
+            return await compute_async(*args)
+        value, state = await asyncio.to_thread(self.get, key)
+        if state == 'stale':
+            self.revalidate(key, compute, *args)
+        if state != 'miss':
+            return value
+
+        value = await compute_async(*args)
+        await asyncio.to_thread(self.put, key, value)
+        return value
+
+    def revalidate(self, key, compute, *args):
+        """在背景重新計算並更新快取（同一個鍵同時只有一個更新）"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key, compute, *args)
+
+    def _refresh(self, key, compute, *args):
+        try:
+            value = compute(*args)
+            self.put(key, value)
+            with self._lock:
+                self.refreshes += 1
+            logger.info(f"已在背景更新公司分析快取: {key}")
+        except QuotaExceeded as e:
+            # 配額不足時保留舊結果，下次命中時再嘗試
+            with self._lock:
+                self.refresh_failures += 1
+            logger.warning(f"背景更新公司分析快取延後: {key}, {str(e)}")
+        except Exception as e:
+            with self._lock:
+                self.refresh_failures += 1
+            logger.error(f"背景更新公司分析快取失敗: {key}, {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear(self):
+        """清除所有快取項目"""
+        with self._lock:
+            self._conn.execute('DELETE FROM company_cache')
+            self._conn.commit()
+
+    def stats(self):
+        """取得快取命中統計（過期但在寬限期內返回的結果也計入命中率）"""
+        now = time.time()
+        with self._lock:
+            count, total, fresh = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(fresh_until > ?), 0) FROM company_cache',
+                (now,)
+            ).fetchone()
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+                'refreshes': self.refreshes,
+                'refresh_failures': self.refresh_failures,
+                'refreshing': len(self._refreshing),
+                'evictions': self.evictions,
+                'entries': count,
+                'fresh_entries': fresh,
+                'bytes': total,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'max_entries': self.max_entries
+            }
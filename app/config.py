@@ -12,6 +12,12 @@ DEBUG = os.environ.get('DEBUG', 'True') == 'True'
 FLASK_ENV = os.environ.get('FLASK_ENV', 'development')
 SECRET_KEY = os.environ.get('SECRET_KEY', 'dev_secret_key')
 
+# 執行期資料目錄（與Flask的instance資料夾相同）
+INSTANCE_PATH = os.environ.get(
+    'INSTANCE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance')
+)
+
 # Google API 配置
 GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
 GOOGLE_CLOUD_PROJECT = os.environ.get('GOOGLE_CLOUD_PROJECT')
@@ -33,4 +39,130 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
 # Google Sheets 配置
 GOOGLE_SHEET_ID = os.environ.get('GOOGLE_SHEET_ID')
-GOOGLE_SHEET_RANGE = os.environ.get('GOOGLE_SHEET_RANGE', 'Sheet1!A:Z') 
+GOOGLE_SHEET_RANGE = os.environ.get('GOOGLE_SHEET_RANGE', 'Sheet1!A:Z')
+
+# OCR結果快取配置
+OCR_CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', 'True') == 'True'
+OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', os.path.join(INSTANCE_PATH, 'ocr_cache.sqlite3'))
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get('OCR_CACHE_MAX_ENTRIES', 5000))
+OCR_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', 50 * 1024 * 1024))  # 50MB
+
+# OCR圖片前處理配置（縮放與重新編碼以減少上傳量）
+OCR_PREPROCESS_ENABLED = os.environ.get('OCR_PREPROCESS_ENABLED', 'True') == 'True'
+OCR_MAX_EDGE = int(os.environ.get('OCR_MAX_EDGE', 1600))
+OCR_GRAYSCALE = os.environ.get('OCR_GRAYSCALE', 'False') == 'True'
+OCR_IMAGE_FORMAT = os.environ.get('OCR_IMAGE_FORMAT', 'JPEG')  # JPEG 或 WEBP
+OCR_IMAGE_QUALITY = int(os.environ.get('OCR_IMAGE_QUALITY', 85))
+OCR_DESKEW_ENABLED = os.environ.get('OCR_DESKEW_ENABLED', 'True') == 'True'  # 校正傾斜
+OCR_CROP_ENABLED = os.environ.get('OCR_CROP_ENABLED', 'True') == 'True'  # 裁切到名片邊界
+OCR_DESKEW_MAX_ANGLE = float(os.environ.get('OCR_DESKEW_MAX_ANGLE', 15.0))
+OCR_GEOMETRY_HOLDOUT = float(os.environ.get('OCR_GEOMETRY_HOLDOUT', 0.0))  # 略過校正與裁切的對照組比例
+
+# 批次OCR配置
+OCR_BATCH_MAX_WORKERS = int(os.environ.get('OCR_BATCH_MAX_WORKERS', 4))
+OCR_BATCH_MAX_ITEMS = int(os.environ.get('OCR_BATCH_MAX_ITEMS', 200))
+
+# 多張名片切割配置
+OCR_SEGMENT_MIN_AREA = float(os.environ.get('OCR_SEGMENT_MIN_AREA', 0.01))  # 名片最小面積佔比
+OCR_SEGMENT_MAX_CARDS = int(os.environ.get('OCR_SEGMENT_MAX_CARDS', 20))
+
+# OCR對沖請求配置（Gemini延遲過長時並行啟動Vision API）
+OCR_HEDGE_ENABLED = os.environ.get('OCR_HEDGE_ENABLED', 'False') == 'True'
+OCR_HEDGE_PERCENTILE = float(os.environ.get('OCR_HEDGE_PERCENTILE', 95))
+OCR_HEDGE_MIN_SAMPLES = int(os.environ.get('OCR_HEDGE_MIN_SAMPLES', 20))
+OCR_HEDGE_DELAY_SECONDS = float(os.environ.get('OCR_HEDGE_DELAY_SECONDS', 8.0))  # 樣本不足時的預設等待秒數
+OCR_HEDGE_MAX_WORKERS = int(os.environ.get('OCR_HEDGE_MAX_WORKERS', 16))
+
+# OCR分級路由配置（Vision擷取結果信心足夠時略過Gemini）
+OCR_ROUTER_ENABLED = os.environ.get('OCR_ROUTER_ENABLED', 'False') == 'True'
+OCR_ROUTER_THRESHOLD = float(os.environ.get('OCR_ROUTER_THRESHOLD', 0.8))
+OCR_ROUTER_ESCALATION = os.environ.get('OCR_ROUTER_ESCALATION', 'missing')  # missing：只補缺少欄位；full：完整重新擷取
+
+# 啟動配置（API客戶端延遲初始化，可選擇在背景預熱）
+WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', 'False') == 'True'
+WARMUP_INSTANCES = os.environ.get('WARMUP_INSTANCES', 'card_ocr,company_analyzer,sheets_processor')
+
+# 非同步OCR工作佇列配置
+OCR_JOBS_DB_PATH = os.environ.get('OCR_JOBS_DB_PATH', os.path.join(INSTANCE_PATH, 'jobs.sqlite3'))
+OCR_JOBS_WORKERS = int(os.environ.get('OCR_JOBS_WORKERS', 2))
+OCR_JOBS_MAX_ATTEMPTS = int(os.environ.get('OCR_JOBS_MAX_ATTEMPTS', 3))  # 最多嘗試次數（執行中斷也計入）
+OCR_JOBS_LEASE_SECONDS = float(os.environ.get('OCR_JOBS_LEASE_SECONDS', 60))  # 工作租約秒數，執行中以心跳延長，過期後由其他行程回收
+OCR_JOBS_RETENTION = int(os.environ.get('OCR_JOBS_RETENTION', 7 * 24 * 3600))  # 已完成工作的保留秒數
+OCR_JOBS_RETRY_BASE_SECONDS = float(os.environ.get('OCR_JOBS_RETRY_BASE_SECONDS', 5))  # 工作發生錯誤後第一次重試的等候秒數，之後每次加倍
+OCR_JOBS_RETRY_MAX_SECONDS = float(os.environ.get('OCR_JOBS_RETRY_MAX_SECONDS', 300))  # 重試等候秒數上限（配額不足時依建議的等候秒數）
+OCR_JOBS_AUTOSTART = os.environ.get('OCR_JOBS_AUTOSTART', 'True') == 'True'  # 啟動時回收租約過期的工作
+
+# 名片重複偵測配置（選用：感知雜湊相近且文字區域相同的名片沿用先前的辨識結果）
+OCR_DEDUP_ENABLED = os.environ.get('OCR_DEDUP_ENABLED', 'False') == 'True'
+OCR_DEDUP_PATH = os.environ.get('OCR_DEDUP_PATH', os.path.join(INSTANCE_PATH, 'card_hashes.sqlite3'))
+OCR_DEDUP_THRESHOLD = int(os.environ.get('OCR_DEDUP_THRESHOLD', 4))  # 列為候選的255位元pHash最大漢明距離
+OCR_DEDUP_CONFIRM_THRESHOLD = float(os.environ.get('OCR_DEDUP_CONFIRM_THRESHOLD', 0.25))  # 確認為同一張名片的最大文字區域墨跡差異
+OCR_DEDUP_MAX_ENTRIES = int(os.environ.get('OCR_DEDUP_MAX_ENTRIES', 20000))
+
+# 雙面名片OCR配置（single：正反面同一次Gemini呼叫；concurrent：並行辨識後依欄位合併）
+OCR_PAIR_MODE = os.environ.get('OCR_PAIR_MODE', 'single')
+
+# OCR後端配置（依序嘗試，逗號分隔：gemini、vision、stub）
+OCR_BACKENDS = [
+    name.strip() for name in os.environ.get('OCR_BACKENDS', 'gemini,vision').split(',') if name.strip()
+]
+# 重播後端（stub）配置：離線壓力測試與基準測試使用錄製的回應
+OCR_STUB_RECORDINGS = os.environ.get('OCR_STUB_RECORDINGS', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'data', 'ocr_recordings.jsonl'
+))
+OCR_STUB_LATENCY = os.environ.get('OCR_STUB_LATENCY', 'lognormal:900:0.35')  # fixed:ms、uniform:ms:ms、lognormal:中位數ms:sigma、recorded
+OCR_STUB_ERROR_RATE = float(os.environ.get('OCR_STUB_ERROR_RATE', 0.0))
+OCR_STUB_SEED = int(os.environ.get('OCR_STUB_SEED', 0))
+OCR_RECORD_RESPONSES_PATH = os.environ.get('OCR_RECORD_RESPONSES_PATH')  # 設定時將Gemini回應附加到此JSONL檔，供重播後端使用
+
+# 單一請求上傳＋OCR配置（圖片只保存在記憶體）
+OCR_UPLOAD_MAX_BYTES = int(os.environ.get('OCR_UPLOAD_MAX_BYTES', MAX_CONTENT_LENGTH))  # 單一檔案上限
+OCR_UPLOAD_SAVE = os.environ.get('OCR_UPLOAD_SAVE', 'True') == 'True'  # 是否在背景保存原始圖片
+OCR_UPLOAD_FOLDER = os.environ.get('OCR_UPLOAD_FOLDER', os.path.join(INSTANCE_PATH, 'uploads'))
+
+# 上傳儲存配置（以內容SHA-256定址，OCR_UPLOAD_FOLDER 為本機儲存根目錄）
+OCR_STORAGE_BACKEND = os.environ.get('OCR_STORAGE_BACKEND', 'local')
+OCR_STORAGE_SHARD_DEPTH = int(os.environ.get('OCR_STORAGE_SHARD_DEPTH', 2))
+OCR_STORAGE_TTL = int(os.environ.get('OCR_STORAGE_TTL', 7 * 24 * 3600))  # 最後存取後保留秒數，0表示不依時間回收
+OCR_STORAGE_MAX_BYTES = int(os.environ.get('OCR_STORAGE_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 0表示不限制
+OCR_STORAGE_GC_INTERVAL = int(os.environ.get('OCR_STORAGE_GC_INTERVAL', 3600))  # 背景回收間隔秒數，0表示停用
+
+# 大量匯入配置（ZIP壓縮檔與多頁PDF）
+OCR_INGEST_MAX_ITEMS = int(os.environ.get('OCR_INGEST_MAX_ITEMS', 2000))  # 單一檔案最多處理的名片數
+OCR_INGEST_PDF_DPI = int(os.environ.get('OCR_INGEST_PDF_DPI', 200))  # PDF頁面點陣化解析度（需安裝 pypdfium2）
+OCR_INGEST_MAX_PDF_BYTES = int(os.environ.get('OCR_INGEST_MAX_PDF_BYTES', MAX_CONTENT_LENGTH))  # ZIP內單一PDF解壓縮後的大小上限
+
+# ASGI非同步服務模式配置（python -m app.asgi）
+ASGI_HOST = os.environ.get('ASGI_HOST', os.environ.get('HOST', '0.0.0.0'))
+ASGI_PORT = int(os.environ.get('ASGI_PORT', os.environ.get('PORT', 5000)))
+ASGI_MAX_IN_FLIGHT = int(os.environ.get('ASGI_MAX_IN_FLIGHT', 512))  # 同時處理的非同步請求上限，超過時排隊等候
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))  # 交給Flask處理的其他路由使用的執行緒數
+ASGI_MAX_JSON_BYTES = int(os.environ.get('ASGI_MAX_JSON_BYTES', 1024 * 1024))  # 非同步路由的JSON請求本文上限
+
+# Gemini限流配置（OCR與公司分析共用；0表示不限制）
+GEMINI_RPM = int(os.environ.get('GEMINI_RPM', 1000))  # 每分鐘請求數
+GEMINI_TPM = int(os.environ.get('GEMINI_TPM', 1000000))  # 每分鐘token數（輸入預估＋GEMINI_OUTPUT_TOKENS）
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 32))  # 同時進行中的呼叫數
+GEMINI_MAX_QUEUE = int(os.environ.get('GEMINI_MAX_QUEUE', 256))  # 等候佇列長度，超過時返回429
+GEMINI_MAX_WAIT_SECONDS = float(os.environ.get('GEMINI_MAX_WAIT_SECONDS', 30))  # 最長等候秒數，逾時返回429
+GEMINI_OUTPUT_TOKENS = int(os.environ.get('GEMINI_OUTPUT_TOKENS', 1024))  # 每次呼叫預估的輸出token數
+GEMINI_QUOTA_COOLDOWN_SECONDS = float(os.environ.get('GEMINI_QUOTA_COOLDOWN_SECONDS', 10))  # API回報配額用盡後暫停放行的秒數
+
+# 冪等鍵配置（Idempotency-Key 標頭：重送的請求直接返回第一次的回應）
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'True') == 'True'
+IDEMPOTENCY_DB_PATH = os.environ.get('IDEMPOTENCY_DB_PATH', os.path.join(INSTANCE_PATH, 'idempotency.sqlite3'))
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))  # 回應保留秒數
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+IDEMPOTENCY_MAX_BYTES = int(os.environ.get('IDEMPOTENCY_MAX_BYTES', 20 * 1024 * 1024))  # 20MB
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 90))  # 重複請求等候第一個請求的最長秒數，逾時返回409
+IDEMPOTENCY_PENDING_TTL = int(os.environ.get('IDEMPOTENCY_PENDING_TTL', 300))  # 處理中的鍵逾期後可由新請求接手（行程中斷時）
+
+# 一次完成的處理流程配置（/api/pipeline：OCR後並行分析並產生開發信）
+PIPELINE_MAX_WORKERS = int(os.environ.get('PIPELINE_MAX_WORKERS', 16))  # OCR之後的階段共用的執行緒數
+
+# 公司分析快取配置（有8碼統一編號時以統一編號為鍵，否則以正規化的公司名稱為鍵）
+COMPANY_CACHE_ENABLED = os.environ.get('COMPANY_CACHE_ENABLED', 'True') == 'True'
+COMPANY_CACHE_PATH = os.environ.get('COMPANY_CACHE_PATH', os.path.join(INSTANCE_PATH, 'company_cache.sqlite3'))
+COMPANY_CACHE_TTL = int(os.environ.get('COMPANY_CACHE_TTL', 7 * 24 * 3600))  # 分析結果的有效秒數
+COMPANY_CACHE_STALE_TTL = int(os.environ.get('COMPANY_CACHE_STALE_TTL', 30 * 24 * 3600))  # 過期後仍先返回舊結果並在背景更新的秒數
+COMPANY_CACHE_MAX_ENTRIES = int(os.environ.get('COMPANY_CACHE_MAX_ENTRIES', 20000))
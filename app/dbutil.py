@@ -0,0 +1,24 @@
+"""
+名片OCR與客戶開發信系統 - SQLite輔助模組
+"""
+import os
+import sqlite3
+
+
+def open_sqlite(db_path):
+    """開啟可跨執行緒共用的SQLite連線（WAL模式）
+
+    Args:
+        db_path: 資料庫檔案路徑，會自動建立所在目錄
+
+    Returns:
+        sqlite3.Connection: 已設定WAL與同步模式的連線，呼叫端需自行加鎖
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
@@ -0,0 +1,334 @@
+"""
+名片OCR與客戶開發信系統 - 名片感知雜湊重複偵測模組
+
+同一張名片換個背景或光線重拍時，圖片位元組不同而無法命中OCR結果快取。
+這裡以感知雜湊（pHash）描述名片外觀，並以BK樹依漢明距離搜尋相近的名片。
+
+pHash只保留低頻的版面資訊：同一公司樣板、不同人的名片（姓名、電話、Email不同）
+可能只差十幾個位元。因此雜湊相近的名片只是候選，還需比對文字區域的墨跡分佈
+（見 ink_map）：逐區塊比較，任一區塊差異超過門檻即視為不同的名片，重新辨識。
+"""
+import io
+import json
+import logging
+import threading
+import time
+import zlib
+import numpy as np
+from PIL import Image, ImageOps
+from app.dbutil import open_sqlite
+from app.segment import find_card_boxes
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def hamming(a, b):
+    """兩個雜湊值的漢明距離"""
+    return bin(a ^ b).count('1')
+
+
+def _dct_matrix(size):
+    """DCT-II轉換矩陣"""
+    k = np.arange(size)
+    return np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+
+
+# 預先計算的DCT轉換矩陣
+DCT_SIZE = 64
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def _card_image(content):
+    """裁切到照片中最大的名片外框並拉伸對比的灰階圖片（消除取景與光線差異）"""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(content))).convert('RGB')
+
+    boxes = find_card_boxes(image, min_area=0.1, max_cards=4)
+    if boxes:
+        image = image.crop(max(boxes, key=lambda box: (box[2] - box[0]) * (box[3] - box[1])))
+
+    return ImageOps.autocontrast(image.convert('L'), cutoff=1)
+
+
+def phash(content, hash_size=16, gray=None):
+    """計算圖片的感知雜湊（pHash）
+
+    先裁切到照片中最大的名片外框以消除取景差異，並拉伸對比以消除光線差異；
+    再縮小為灰階 64x64，取二維DCT左上角 hash_size x hash_size 的低頻係數
+    （略過直流分量），與中位數比較得到各位元。
+
+    Args:
+        content: 圖片位元組
+        hash_size: 低頻係數區塊邊長，雜湊共 hash_size*hash_size-1 位元
+        gray: 已由 _card_image 處理的圖片（選填，避免重複解碼）
+
+    Returns:
+        int: 雜湊值
+    """
+    gray = gray if gray is not None else _card_image(content)
+    pixels = np.asarray(gray.resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:hash_size, :hash_size].flatten()[1:]
+    bits = coefficients > np.median(coefficients)
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+# 墨跡分佈的格數（寬x高，約為名片比例）與每格邊長（像素）
+INK_COLS = 128
+INK_ROWS = 72
+INK_CELL = 4
+
+# 比對墨跡分佈的區塊大小（格）與允許的整體位移（格）
+INK_BLOCK = 8
+INK_SHIFT = 2
+
+
+def ink_map(content, gray=None):
+    """計算名片的墨跡分佈：每格中深色像素的數量（0到 INK_CELL**2）
+
+    與pHash不同，格子夠細，可以分辨姓名、電話或Email等單行文字的差異。
+
+    Returns:
+        numpy.ndarray: INK_ROWS x INK_COLS 的uint8陣列
+    """
+    gray = gray if gray is not None else _card_image(content)
+    pixels = np.asarray(gray.resize((INK_COLS * INK_CELL, INK_ROWS * INK_CELL), Image.BOX))
+    ink = (pixels < 128).reshape(INK_ROWS, INK_CELL, INK_COLS, INK_CELL)
+    return ink.sum(axis=(1, 3)).astype(np.uint8)
+
+
+def ink_distance(a, b):
+    """兩個墨跡分佈的差異（0到1）
+
+    先在 ±INK_SHIFT 格內找出整體差異最小的對齊位置，再逐區塊計算
+    |a-b| / (a+b)，返回差異最大的區塊的值：只有一行文字不同時整體差異很小，
+    但該行所在的區塊差異很大。
+    """
+    a = a.astype(np.int32)
+    b = b.astype(np.int32)
+    rows, cols = a.shape
+    best = None
+    for dy in range(-INK_SHIFT, INK_SHIFT + 1):
+        for dx in range(-INK_SHIFT, INK_SHIFT + 1):
+            sa = a[max(dy, 0):rows + min(dy, 0), max(dx, 0):cols + min(dx, 0)]
+            sb = b[max(-dy, 0):rows + min(-dy, 0), max(-dx, 0):cols + min(-dx, 0)]
+            total = int(np.abs(sa - sb).sum())
+            if best is None or total < best[0]:
+                best = (total, sa, sb)
+
+    _, sa, sb = best
+    worst = 0.0
+    for row in range(0, sa.shape[0], INK_BLOCK):
+        for col in range(0, sa.shape[1], INK_BLOCK):
+            x = sa[row:row + INK_BLOCK, col:col + INK_BLOCK]
+            y = sb[row:row + INK_BLOCK, col:col + INK_BLOCK]
+            ink = int((x + y).sum())
+            # 幾乎空白的區塊不列入比較
+            if ink < INK_CELL * INK_CELL * 2:
+                continue
+            worst = max(worst, int(np.abs(x - y).sum()) / ink)
+    return worst
+
+
+class BKTree:
+    """以漢明距離建立的BK樹，支援半徑內的近鄰搜尋"""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, value):
+        """加入一個雜湊值與對應資料"""
+        self._size += 1
+        if self._root is None:
+            self._root = (key, value, {})
+            return
+
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, value, {})
+                return
+            node = child
+
+    def search(self, key, radius):
+        """搜尋漢明距離不超過radius的所有項目
+
+        Returns:
+            list: [(距離, 資料), ...]，依距離由小到大排序
+        """
+        if self._root is None:
+            return []
+
+        found = []
+        stack = [self._root]
+        while stack:
+            node_key, value, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= radius:
+                found.append((distance, value))
+            # 三角不等式：只有距離在 [d-r, d+r] 的子樹可能包含結果
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class DuplicateIndex:
+    """持久化的名片重複偵測索引（SQLite保存，記憶體中以BK樹搜尋）"""
+
+    def __init__(self, db_path, version, threshold=4, confirm_threshold=0.25, hash_size=16,
+                 max_entries=20000, max_candidates=5):
+        """初始化索引並載入同版本的既有項目
+
+        Args:
+            db_path: SQLite資料庫檔案路徑
+            version: 辨識結果版本（模型或提示詞變更時舊項目不再使用）
+            threshold: 列為候選的最大pHash漢明距離
+            confirm_threshold: 確認為同一張名片的最大墨跡分佈差異（見 ink_distance）
+            hash_size: pHash低頻係數區塊邊長
+            max_entries: 最多保留的項目數，超過時淘汰最舊的項目
+            max_candidates: 每次查詢最多確認的候選數
+        """
+        self.db_path = db_path
+        self.version = version
+        self.threshold = threshold
+        self.confirm_threshold = confirm_threshold
+        self.hash_size = hash_size
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self.lookups = 0
+        self.candidates = 0
+        self.rejected = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS card_hashes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hash TEXT NOT NULL,
+                version TEXT NOT NULL,
+                source TEXT,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(card_hashes)')}
+        if 'ink' not in columns:
+            # 舊版索引沒有墨跡分佈，這些項目無法確認，不會再被沿用
+            self._conn.execute('ALTER TABLE card_hashes ADD COLUMN ink BLOB')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_card_hashes_version ON card_hashes (version, id)')
+        self._conn.commit()
+        self._rebuild()
+
+    def _rebuild(self):
+        """由資料庫重建BK樹（略過沒有墨跡分佈的舊項目）"""
+        tree = BKTree()
+        rows = self._conn.execute(
+            'SELECT id, hash FROM card_hashes WHERE version = ? AND ink IS NOT NULL ORDER BY id', (self.version,)
+        ).fetchall()
+        for row_id, key in rows:
+            tree.add(int(key, 16), row_id)
+        self._tree = tree
+        logger.info(f"名片重複偵測索引已載入 {len(tree)} 筆")
+
+    def hash_image(self, content):
+        """計算圖片的簽章
+
+        Returns:
+            tuple: (pHash值, 墨跡分佈)
+        """
+        gray = _card_image(content)
+        return phash(content, hash_size=self.hash_size, gray=gray), ink_map(content, gray=gray)
+
+    def lookup(self, signature):
+        """搜尋同一張名片的已辨識結果
+
+        pHash距離在門檻內的項目只是候選，依距離由近到遠比對墨跡分佈，
+        第一個差異在 confirm_threshold 內的候選才視為重複。
+
+        Args:
+            signature: hash_image 返回的簽章
+
+        Returns:
+            dict: 包含distance、ink_distance、source與result，找不到時返回None
+        """
+        key, ink = signature
+        with self._lock:
+            self.lookups += 1
+            matches = self._tree.search(key, self.threshold)[:self.max_candidates]
+            for distance, row_id in matches:
+                row = self._conn.execute(
+                    'SELECT source, result, ink FROM card_hashes WHERE id = ?', (row_id,)
+                ).fetchone()
+                if row is None or row[2] is None:
+                    continue
+
+                self.candidates += 1
+                stored = np.frombuffer(zlib.decompress(row[2]), dtype=np.uint8).reshape(INK_ROWS, INK_COLS)
+                difference = ink_distance(ink, stored)
+                if difference > self.confirm_threshold:
+                    self.rejected += 1
+                    logger.info(f"相近名片的文字區域不同，不沿用: {row[0]}（差異 {difference:.3f}）")
+                    continue
+
+                self.hits += 1
+                return {
+                    'distance': distance,
+                    'ink_distance': round(difference, 4),
+                    'source': row[0],
+                    'result': json.loads(row[1])
+                }
+            return None
+
+    def add(self, signature, result, source=None):
+        """加入新辨識的名片"""
+        key, ink = signature
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO card_hashes (hash, version, source, result, created_at, ink) VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    format(key, 'x'), self.version, source, json.dumps(result, ensure_ascii=False), time.time(),
+                    zlib.compress(np.ascontiguousarray(ink, dtype=np.uint8).tobytes())
+                )
+            )
+            self._conn.commit()
+            self._tree.add(key, cursor.lastrowid)
+
+            # 超過上限時一次淘汰約一成最舊的項目並重建BK樹
+            if len(self._tree) > self.max_entries:
+                keep = int(self.max_entries * 0.9)
+                self._conn.execute(
+                    """
+                    DELETE FROM card_hashes WHERE id NOT IN (
+                        SELECT id FROM card_hashes WHERE version = ? ORDER BY id DESC LIMIT ?
+                    )
+                    """,
+                    (self.version, keep)
+                )
+                self._conn.commit()
+                self._rebuild()
+
+    def stats(self):
+        """取得重複偵測統計"""
+        with self._lock:
+            return {
+                'lookups': self.lookups,
+                'candidates': self.candidates,
+                'rejected': self.rejected,
+                'hits': self.hits,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'entries': len(self._tree),
+                'threshold': self.threshold,
+                'confirm_threshold': self.confirm_threshold,
+                'hash_bits': self.hash_size * self.hash_size - 1
+            }
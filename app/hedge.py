@@ -0,0 +1,92 @@
+"""
+名片OCR與客戶開發信系統 - 對沖請求（Hedged Request）統計模組
+"""
+import threading
+from collections import deque
+
+
+def percentile(values, pct):
+    """計算百分位數（最近秩法），無資料時返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class LatencyTracker:
+    """記錄最近N次延遲，用於估計對沖觸發時間"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms):
+        """記錄一次延遲（毫秒）"""
+        with self._lock:
+            self._samples.append(latency_ms)
+
+    def count(self):
+        """目前保留的樣本數"""
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, pct):
+        """取得延遲百分位數（毫秒）"""
+        with self._lock:
+            return percentile(list(self._samples), pct)
+
+
+class HedgeStats:
+    """對沖請求的觸發率、勝出來源與尾端延遲改善統計"""
+
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.hedged = 0
+        self.wins = {}
+        self._latencies = deque(maxlen=window)
+        self._savings = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_request(self, latency_ms, hedged, winner):
+        """記錄一次OCR請求的結果
+
+        Args:
+            latency_ms: 端對端延遲（毫秒）
+            hedged: 是否觸發了對沖請求
+            winner: 採用結果的來源（gemini、vision或None）
+        """
+        with self._lock:
+            self.requests += 1
+            if hedged:
+                self.hedged += 1
+            key = winner or 'none'
+            self.wins[key] = self.wins.get(key, 0) + 1
+            self._latencies.append(round(latency_ms, 2))
+
+    def record_saving(self, saved_ms):
+        """記錄對沖勝出時，相較等待主要請求所節省的時間（毫秒）"""
+        with self._lock:
+            self._savings.append(round(saved_ms, 2))
+
+    def snapshot(self):
+        """取得統計摘要"""
+        with self._lock:
+            latencies = list(self._latencies)
+            savings = list(self._savings)
+            return {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_rate': round(self.hedged / self.requests, 4) if self.requests else 0.0,
+                'wins': dict(self.wins),
+                'latency_ms': {
+                    'p50': percentile(latencies, 50),
+                    'p95': percentile(latencies, 95),
+                    'p99': percentile(latencies, 99)
+                },
+                'saved_ms': {
+                    'count': len(savings),
+                    'mean': round(sum(savings) / len(savings), 2) if savings else None,
+                    'p95': percentile(savings, 95)
+                }
+            }
@@ -0,0 +1,396 @@
+"""
+名片OCR與客戶開發信系統 - 冪等鍵模組
+
+客戶端以 Idempotency-Key 標頭重送同一個請求（逾時重試、重複點擊、Streamlit重新執行）時，
+直接返回第一次的回應，不再重複呼叫Gemini或重複寄信：
+- 已完成的回應保存在SQLite（筆數與大小有上限，逾期自動清除），重播時附上 Idempotent-Replayed 標頭；
+- 第一個請求仍在處理中時，重複的請求等候其結果，而不是再發起一次呼叫；
+- 同一個鍵搭配不同的請求內容返回422。
+
+429與5xx回應不保存（等候中的重複請求仍共用該結果），客戶端稍後以同一個鍵重試時會重新處理。
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from flask import current_app, jsonify, request
+from app.dbutil import open_sqlite
+from app.lazy import LazyInstance
+from app.metrics import idempotency_requests
+from app.config import (
+    IDEMPOTENCY_ENABLED, IDEMPOTENCY_DB_PATH, IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_ENTRIES,
+    IDEMPOTENCY_MAX_BYTES, IDEMPOTENCY_WAIT_SECONDS, IDEMPOTENCY_PENDING_TTL
+)
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 冪等鍵的最大長度
+MAX_KEY_LENGTH = 255
+
+# 等候其他行程處理中的請求時的輪詢間隔（秒）
+POLL_INTERVAL = 0.1
+
+# 等候逾時（409）時建議的重試秒數
+IN_PROGRESS_RETRY_AFTER = 5
+
+# 重播的回應附加的標頭
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class IdempotencyError(Exception):
+    """冪等鍵無法使用（status_code 為返回給客戶端的狀態碼）"""
+    status_code = 400
+    reason = 'invalid_key'
+    retry_after = None
+
+
+class InvalidIdempotencyKey(IdempotencyError):
+    """冪等鍵格式錯誤"""
+
+    def __init__(self):
+        super().__init__(f'Idempotency-Key 需為1到{MAX_KEY_LENGTH}個字元')
+
+
+class IdempotencyMismatch(IdempotencyError):
+    """同一個鍵已用於內容不同的請求"""
+    status_code = 422
+    reason = 'mismatch'
+
+    def __init__(self):
+        super().__init__('Idempotency-Key 已用於內容不同的請求')
+
+
+class IdempotencyInProgress(IdempotencyError):
+    """等候逾時：同一個鍵的請求仍在處理中"""
+    status_code = 409
+    reason = 'in_progress'
+
+    def __init__(self, retry_after):
+        super().__init__('相同 Idempotency-Key 的請求仍在處理中')
+        self.retry_after = retry_after
+
+
+def request_fingerprint(method, path, body):
+    """由請求方法、路徑與本文產生指紋（JSON本文先正規化，鍵的順序不影響結果）"""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode('utf-8')
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f'{method} {path}\n'.encode('utf-8'))
+    digest.update(body or b'')
+    return digest.hexdigest()
+
+
+def scoped_key(endpoint, key):
+    """以端點區隔冪等鍵；鍵格式錯誤時拋出 InvalidIdempotencyKey"""
+    key = (key or '').strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise InvalidIdempotencyKey()
+    return f'{endpoint}:{key}'
+
+
+def should_store(status_code):
+    """是否保存此狀態碼的回應（限流、衝突與伺服器錯誤可稍後重試）"""
+    return status_code < 500 and status_code not in (408, 409, 429)
+
+
+class IdempotencyStore:
+    """以SQLite保存冪等鍵與回應，並協調處理中的重複請求"""
+
+    def __init__(self, db_path, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES,
+                 max_bytes=IDEMPOTENCY_MAX_BYTES, wait_seconds=IDEMPOTENCY_WAIT_SECONDS,
+                 pending_ttl=IDEMPOTENCY_PENDING_TTL):
+        """初始化冪等鍵儲存
+
+        Args:
+            db_path: SQLite資料庫檔案路徑（多個行程可共用）
+            ttl: 已完成的回應保留秒數
+            max_entries: 最多保留的回應筆數
+            max_bytes: 回應內容總大小上限（位元組）
+            wait_seconds: 重複請求等候第一個請求完成的最長秒數
+            pending_ttl: 處理中的鍵的保留秒數（行程中斷時，逾期後由下一個請求接手）
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.wait_seconds = wait_seconds
+        self.pending_ttl = pending_ttl
+
+        self.started = 0
+        self.replayed = 0
+        self.joined = 0
+        self.mismatches = 0
+        self.timeouts = 0
+        self.stored = 0
+        self.evictions = 0
+
+        # 本行程處理中的鍵：{鍵: {'event': threading.Event, 'record': 回應或None}}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                state TEXT NOT NULL,
+                status_code INTEGER,
+                content_type TEXT,
+                body BLOB,
+                size INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_idempotency_expires_at ON idempotency_keys (expires_at)'
+        )
+        self._conn.commit()
+        logger.info(f"冪等鍵儲存初始化成功: {db_path}")
+
+    def _claim(self, key, fingerprint):
+        """嘗試取得鍵的處理權
+
+        Returns:
+            tuple: ('owner', 擁有者代碼)、('replay', 回應) 或 ('pending', 本行程的處理中項目或None)
+        """
+        now = time.time()
+        owner = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM idempotency_keys WHERE key = ? AND expires_at <= ?', (key, now)
+            )
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, owner, state, created_at, expires_at) '
+                "VALUES (?, ?, ?, 'pending', ?, ?)",
+                (key, fingerprint, owner, now, now + self.pending_ttl)
+            )
+            self._conn.commit()
+            if cursor.rowcount == 1:
+                self._inflight[key] = {'event': threading.Event(), 'record': None}
+                self.started += 1
+                return 'owner', owner
+
+            row = self._conn.execute(
+                'SELECT fingerprint, state, status_code, content_type, body FROM idempotency_keys WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None:
+                # 已被其他行程刪除，下一輪重新嘗試
+                return 'pending', None
+            if row[0] != fingerprint:
+                self.mismatches += 1
+                raise IdempotencyMismatch()
+            if row[1] == 'done':
+                self.replayed += 1
+                return 'replay', {'status_code': row[2], 'content_type': row[3], 'body': bytes(row[4])}
+            return 'pending', self._inflight.get(key)
+
+    def _joined(self, entry):
+        """等候中的項目已有結果時返回該結果"""
+        if entry is not None and entry['event'].is_set() and entry['record'] is not None:
+            with self._lock:
+                self.joined += 1
+            return entry['record']
+        return None
+
+    def _timeout(self):
+        with self._lock:
+            self.timeouts += 1
+        return IdempotencyInProgress(IN_PROGRESS_RETRY_AFTER)
+
+    def begin(self, key, fingerprint):
+        """開始處理一個帶冪等鍵的請求，必要時等候處理中的相同請求
+
+        Returns:
+            tuple: (擁有者代碼, None) 表示由呼叫端處理，完成後需呼叫 complete 或 abandon；
+                (None, 回應) 表示直接返回已保存或共用的回應
+
+        Raises:
+            IdempotencyMismatch: 同一個鍵已用於內容不同的請求
+            IdempotencyInProgress: 等候逾時
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            state, value = self._claim(key, fingerprint)
+            if state == 'owner':
+                return value, None
+            if state == 'replay':
+                return None, value
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._timeout()
+            if value is not None:
+                value['event'].wait(remaining)
+                record = self._joined(value)
+                if record is not None:
+                    return None, record
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+
+    async def begin_async(self, key, fingerprint):
+        """begin 的非同步版本（等候期間不佔用執行緒）"""
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            state, value = await asyncio.to_thread(self._claim, key, fingerprint)
+            if state == 'owner':
+                return value, None
+            if state == 'replay':
+                return None, value
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timeout()
+                await asyncio.sleep(min(POLL_INTERVAL, remaining))
+                if value is None or value['event'].is_set():
+                    break
+            record = self._joined(value)
+            if record is not None:
+                return None, record
+
+    def complete(self, key, owner, status_code, body, content_type):
+        """保存處理結果並喚醒等候中的重複請求（不保存的狀態碼會釋放鍵）"""
+        record = {'status_code': status_code, 'content_type': content_type, 'body': body}
+        now = time.time()
+        with self._lock:
+            if should_store(status_code):
+                cursor = self._conn.execute(
+                    "UPDATE idempotency_keys SET state = 'done', status_code = ?, content_type = ?, body = ?, "
+                    'size = ?, expires_at = ? WHERE key = ? AND owner = ?',
+                    (status_code, content_type, body, len(body), now + self.ttl, key, owner)
+                )
+                if cursor.rowcount:
+                    self.stored += 1
+                    self._evict(now)
+            else:
+                self._conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND owner = ?', (key, owner))
+            self._conn.commit()
+            self._finish(key, record)
+
+    def abandon(self, key, owner):
+        """放棄處理權（處理失敗或回應無法保存），等候中的請求會重新取得處理權"""
+        with self._lock:
+            self._conn.execute('DELETE FROM idempotency_keys WHERE key = ? AND owner = ?', (key, owner))
+            self._conn.commit()
+            self._finish(key, None)
+
+    def _finish(self, key, record):
+        """喚醒本行程中等候此鍵的請求（需持有鎖）"""
+        entry = self._inflight.pop(key, None)
+        if entry is not None:
+            entry['record'] = record
+            entry['event'].set()
+
+    def _evict(self, now):
+        """清除逾期項目，並淘汰最舊的回應直到符合筆數與大小上限（需持有鎖）"""
+        cursor = self._conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,))
+        self.evictions += max(cursor.rowcount, 0)
+
+        count, total = self._conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM idempotency_keys'
+        ).fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            row = self._conn.execute(
+                "SELECT key, size FROM idempotency_keys WHERE state = 'done' ORDER BY created_at ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._conn.execute('DELETE FROM idempotency_keys WHERE key = ?', (row[0],))
+            count -= 1
+            total -= row[1]
+            self.evictions += 1
+
+    def stats(self):
+        """取得冪等鍵統計"""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM idempotency_keys WHERE state = 'done'"
+            ).fetchone()
+            return {
+                'started': self.started,
+                'replayed': self.replayed,
+                'joined': self.joined,
+                'mismatches': self.mismatches,
+                'timeouts': self.timeouts,
+                'stored': self.stored,
+                'evictions': self.evictions,
+                'in_flight': len(self._inflight),
+                'entries': count,
+                'bytes': total,
+                'ttl': self.ttl,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes
+            }
+
+
+def error_payload(error):
+    """IdempotencyError 的回應內容：(payload, 狀態碼, 標頭)"""
+    payload = {'status': 'error', 'error': str(error)}
+    headers = {}
+    if error.retry_after is not None:
+        payload['retry_after'] = error.retry_after
+        headers['Retry-After'] = str(error.retry_after)
+    return payload, error.status_code, headers
+
+
+def idempotent(view):
+    """路由支援 Idempotency-Key 標頭的裝飾器
+
+    未帶標頭的請求照常處理；串流回應無法重播，不保存結果。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        raw_key = request.headers.get('Idempotency-Key')
+        if idempotency_store is None or raw_key is None:
+            return view(*args, **kwargs)
+
+        try:
+            key = scoped_key(request.endpoint, raw_key)
+            owner, record = idempotency_store.begin(
+                key, request_fingerprint(request.method, request.path, request.get_data())
+            )
+        except IdempotencyError as e:
+            idempotency_requests.inc(endpoint=request.endpoint, outcome=e.reason)
+            payload, status, headers = error_payload(e)
+            return jsonify(payload), status, headers
+
+        if record is not None:
+            idempotency_requests.inc(endpoint=request.endpoint, outcome='replayed')
+            response = current_app.response_class(
+                record['body'], status=record['status_code'], content_type=record['content_type']
+            )
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response
+
+        idempotency_requests.inc(endpoint=request.endpoint, outcome='started')
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency_store.abandon(key, owner)
+            raise
+        if response.is_streamed:
+            idempotency_store.abandon(key, owner)
+        else:
+            idempotency_store.complete(key, owner, response.status_code, response.get_data(), response.content_type)
+        return response
+
+    wrapper.idempotent = True
+    return wrapper
+
+
+# 建立全域冪等鍵儲存實例（第一次使用時才開啟資料庫，停用時為None）
+idempotency_store = (
+    LazyInstance('idempotency_store', functools.partial(IdempotencyStore, IDEMPOTENCY_DB_PATH))
+    if IDEMPOTENCY_ENABLED else None
+)
@@ -0,0 +1,206 @@
+"""
+名片OCR與客戶開發信系統 - 大量匯入模組
+
+將ZIP壓縮檔或多頁PDF逐一拆成名片圖片，以產生器串接到OCR階段：
+每次只解出一個項目，記憶體用量與檔案大小無關。
+
+PDF頁面的點陣化使用 pypdfium2（選用套件）；未安裝時改為直接取出
+頁面中嵌入的JPEG影像（掃描器產生的PDF通常每頁即為一張JPEG）。
+"""
+import io
+import logging
+import mmap
+import os
+import re
+import tempfile
+import zipfile
+from app.config import OCR_UPLOAD_MAX_BYTES, OCR_INGEST_PDF_DPI, OCR_INGEST_MAX_PDF_BYTES
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 可匯入的檔案類型
+INGEST_EXTENSIONS = {'zip', 'pdf', 'png', 'jpg', 'jpeg'}
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+# PDF中的影像物件（字典後緊接 stream 關鍵字）
+PDF_IMAGE_OBJECT_RE = re.compile(rb'\d+\s+\d+\s+obj\s*<<(.{0,4096}?)>>\s*stream\r?\n', re.DOTALL)
+PDF_LENGTH_RE = re.compile(rb'/Length\s+(\d+)(\s+\d+\s+R)?')
+PDF_WIDTH_RE = re.compile(rb'/Width\s+(\d+)')
+
+# 嵌入影像的最小寬度（略過頁面上的標誌等小圖）
+PDF_MIN_IMAGE_WIDTH = 200
+
+# 解壓縮ZIP內PDF時每次讀取的位元組數
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class IngestError(ValueError):
+    """無法解析的匯入檔案"""
+
+
+def allowed_ingest_file(filename):
+    """檢查檔案類型是否可匯入"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in INGEST_EXTENSIONS
+
+
+def _extension(name):
+    return name.rsplit('.', 1)[1].lower() if '.' in name else ''
+
+
+def _item(source, content=None, skipped=None):
+    """匯入項目：content 為圖片位元組；無法處理時 skipped 為原因"""
+    return {'source': source, 'content': content, 'skipped': skipped}
+
+
+def iter_ingest_items(fileobj, filename, max_item_bytes=OCR_UPLOAD_MAX_BYTES):
+    """依檔案內容逐一產生名片圖片
+
+    Args:
+        fileobj: 可隨機讀取的檔案物件（上傳的暫存檔）
+        filename: 原始檔名，用於組成各項目的來源描述
+        max_item_bytes: 單一圖片的大小上限，超過的項目標記為略過
+
+    Yields:
+        dict: {'source', 'content', 'skipped'}
+
+    Raises:
+        IngestError: 檔案無法解析
+    """
+    head = fileobj.read(5)
+    fileobj.seek(0)
+    if head.startswith(b'PK'):
+        yield from iter_zip_items(fileobj, filename, max_item_bytes)
+    elif head.startswith(b'%PDF'):
+        yield from iter_pdf_items(fileobj, filename)
+    elif _extension(filename) in IMAGE_EXTENSIONS:
+        content = fileobj.read(max_item_bytes + 1)
+        if len(content) > max_item_bytes:
+            yield _item(filename, skipped='檔案過大')
+        else:
+            yield _item(filename, content)
+    else:
+        raise IngestError(f'不支援的檔案格式: {filename}')
+
+
+def _copy_limited(source, target, limit):
+    """分段複製檔案內容，超過 limit 位元組時停止並返回False"""
+    copied = 0
+    while True:
+        chunk = source.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            return True
+        copied += len(chunk)
+        if copied > limit:
+            return False
+        target.write(chunk)
+
+
+def iter_zip_items(fileobj, filename, max_item_bytes=OCR_UPLOAD_MAX_BYTES, max_pdf_bytes=OCR_INGEST_MAX_PDF_BYTES):
+    """逐一解出ZIP中的圖片（內含的PDF會再拆成頁面，解壓縮後超過 max_pdf_bytes 的PDF標記為略過）"""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise IngestError(f'無法解析ZIP檔: {str(e)}')
+
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            if info.is_dir() or not base or base.startswith('.') or name.startswith('__MACOSX/'):
+                continue
+            source = f'{filename}:{name}'
+            extension = _extension(base)
+
+            if extension == 'pdf':
+                # PDF需要隨機讀取，先解到暫存檔再逐頁處理（同樣以實際解壓縮的大小判斷）
+                with tempfile.TemporaryFile() as spool:
+                    with archive.open(info) as entry:
+                        complete = _copy_limited(entry, spool, max_pdf_bytes)
+                    if not complete:
+                        yield _item(source, skipped='檔案過大')
+                        continue
+                    spool.seek(0)
+                    yield from iter_pdf_items(spool, source)
+                continue
+
+            if extension not in IMAGE_EXTENSIONS:
+                yield _item(source, skipped='不支援的檔案類型')
+                continue
+
+            # 以實際解壓縮的大小判斷，避免壓縮炸彈謊報 file_size
+            with archive.open(info) as entry:
+                content = entry.read(max_item_bytes + 1)
+            if len(content) > max_item_bytes:
+                yield _item(source, skipped='檔案過大')
+            else:
+                yield _item(source, content)
+
+
+def iter_pdf_items(fileobj, filename, dpi=OCR_INGEST_PDF_DPI):
+    """逐頁產生PDF的頁面圖片"""
+    try:
+        import pypdfium2
+    except ImportError:
+        yield from iter_pdf_embedded_images(fileobj, filename)
+        return
+
+    try:
+        document = pypdfium2.PdfDocument(fileobj)
+    except pypdfium2.PdfiumError as e:
+        raise IngestError(f'無法解析PDF檔: {str(e)}')
+
+    try:
+        for index in range(len(document)):
+            page = document[index]
+            try:
+                image = page.render(scale=dpi / 72.0).to_pil()
+                buffer = io.BytesIO()
+                image.convert('RGB').save(buffer, format='JPEG', quality=90)
+            finally:
+                page.close()
+            yield _item(f'{filename}#p{index + 1}', buffer.getvalue())
+    finally:
+        document.close()
+
+
+def iter_pdf_embedded_images(fileobj, filename):
+    """取出PDF中嵌入的JPEG影像（依檔案中的順序，通常即頁面順序）
+
+    以mmap掃描檔案，不會把整個PDF讀入記憶體；只支援未再壓縮的DCTDecode影像。
+    """
+    try:
+        view = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, io.UnsupportedOperation, ValueError):
+        # 記憶體中的小檔案（例如 BytesIO）
+        view = fileobj.read()
+
+    try:
+        page = 0
+        for match in PDF_IMAGE_OBJECT_RE.finditer(view):
+            header = match.group(1)
+            if b'/Image' not in header or b'/DCTDecode' not in header or b'/FlateDecode' in header:
+                continue
+            width = PDF_WIDTH_RE.search(header)
+            if width and int(width.group(1)) < PDF_MIN_IMAGE_WIDTH:
+                continue
+
+            start = match.end()
+            length = PDF_LENGTH_RE.search(header)
+            if length and not length.group(2):
+                end = start + int(length.group(1))
+            else:
+                # 長度為間接參照時，以 endstream 關鍵字定位結尾
+                end = view.find(b'endstream', start)
+                if end < 0:
+                    break
+            page += 1
+            yield _item(f'{filename}#img{page}', bytes(view[start:end]).rstrip(b'\r\n'))
+
+        if page == 0:
+            logger.warning(f"PDF中沒有可取出的JPEG影像（安裝 pypdfium2 以點陣化頁面）: {filename}")
+            yield _item(filename, skipped='PDF中沒有可取出的JPEG影像')
+    finally:
+        if isinstance(view, mmap.mmap):
+            view.close()
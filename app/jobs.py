@@ -0,0 +1,381 @@
+"""
+名片OCR與客戶開發信系統 - 非同步工作佇列模組
+
+工作保存在SQLite（WAL模式）中，多個行程可共用同一個佇列。
+取出工作時記錄租約到期時間，執行中持續以心跳延長租約；
+租約過期（執行的行程已中斷）的工作才會重新排入佇列，重試次數用盡時標記為失敗。
+處理發生錯誤的工作以指數退避延後重試（配額不足時依建議的等候秒數），避免重試次數瞬間用盡。
+已完成的工作保留一段時間後刪除。
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+from app.dbutil import open_sqlite
+from app.ratelimit import QuotaExceeded
+from app.config import (
+    OCR_JOBS_DB_PATH, OCR_JOBS_WORKERS, OCR_JOBS_MAX_ATTEMPTS, OCR_JOBS_LEASE_SECONDS, OCR_JOBS_RETENTION,
+    OCR_JOBS_RETRY_BASE_SECONDS, OCR_JOBS_RETRY_MAX_SECONDS
+)
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 工作狀態
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class JobFailed(Exception):
+    """工作處理失敗且不需重試（例如圖片無法辨識）"""
+
+
+class JobStore:
+    """以SQLite保存的持久化工作儲存區"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = open_sqlite(db_path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_until REAL,
+                not_before REAL
+            )
+            """
+        )
+        # 舊版資料庫沒有租約與延後重試欄位
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        if 'lease_owner' not in columns:
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN lease_owner TEXT')
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN lease_until REAL')
+        if 'not_before' not in columns:
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN not_before REAL')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+        self._conn.commit()
+
+    def create(self, kind, payload):
+        """新增工作並返回工作ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, QUEUED, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self._conn.commit()
+        return job_id
+
+    def claim(self, lease_seconds):
+        """取出最早排入且已到重試時間的工作並標記為執行中，沒有工作時返回None
+
+        Args:
+            lease_seconds: 租約秒數，執行期間需以 renew 延長，過期後工作會被其他行程回收
+
+        Returns:
+            dict: 包含 id、kind、payload、attempts 與租約識別碼 lease
+        """
+        lease = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    'SELECT id, kind, payload, attempts FROM jobs '
+                    'WHERE status = ? AND (not_before IS NULL OR not_before <= ?) ORDER BY created_at LIMIT 1',
+                    (QUEUED, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.commit()
+                    return None
+
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, '
+                    'lease_owner = ?, lease_until = ?, not_before = NULL WHERE id = ?',
+                    (RUNNING, now, lease, now + lease_seconds, row[0])
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+        return {'id': row[0], 'kind': row[1], 'payload': json.loads(row[2]), 'attempts': row[3] + 1, 'lease': lease}
+
+    def renew(self, leases, lease_seconds):
+        """延長仍持有的租約（心跳），返回成功延長的工作數"""
+        if not leases:
+            return 0
+        lease_until = time.time() + lease_seconds
+        with self._lock:
+            cursor = self._conn.executemany(
+                'UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_owner = ? AND status = ?',
+                [(lease_until, job_id, lease, RUNNING) for job_id, lease in leases]
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def finish(self, job_id, lease, status, result=None, error=None, retry_delay=None):
+        """更新工作的最終狀態（或重新排入佇列）
+
+        只有仍持有租約時才會更新；租約已過期且工作已被回收時返回False。
+
+        Args:
+            retry_delay: 重新排入佇列時，延後多少秒才能再被取出
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, lease_owner = NULL, lease_until = NULL, '
+                'not_before = ? WHERE id = ? AND lease_owner = ? AND status = ?',
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    now,
+                    now + retry_delay if retry_delay else None,
+                    job_id,
+                    lease,
+                    RUNNING
+                )
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def recover_expired(self, max_attempts):
+        """回收租約已過期的執行中工作（執行的行程已中斷）
+
+        中斷的執行已在取出時計入嘗試次數：仍有剩餘次數的工作重新排入佇列，
+        否則標記為失敗。沒有租約的舊版執行中工作視為已過期。
+
+        Returns:
+            tuple: (重新排入的工作數, 標記為失敗的工作數)
+        """
+        now = time.time()
+        expired = '(lease_until IS NULL OR lease_until <= ?)'
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                failed = self._conn.execute(
+                    f'UPDATE jobs SET status = ?, error = ?, updated_at = ?, lease_owner = NULL, lease_until = NULL '
+                    f'WHERE status = ? AND {expired} AND attempts >= ?',
+                    (FAILED, '工作執行中斷，重試次數已用盡', now, RUNNING, now, max_attempts)
+                ).rowcount
+                requeued = self._conn.execute(
+                    f'UPDATE jobs SET status = ?, error = ?, updated_at = ?, lease_owner = NULL, lease_until = NULL '
+                    f'WHERE status = ? AND {expired}',
+                    (QUEUED, '工作執行中斷，已重新排入佇列', now, RUNNING, now)
+                ).rowcount
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return requeued, failed
+
+    def purge_finished(self, retention):
+        """刪除完成（成功或失敗）超過 retention 秒的工作，返回刪除的工作數"""
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at <= ?',
+                (SUCCEEDED, FAILED, time.time() - retention)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def get(self, job_id):
+        """取得工作狀態，不存在時返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, kind, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        return {
+            'job_id': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'result': json.loads(row[3]) if row[3] else None,
+            'error': row[4],
+            'attempts': row[5],
+            'created_at': datetime.fromtimestamp(row[6]).isoformat(timespec='seconds'),
+            'updated_at': datetime.fromtimestamp(row[7]).isoformat(timespec='seconds')
+        }
+
+
+class JobQueue:
+    """背景工作佇列：以固定數量的工作執行緒處理持久化工作"""
+
+    def __init__(self, db_path, workers=2, max_attempts=3, poll_interval=1.0, lease_seconds=60,
+                 retention=7 * 24 * 3600, retry_base=5.0, retry_max=300.0):
+        """初始化佇列（第一次使用時才開啟資料庫並啟動工作執行緒）
+
+        Args:
+            db_path: SQLite資料庫檔案路徑
+            workers: 工作執行緒數量
+            max_attempts: 最多嘗試次數（發生例外或執行中斷都計入）
+            poll_interval: 沒有工作時的輪詢間隔（秒），用於接手其他行程排入的工作
+            lease_seconds: 工作租約秒數，執行中每 lease_seconds/3 秒以心跳延長
+            retention: 已完成工作的保留秒數
+            retry_base: 第一次重試前的等候秒數，之後每次加倍
+            retry_max: 重試等候秒數上限
+        """
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.retention = retention
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.handlers = {}
+        self.store = None
+        self._threads = []
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def register(self, kind, handler):
+        """註冊工作處理函式，handler(payload) 返回可序列化為JSON的結果"""
+        self.handlers[kind] = handler
+
+    def start(self):
+        """開啟資料庫、回收租約過期的工作並啟動工作執行緒與心跳執行緒（可重複呼叫）"""
+        with self._start_lock:
+            if self._threads:
+                return
+
+            self.store = JobStore(self.db_path)
+            self._maintain()
+
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+            logger.info(f"工作佇列已啟動: {self.db_path}, 工作執行緒 {self.workers} 個")
+
+    def submit(self, kind, payload):
+        """排入新工作並返回工作ID"""
+        if kind not in self.handlers:
+            raise ValueError(f"未註冊的工作類型: {kind}")
+
+        self.start()
+        job_id = self.store.create(kind, payload)
+        self._wakeup.set()
+        logger.info(f"已排入工作: {job_id} ({kind})")
+        return job_id
+
+    def get(self, job_id):
+        """取得工作狀態"""
+        self.start()
+        return self.store.get(job_id)
+
+    def _maintain(self):
+        """回收租約過期的工作並刪除超過保留期限的已完成工作"""
+        requeued, failed = self.store.recover_expired(self.max_attempts)
+        if requeued:
+            logger.info(f"重新排入 {requeued} 個中斷的工作")
+        if failed:
+            logger.warning(f"{failed} 個中斷的工作重試次數已用盡，標記為失敗")
+        purged = self.store.purge_finished(self.retention)
+        if purged:
+            logger.info(f"已刪除 {purged} 個超過保留期限的工作")
+
+    def _heartbeat(self):
+        """心跳執行緒：定期延長執行中工作的租約，並回收其他行程中斷的工作"""
+        interval = self.lease_seconds / 3.0
+        while True:
+            time.sleep(interval)
+            try:
+                with self._leases_lock:
+                    leases = list(self._leases.items())
+                self.store.renew(leases, self.lease_seconds)
+                self._maintain()
+            except Exception as e:
+                logger.error(f"工作租約維護失敗: {str(e)}")
+
+    def _work(self):
+        """工作執行緒主迴圈"""
+        while True:
+            try:
+                job = self.store.claim(self.lease_seconds)
+            except Exception as e:
+                logger.error(f"取得工作失敗: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            with self._leases_lock:
+                self._leases[job['id']] = job['lease']
+            try:
+                self._run(job)
+            finally:
+                with self._leases_lock:
+                    self._leases.pop(job['id'], None)
+
+    def _finish(self, job, status, result=None, error=None, retry_delay=None):
+        """記錄工作結果，租約已被回收時只記錄警告（工作由其他行程重新執行）"""
+        if self.store.finish(job['id'], job['lease'], status, result=result, error=error, retry_delay=retry_delay):
+            return True
+        logger.warning(f"工作租約已過期，結果未寫入: {job['id']}")
+        return False
+
+    def _retry_delay(self, job, error):
+        """計算重試前的等候秒數：配額不足時依建議的等候秒數，其他錯誤以指數退避"""
+        if isinstance(error, QuotaExceeded):
+            return error.retry_after
+        return min(self.retry_max, self.retry_base * 2 ** (job['attempts'] - 1))
+
+    def _run(self, job):
+        """執行單一工作並記錄結果"""
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self._finish(job, FAILED, error=f"未註冊的工作類型: {job['kind']}")
+            return
+
+        try:
+            result = handler(job['payload'])
+            if self._finish(job, SUCCEEDED, result=result):
+                logger.info(f"工作完成: {job['id']}")
+        except JobFailed as e:
+            self._finish(job, FAILED, error=str(e))
+            logger.error(f"工作失敗: {job['id']}, {str(e)}")
+        except Exception as e:
+            if job['attempts'] < self.max_attempts:
+                delay = self._retry_delay(job, e)
+                self._finish(job, QUEUED, error=str(e), retry_delay=delay)
+                logger.warning(f"工作處理發生錯誤，{delay} 秒後重試: {job['id']}, {str(e)}")
+            else:
+                self._finish(job, FAILED, error=str(e))
+                logger.error(f"工作重試次數已用盡: {job['id']}, {str(e)}")
+
+
+# 建立全域實例（處理函式由路由模組註冊）
+job_queue = JobQueue(
+    OCR_JOBS_DB_PATH, workers=OCR_JOBS_WORKERS, max_attempts=OCR_JOBS_MAX_ATTEMPTS,
+    lease_seconds=OCR_JOBS_LEASE_SECONDS, retention=OCR_JOBS_RETENTION,
+    retry_base=OCR_JOBS_RETRY_BASE_SECONDS, retry_max=OCR_JOBS_RETRY_MAX_SECONDS
+)
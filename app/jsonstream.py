@@ -0,0 +1,119 @@
+"""
+名片OCR與客戶開發信系統 - 串流JSON欄位解析模組
+
+逐段餵入模型的串流回應，最外層物件的欄位一旦完整即返回，
+不必等待整個回應結束。物件前後的Markdown標記（例如 ```json）會被忽略。
+"""
+import json
+
+
+class JSONFieldStream:
+    """增量解析最外層JSON物件的欄位"""
+
+    def __init__(self):
+        self.fields = {}
+        self.done = False
+        self._text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = 'key'
+        self._key = None
+        self._start = None
+
+    @property
+    def text(self):
+        """目前收到的完整文字"""
+        return self._text
+
+    def feed(self, chunk):
+        """餵入一段文字
+
+        Args:
+            chunk: 新收到的回應文字
+
+        Returns:
+            list: 本段文字中完成的欄位 [(欄位名稱, 值), ...]
+        """
+        self._text += chunk
+        completed = []
+        text = self._text
+
+        for index in range(self._pos, len(text)):
+            if self.done:
+                break
+            ch = text[index]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == 'key':
+                        self._key = self._decode(text[self._start:index + 1])
+                        self._expect = 'colon'
+                    elif self._depth == 1 and self._expect == 'string':
+                        self._emit(text[self._start:index + 1], completed)
+                        self._expect = 'comma'
+                continue
+
+            # 物件開始前的文字（例如Markdown標記）一律略過
+            if self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                    self._expect = 'key'
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect in ('key', 'value'):
+                    self._start = index
+                    if self._expect == 'value':
+                        self._expect = 'string'
+            elif ch in '{[':
+                if self._depth == 1 and self._expect == 'value':
+                    self._start = index
+                    self._expect = 'other'
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._expect == 'other':
+                        self._emit(text[self._start:index], completed)
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ',':
+                    if self._expect == 'other':
+                        self._emit(text[self._start:index], completed)
+                    self._expect = 'key'
+                elif ch == ':' and self._expect == 'colon':
+                    self._expect = 'value'
+                elif not ch.isspace() and self._expect == 'value':
+                    # 數字、true、false、null
+                    self._start = index
+                    self._expect = 'other'
+
+        self._pos = len(text)
+        return completed
+
+    @staticmethod
+    def _decode(raw):
+        try:
+            return json.loads(raw.strip())
+        except ValueError:
+            return None
+
+    def _emit(self, raw, completed):
+        """解析完成的欄位值並記錄"""
+        if self._key is None:
+            return
+        try:
+            value = json.loads(raw.strip())
+        except ValueError:
+            return
+        self.fields[self._key] = value
+        completed.append((self._key, value))
+        self._key = None
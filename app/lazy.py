@@ -0,0 +1,127 @@
+"""
+名片OCR與客戶開發信系統 - 延遲初始化與啟動時間報告模組
+
+外部API客戶端（Gemini、Vision、Sheets、Gmail）改為第一次使用時才建立，
+讓Flask在匯入模組後即可回應 /health，並記錄各階段啟動耗時。
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 以本模組載入時間近似行程啟動時間
+_process_start = time.perf_counter()
+_startup_lock = threading.Lock()
+_startup = {
+    'started_at': datetime.now().isoformat(timespec='seconds'),
+    'phases': {},
+    'warmup': None
+}
+_instances = {}
+
+
+def record_phase(name, elapsed_ms):
+    """記錄啟動階段耗時（毫秒）"""
+    with _startup_lock:
+        _startup['phases'][name] = round(elapsed_ms, 2)
+
+
+class LazyInstance:
+    """延遲建立的全域實例代理：第一次存取屬性時才呼叫factory建立物件"""
+
+    def __init__(self, name, factory):
+        """建立代理
+
+        Args:
+            name: 實例名稱（用於啟動報告與預熱設定）
+            factory: 無參數的建構函式
+        """
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+        object.__setattr__(self, '_info', {'initialized': False})
+        _instances[name] = self
+
+    @property
+    def initialized(self):
+        """是否已建立實例"""
+        return self._instance is not None
+
+    def get(self, trigger='request'):
+        """取得實例，尚未建立時以執行緒安全的方式建立"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if self._instance is None:
+                start = time.perf_counter()
+                instance = self._factory()
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                object.__setattr__(self, '_instance', instance)
+                self._info.update({
+                    'initialized': True,
+                    'init_ms': round(elapsed_ms, 2),
+                    'initialized_at': datetime.now().isoformat(timespec='seconds'),
+                    'since_start_ms': round((time.perf_counter() - _process_start) * 1000, 2),
+                    'trigger': trigger
+                })
+                logger.info(f"延遲初始化 {self._name} 完成，耗時 {elapsed_ms:.1f}ms（{trigger}）")
+            return self._instance
+
+    def __getattr__(self, item):
+        return getattr(self.get(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self.get(), key, value)
+
+    def __repr__(self):
+        state = 'initialized' if self.initialized else 'pending'
+        return f"<LazyInstance {self._name} ({state})>"
+
+
+def warm_up(names=None):
+    """在背景執行緒依序建立指定的實例，避免第一個請求承擔初始化延遲
+
+    Args:
+        names: 要預熱的實例名稱列表，None表示全部已註冊的實例
+
+    Returns:
+        threading.Thread: 預熱執行緒
+    """
+    targets = [name for name in (names or list(_instances)) if name in _instances]
+
+    def run():
+        start = time.perf_counter()
+        for name in targets:
+            try:
+                _instances[name].get(trigger='warmup')
+            except Exception as e:
+                logger.error(f"預熱 {name} 失敗: {str(e)}")
+        with _startup_lock:
+            _startup['warmup']['finished_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    with _startup_lock:
+        _startup['warmup'] = {'instances': targets, 'finished_ms': None}
+
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def startup_report():
+    """取得啟動時間報告"""
+    with _startup_lock:
+        report = {
+            'started_at': _startup['started_at'],
+            'uptime_ms': round((time.perf_counter() - _process_start) * 1000, 2),
+            'phases': dict(_startup['phases']),
+            'warmup': dict(_startup['warmup']) if _startup['warmup'] else None
+        }
+    report['instances'] = {name: dict(proxy._info) for name, proxy in _instances.items()}
+    return report
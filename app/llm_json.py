@@ -0,0 +1,385 @@
+"""
+名片OCR與客戶開發信系統 - Gemini結構化回應解析模組
+
+所有要求JSON回覆的Gemini呼叫共用同一套解析流程：
+1. 直接解析；
+2. 單次掃描取出第一個括號平衡的JSON物件（忽略Markdown標記與前後說明文字）；
+3. 修復常見的模型JSON缺陷（結尾逗號、單引號、註解、未加引號的鍵、截斷等）；
+4. 依欄位定義驗證並轉換型別；
+5. 仍失敗時，只把損壞的JSON交給模型修正（不重送圖片或原始提示詞）。
+"""
+import json
+import logging
+import time
+from app.metrics import stage_seconds, observe_stage, record_fallback
+from app.ratelimit import QuotaExceeded
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 修正JSON的提示詞（只包含損壞的回覆，成本遠低於重新呼叫原始請求）
+FIX_JSON_PROMPT = """以下內容應為一個JSON物件，但無法解析或欄位不符合要求。
+問題：{errors}
+必要欄位：{fields}
+
+請只回覆修正後的JSON物件，不要加入任何說明或Markdown標記，也不要改動欄位內容。
+
+{text}
+"""
+
+# 重新詢問時最多附上的回覆長度
+FIX_JSON_MAX_CHARS = 8000
+
+_CLOSERS = {'{': '}', '[': ']'}
+_LITERALS = {
+    'true': 'true', 'True': 'true', 'TRUE': 'true',
+    'false': 'false', 'False': 'false', 'FALSE': 'false',
+    'null': 'null', 'None': 'null', 'NULL': 'null', 'undefined': 'null', 'NaN': 'null'
+}
+_OPEN_QUOTES = {'"': '"', "'": "'", '“': '”', '‘': '’'}
+
+
+class LLMJSONError(ValueError):
+    """模型回覆無法解析為符合要求的JSON"""
+
+    def __init__(self, message, text='', errors=None):
+        super().__init__(message)
+        self.text = text
+        self.errors = errors or []
+
+
+def extract_json(text):
+    """單次掃描取出第一個括號平衡的JSON物件或陣列
+
+    字串內的括號不計入；物件未結束（回覆被截斷）時返回從開頭到結尾的內容。
+
+    Returns:
+        str: JSON片段，找不到開頭括號時返回None
+    """
+    start = None
+    depth = 0
+    quote = None
+    escape = False
+
+    for index, ch in enumerate(text):
+        if start is None:
+            if ch in '{[':
+                start = index
+                depth = 1
+            continue
+
+        if quote:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == quote:
+                quote = None
+            continue
+
+        if ch in '"\'':
+            quote = ch
+        elif ch in '{[':
+            depth += 1
+        elif ch in '}]':
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+
+    return text[start:] if start is not None else None
+
+
+def _strip_trailing_comma(out):
+    """移除輸出結尾（忽略空白）的逗號"""
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ',':
+        del out[index]
+
+
+def _needs_comma(out):
+    """輸出結尾是否為一個完整的值（接著出現新的值或鍵時表示缺少逗號）"""
+    for index in range(len(out) - 1, -1, -1):
+        if not out[index].isspace():
+            last = out[index][-1]
+            return last in '"}]' or last.isdigit() or out[index] in ('true', 'false', 'null')
+    return False
+
+
+def _ends_with_colon(out):
+    """輸出結尾（忽略空白）是否為冒號"""
+    for index in range(len(out) - 1, -1, -1):
+        if not out[index].isspace():
+            return out[index] == ':'
+    return False
+
+
+def repair_json(text):
+    """修復常見的模型JSON缺陷
+
+    處理：單引號與全形引號、字串內未跳脫的換行與引號、// 與 /* */ 註解、
+    結尾逗號、缺少的逗號、未加引號的鍵、Python/JS常值（True、None、undefined）、
+    以及回覆截斷造成的未結束字串與括號。
+    """
+    out = []
+    stack = []
+    quote = None
+    index = 0
+    length = len(text)
+
+    while index < length:
+        ch = text[index]
+
+        if quote:
+            if ch == '\\' and index + 1 < length:
+                # 單引號字串中的 \' 在JSON中不需跳脫
+                escaped = text[index + 1]
+                out.append(escaped if escaped == "'" else ch + escaped)
+                index += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == '\n':
+                out.append('\\n')
+            elif ch == '\t':
+                out.append('\\t')
+            elif ch != '\r':
+                out.append(ch)
+            index += 1
+            continue
+
+        if ch in _OPEN_QUOTES:
+            if _needs_comma(out):
+                out.append(',')
+            quote = _OPEN_QUOTES[ch]
+            out.append('"')
+        elif ch == '/' and text[index + 1:index + 2] == '/':
+            end = text.find('\n', index)
+            index = length if end == -1 else end
+            continue
+        elif ch == '/' and text[index + 1:index + 2] == '*':
+            end = text.find('*/', index + 2)
+            index = length if end == -1 else end + 2
+            continue
+        elif ch in '{[':
+            if _needs_comma(out):
+                out.append(',')
+            stack.append(ch)
+            out.append(ch)
+        elif ch in '}]':
+            _strip_trailing_comma(out)
+            if stack:
+                out.append(_CLOSERS[stack.pop()])
+                if not stack:
+                    break
+        elif ch.isalpha() or ch == '_':
+            end = index
+            while end < length and (text[end].isalnum() or text[end] in '_$-'):
+                end += 1
+            word = text[index:end]
+            rest = text[end:].lstrip()
+            if index and (text[index - 1].isdigit() or text[index - 1] == '.'):
+                # 數字的指數部分（例如 1.5e3）
+                out.append(word)
+                index = end
+                continue
+            if _needs_comma(out):
+                out.append(',')
+            if rest.startswith(':'):
+                out.append(json.dumps(word))
+            elif word in _LITERALS:
+                out.append(_LITERALS[word])
+            else:
+                out.append(json.dumps(word))
+            index = end
+            continue
+        else:
+            out.append(ch)
+        index += 1
+
+    # 回覆被截斷：補上未結束的字串、值與括號
+    if quote:
+        out.append('"')
+    _strip_trailing_comma(out)
+    if _ends_with_colon(out):
+        out.append('null')
+    while stack:
+        _strip_trailing_comma(out)
+        out.append(_CLOSERS[stack.pop()])
+
+    return ''.join(out)
+
+
+def validate(data, schema):
+    """依欄位定義驗證並轉換資料
+
+    Args:
+        data: 解析後的JSON
+        schema: {'fields': {欄位: 型別}, 'required': [必要欄位]}；
+                型別為 str 或 list，None值與數字會轉為字串，字串會轉為單元素列表
+
+    Returns:
+        tuple: (轉換後的dict, 錯誤訊息列表)
+    """
+    if not isinstance(data, dict):
+        return data, ['回覆不是JSON物件']
+
+    fields = schema.get('fields', {})
+    errors = []
+    result = dict(data)
+
+    for field in schema.get('required', ()):
+        if field not in data:
+            errors.append(f'缺少欄位 {field}')
+
+    for field, expected in fields.items():
+        if field not in result:
+            continue
+        value = result[field]
+        if expected is str:
+            if value is None:
+                result[field] = ''
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                result[field] = str(value)
+            elif isinstance(value, list) and all(isinstance(item, str) for item in value):
+                result[field] = '\n'.join(value)
+            elif not isinstance(value, str):
+                errors.append(f'欄位 {field} 應為字串')
+        elif expected is list:
+            if value is None:
+                result[field] = []
+            elif isinstance(value, str):
+                result[field] = [value] if value else []
+            elif not isinstance(value, list):
+                errors.append(f'欄位 {field} 應為列表')
+
+    return result, errors
+
+
+def _parse_once(text, schema):
+    """不呼叫模型的解析流程
+
+    Returns:
+        tuple: (資料或None, 使用的階段, 錯誤訊息列表)
+    """
+    extracted = extract_json(text)
+    candidates = [
+        ('direct', lambda: text.strip()),
+        ('extracted', lambda: extracted),
+        ('repaired', lambda: repair_json(extracted) if extracted else None)
+    ]
+
+    errors = []
+    for stage, produce in candidates:
+        fragment = produce()
+        if not fragment:
+            continue
+        try:
+            data = json.loads(fragment)
+        except ValueError as e:
+            errors = [f'JSON格式錯誤: {str(e)}']
+            continue
+
+        if schema:
+            data, schema_errors = validate(data, schema)
+            if schema_errors:
+                return None, stage, schema_errors
+        return data, stage, []
+
+    return None, 'failed', errors or ['回覆中找不到JSON物件']
+
+
+def _parse_local(text, schema):
+    """不呼叫模型的解析，並記錄解析耗時"""
+    start = time.perf_counter()
+    data, stage, errors = _parse_once(text, schema)
+    stage_seconds.observe(
+        time.perf_counter() - start, stage='json_parse', outcome='success' if data is not None else 'error'
+    )
+    return data, stage, errors
+
+
+def _fix_prompt(text, schema, errors):
+    """請模型修正損壞JSON的提示詞"""
+    logger.warning(f"模型回覆JSON無法解析，請模型修正: {'; '.join(errors)}")
+    record_fallback('json_parse', 'reask')
+    fields = ', '.join((schema or {}).get('required', ())) or '（依原內容）'
+    return FIX_JSON_PROMPT.format(errors='; '.join(errors), fields=fields, text=text[:FIX_JSON_MAX_CHARS])
+
+
+def _finish(text, data, stage, errors, stats, start):
+    """記錄解析統計並返回資料，無法解析時拋出 LLMJSONError"""
+    if stats is not None:
+        stats['json_parse'] = {
+            'stage': stage,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    if data is None:
+        raise LLMJSONError(f"無法解析模型回覆JSON: {'; '.join(errors)}", text=text, errors=errors)
+
+    if stage != 'direct':
+        logger.info(f"模型回覆JSON經 {stage} 階段解析成功")
+    return data
+
+
+def parse_llm_json(text, schema=None, model=None, stats=None):
+    """解析模型的JSON回覆
+
+    Args:
+        text: 模型回覆文字
+        schema: 選填的欄位定義（見 validate）
+        model: 選填的Gemini模型；本地修復失敗時以簡短提示詞請模型修正一次
+        stats: 選填的dict，記錄解析階段與耗時
+
+    Returns:
+        dict: 解析並驗證後的資料
+
+    Raises:
+        LLMJSONError: 無法取得符合要求的JSON
+    """
+    start = time.perf_counter()
+    text = text or ''
+    data, stage, errors = _parse_local(text, schema)
+
+    if data is None and model is not None:
+        prompt = _fix_prompt(text, schema, errors)
+        try:
+            with observe_stage('gemini'):
+                fixed = model.generate_content(prompt).text
+            data, _, errors = _parse_once(fixed, schema)
+            stage = 'reasked' if data is not None else 'failed'
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            errors = errors + [f'修正請求失敗: {str(e)}']
+            stage = 'failed'
+
+    return _finish(text, data, stage, errors, stats, start)
+
+
+async def parse_llm_json_async(text, schema=None, model=None, stats=None):
+    """parse_llm_json 的非同步版本（請模型修正時不佔用執行緒）"""
+    start = time.perf_counter()
+    text = text or ''
+    data, stage, errors = _parse_local(text, schema)
+
+    if data is None and model is not None:
+        prompt = _fix_prompt(text, schema, errors)
+        try:
+            with observe_stage('gemini'):
+                fixed = (await model.generate_content_async(prompt)).text
+            data, _, errors = _parse_once(fixed, schema)
+            stage = 'reasked' if data is not None else 'failed'
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            errors = errors + [f'修正請求失敗: {str(e)}']
+            stage = 'failed'
+
+    return _finish(text, data, stage, errors, stats, start)
@@ -11,6 +11,8 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 import pickle
+from app.lazy import LazyInstance
+from app.metrics import observe_stage
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -77,8 +79,11 @@ class GmailSender:
                 with open(token_file, 'wb') as token:
                     pickle.dump(self.credentials, token)
             
-            # 建立Gmail API客戶端
-            self.client = build('gmail', 'v1', credentials=self.credentials)
+            # 建立Gmail API客戶端（使用套件內建的靜態探索文件）
+            self.client = build(
+                'gmail', 'v1', credentials=self.credentials,
+                static_discovery=True, cache_discovery=False
+            )
             logger.info("Gmail API客戶端初始化成功")
         
         except Exception as e:
@@ -105,10 +110,11 @@ class GmailSender:
             raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
             
             # 發送郵件
-            self.client.users().messages().send(
-                userId='me',
-                body={'raw': raw_message}
-            ).execute()
+            with observe_stage('gmail_send'):
+                self.client.users().messages().send(
+                    userId='me',
+                    body={'raw': raw_message}
+                ).execute()
             
             logger.info(f"成功發送郵件至: {to}")
             return True
@@ -137,10 +143,11 @@ class GmailSender:
             raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
             
             # 發送郵件
-            self.client.users().messages().send(
-                userId='me',
-                body={'raw': raw_message}
-            ).execute()
+            with observe_stage('gmail_send'):
+                self.client.users().messages().send(
+                    userId='me',
+                    body={'raw': raw_message}
+                ).execute()
             
             logger.info(f"成功發送HTML郵件至: {to}")
             return True
@@ -149,5 +156,5 @@ class GmailSender:
             logger.error(f"發送HTML郵件失敗: {str(e)}")
             return False
 
-# 建立全域實例
-gmail_sender = GmailSender() 
\ No newline at end of file
+# 建立全域實例（第一次寄信時才初始化，避免匯入時觸發OAuth流程）
+gmail_sender = LazyInstance('gmail_sender', GmailSender) 
\ No newline at end of file
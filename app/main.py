@@ -1,12 +1,25 @@
 """
 名片OCR與客戶開發信系統 - 主要路由
 """
-import os
-from flask import Blueprint, render_template, request, jsonify, current_app
+import itertools
+import json
+import time
+from flask import Blueprint, Response, render_template, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 import logging
 from app.ocr import card_ocr
 from app.analyzer import company_analyzer
+from app.batch import run_bounded, iter_bounded
+from app.ingest import iter_ingest_items, allowed_ingest_file, IngestError
+from app.jobs import job_queue, JobFailed
+from app.uploads import upload_saver, in_memory_upload
+from app.storage import upload_store, is_blob_key
+from app.metrics import observe_stage
+from app.ratelimit import QuotaExceeded, gemini_limiter
+from app.idempotency import idempotent, idempotency_store
+from app.pipeline import run_pipeline
+from app.config import OCR_BATCH_MAX_WORKERS, OCR_BATCH_MAX_ITEMS, OCR_UPLOAD_SAVE, OCR_INGEST_MAX_ITEMS
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +36,90 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# OCR欄位名稱與前端欄位名稱的對應
+CARD_FIELD_NAMES = {
+    'company': 'company_name',
+    'name': 'person_name',
+    'title': 'title',
+    'phone': 'phone',
+    'mobile': 'mobile',
+    'email': 'email',
+    'address': 'address',
+    'tax_id': 'tax_id',
+    'website': 'website',
+    'name_en': 'person_name_en',
+    'title_en': 'title_en',
+    'company_en': 'company_name_en',
+    'address_en': 'address_en'
+}
+
+def to_card_data(result):
+    """將OCR結果轉換為前端期望的格式"""
+    return {target: result.get(field, '') for field, target in CARD_FIELD_NAMES.items()}
+
+def sse_event(event, payload):
+    """組成一則Server-Sent Events訊息"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def quota_response(error, extra=None):
+    """Gemini配額不足時的429回應（Retry-After 為建議的重試秒數）"""
+    logger.warning(f"Gemini配額不足: {str(error)}")
+    response = jsonify(dict(extra or {}, status='error', error=str(error), retry_after=error.retry_after))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def batch_workers(requested):
+    """批次處理的並行數量：未指定時使用設定上限，並限制在1至上限之間（避免超出API配額）"""
+    return max(1, min(requested or OCR_BATCH_MAX_WORKERS, OCR_BATCH_MAX_WORKERS))
+
+def save_upload(file):
+    """將上傳檔案存入上傳儲存，返回 (檔名, 儲存鍵)"""
+    filename = secure_filename(file.filename)
+    with observe_stage('upload_save'):
+        key = upload_store.put(file.read())
+    logger.info(f"儲存檔案: {filename} -> {key}")
+    return filename, key
+
+def load_image(image_ref):
+    """讀取圖片內容
+
+    Args:
+        image_ref: 上傳儲存的鍵（/upload 等路由返回的 path），或本機檔案路徑
+
+    Raises:
+        OSError: 無法讀取圖片
+    """
+    if is_blob_key(image_ref):
+        upload_saver.wait(image_ref)
+        try:
+            return upload_store.get(image_ref)
+        except KeyError:
+            raise FileNotFoundError(f'上傳儲存中找不到圖片（可能已過期回收）: {image_ref}')
+    with open(image_ref, 'rb') as image_file:
+        return image_file.read()
+
+def run_ocr_job(payload):
+    """非同步OCR工作的處理函式"""
+    stats = {}
+    try:
+        content = load_image(payload['image_path'])
+        back_content = load_image(payload['back_image_path']) if payload.get('back_image_path') else None
+    except OSError as e:
+        raise JobFailed(f'無法讀取圖片: {str(e)}')
+    if back_content:
+        result = card_ocr.process_card_pair(content, back_content, stats=stats, source=payload['image_path'])
+    else:
+        result = card_ocr.process_image_bytes(content, stats=stats, source=payload['image_path'])
+    if not result:
+        raise JobFailed('無法辨識名片資訊')
+    return {
+        'data': to_card_data(result),
+        'stats': stats
+    }
+
+job_queue.register('ocr', run_ocr_job)
+
 @bp.route('/')
 def index():
     """首頁路由"""
@@ -30,7 +127,10 @@ def index():
 
 @bp.route('/upload', methods=['POST'])
 def upload_file():
-    """上傳名片圖片路由"""
+    """上傳名片圖片路由
+
+    圖片存入內容定址的上傳儲存，回應中的 path 為儲存鍵，可直接作為 /api/ocr 的 image_path。
+    """
     logger.info("接收到上傳請求")
     
     # 檢查是否有檔案
@@ -50,40 +150,64 @@ def upload_file():
         logger.error(f"上傳失敗: 不支援的檔案類型 - {file.filename}")
         return jsonify({'error': '不支援的檔案類型'}), 400
     
+    # 選填的名片背面
+    back = request.files.get('back')
+    if back and back.filename and not allowed_file(back.filename):
+        logger.error(f"上傳失敗: 不支援的檔案類型 - {back.filename}")
+        return jsonify({'error': '不支援的檔案類型'}), 400
+    
     # 儲存檔案
     try:
-        filename = secure_filename(file.filename)
-        upload_folder = os.path.join(current_app.instance_path, 'uploads')
-        
-        # 確保上傳目錄存在
-        os.makedirs(upload_folder, exist_ok=True)
-        
-        file_path = os.path.join(upload_folder, filename)
-        logger.info(f"儲存檔案到: {file_path}")
-        file.save(file_path)
-        
-        return jsonify({
+        filename, file_path = save_upload(file)
+        response = {
             'message': '檔案上傳成功',
             'filename': filename,
             'path': file_path
-        })
+        }
+        
+        if back and back.filename:
+            back_filename, back_path = save_upload(back)
+            response['back_filename'] = back_filename
+            response['back_path'] = back_path
+        
+        return jsonify(response)
     except Exception as e:
         logger.error(f"檔案上傳失敗: {str(e)}")
         return jsonify({'error': f'檔案上傳失敗: {str(e)}'}), 500
 
 @bp.route('/api/ocr', methods=['POST'])
+@idempotent
 def process_ocr():
-    """處理OCR請求"""
+    """處理OCR請求
+
+    選填 back_image_path 時，正反面合併辨識為一張名片（含中英文欄位）。
+    """
     data = request.json
     if not data or 'image_path' not in data:
         return jsonify({'error': '缺少圖片路徑'}), 400
     
     image_path = data['image_path']
+    back_image_path = data.get('back_image_path')
+    
+    # 串流模式：欄位一辨識完成即以SSE推送（僅支援單面名片）
+    if not back_image_path and (data.get('stream') or 'text/event-stream' in request.headers.get('Accept', '')):
+        return stream_ocr(image_path)
+    
+    try:
+        content = load_image(image_path)
+        back_content = load_image(back_image_path) if back_image_path else None
+    except OSError as e:
+        logger.error(f"讀取圖片失敗: {image_path}, {str(e)}")
+        return jsonify({'status': 'error', 'error': '無法讀取圖片'}), 400
     
     try:
         # 使用OCR模組處理圖片
         logger.info(f"開始處理OCR: {image_path}")
-        result = card_ocr.process_image(image_path)
+        stats = {}
+        if back_content:
+            result = card_ocr.process_card_pair(content, back_content, stats=stats, source=image_path)
+        else:
+            result = card_ocr.process_image_bytes(content, stats=stats, source=image_path)
         
         if not result:
             return jsonify({
@@ -92,24 +216,17 @@ def process_ocr():
             }), 400
         
         # 將結果轉換為前端期望的格式
-        card_data = {
-            'company_name': result.get('company', ''),
-            'person_name': result.get('name', ''),
-            'title': result.get('title', ''),
-            'phone': result.get('phone', ''),
-            'mobile': result.get('mobile', ''),
-            'email': result.get('email', ''),
-            'address': result.get('address', ''),
-            'tax_id': result.get('tax_id', ''),
-            'website': result.get('website', '')
-        }
+        card_data = to_card_data(result)
         
         logger.info(f"OCR處理成功: {image_path}")
         return jsonify({
             'status': 'success',
-            'data': card_data
+            'data': card_data,
+            'stats': stats
         })
         
+    except QuotaExceeded as e:
+        return quota_response(e)
     except Exception as e:
         logger.error(f"OCR處理失敗: {str(e)}")
         return jsonify({
@@ -117,7 +234,572 @@ def process_ocr():
             'error': f'OCR處理失敗: {str(e)}'
         }), 500
 
+def stream_ocr(image_path):
+    """以Server-Sent Events串流OCR結果
+
+    事件依序為多個 field（data 為 {field, value}，欄位名稱同 /api/ocr 的 data），
+    最後為 done（data 同 /api/ocr 的完整回應）或 error。
+    """
+    try:
+        content = load_image(image_path)
+    except OSError as e:
+        logger.error(f"讀取圖片失敗: {image_path}, {str(e)}")
+        return jsonify({'status': 'error', 'error': '無法讀取圖片'}), 400
+
+    return stream_ocr_content(content, image_path)
+
+def stream_ocr_content(content, source, extra=None):
+    """以Server-Sent Events串流記憶體中圖片的OCR結果（extra 會併入 done 事件）
+
+    取得第一個事件後才送出回應標頭，Gemini配額不足時仍可返回429。
+    """
+    logger.info(f"開始串流處理OCR: {source}")
+    stats = {}
+    events = card_ocr.stream_image_bytes(content, stats=stats, source=source)
+    try:
+        first = [next(events)]
+    except QuotaExceeded as e:
+        return quota_response(e, extra)
+    except Exception as e:
+        first = e
+
+    def generate():
+        try:
+            if isinstance(first, Exception):
+                raise first
+            for kind, field, value in itertools.chain(first, events):
+                if kind == 'field':
+                    if field in CARD_FIELD_NAMES:
+                        yield sse_event('field', {'field': CARD_FIELD_NAMES[field], 'value': value})
+                    continue
+
+                # 最後的 result 事件：field 位置為完整的名片dict
+                result = field
+                if result:
+                    yield sse_event('done', dict(
+                        extra or {}, status='success', data=to_card_data(result), stats=stats
+                    ))
+                else:
+                    yield sse_event('error', {'status': 'error', 'error': '無法辨識名片資訊', 'stats': stats})
+        except Exception as e:
+            logger.error(f"串流OCR處理失敗: {str(e)}")
+            yield sse_event('error', {'status': 'error', 'error': f'OCR處理失敗: {str(e)}'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/ocr/upload', methods=['POST'])
+@in_memory_upload
+def upload_and_ocr():
+    """上傳名片圖片並在同一個請求中辨識
+
+    multipart欄位：file（必填）、back（選填的名片背面）、stream（選填，為1時以SSE串流，僅支援單面）。
+    圖片只保存在記憶體，解析途中超過大小上限即返回413；啟用 OCR_UPLOAD_SAVE 時，
+    原始圖片在背景寫入上傳儲存，回應中的 path（儲存鍵）可用於 /api/ocr/refine 等後續請求。
+    """
+    try:
+        file = request.files.get('file')
+        back = request.files.get('back')
+    except RequestEntityTooLarge as e:
+        logger.error(f"上傳失敗: 檔案過大 - {e.description}")
+        return jsonify({'status': 'error', 'error': '檔案過大'}), 413
+
+    if file is None or file.filename == '':
+        logger.error("上傳失敗: 沒有檔案")
+        return jsonify({'status': 'error', 'error': '沒有檔案'}), 400
+
+    for upload in (file, back):
+        if upload and upload.filename and not allowed_file(upload.filename):
+            logger.error(f"上傳失敗: 不支援的檔案類型 - {upload.filename}")
+            return jsonify({'status': 'error', 'error': '不支援的檔案類型'}), 400
+
+    content = file.read()
+    back_content = back.read() if back and back.filename else None
+    if not content:
+        return jsonify({'status': 'error', 'error': '檔案內容為空'}), 400
+
+    source = f'upload:{secure_filename(file.filename)}'
+    extra = {}
+    if OCR_UPLOAD_SAVE:
+        extra['path'] = upload_saver.save(content)
+        if back_content:
+            extra['back_path'] = upload_saver.save(back_content)
+
+    stream = request.form.get('stream') == '1' or 'text/event-stream' in request.headers.get('Accept', '')
+    if stream and not back_content:
+        return stream_ocr_content(content, source, extra)
+
+    try:
+        logger.info(f"開始處理OCR: {source}")
+        stats = {}
+        if back_content:
+            result = card_ocr.process_card_pair(content, back_content, stats=stats, source=source)
+        else:
+            result = card_ocr.process_image_bytes(content, stats=stats, source=source)
+
+        if not result:
+            return jsonify(dict(extra, status='error', error='無法辨識名片資訊')), 400
+
+        logger.info(f"OCR處理成功: {source}")
+        return jsonify(dict(extra, status='success', data=to_card_data(result), stats=stats))
+
+    except QuotaExceeded as e:
+        return quota_response(e, extra)
+    except Exception as e:
+        logger.error(f"OCR處理失敗: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'error': f'OCR處理失敗: {str(e)}'
+        }), 500
+
+@bp.route('/api/jobs', methods=['POST'])
+def submit_ocr_job():
+    """排入非同步OCR工作，立即返回工作ID
+
+    接受 multipart 的 file（與選填的 back）欄位，或JSON格式的 image_path（與選填的 back_image_path）。
+    """
+    if 'file' in request.files:
+        files = {'image_path': request.files['file'], 'back_image_path': request.files.get('back')}
+        payload = {}
+        for key, file in files.items():
+            if file is None or (key == 'back_image_path' and not file.filename):
+                continue
+            if not file.filename or not allowed_file(file.filename):
+                return jsonify({'error': '不支援的檔案類型'}), 400
+            try:
+                _, payload[key] = save_upload(file)
+            except Exception as e:
+                logger.error(f"檔案上傳失敗: {str(e)}")
+                return jsonify({'error': f'檔案上傳失敗: {str(e)}'}), 500
+    else:
+        data = request.json
+        if not data or 'image_path' not in data:
+            return jsonify({'error': '缺少圖片路徑'}), 400
+        payload = {'image_path': data['image_path']}
+        if data.get('back_image_path'):
+            payload['back_image_path'] = data['back_image_path']
+
+    try:
+        job_id = job_queue.submit('ocr', payload)
+    except Exception as e:
+        logger.error(f"排入OCR工作失敗: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'error': f'排入OCR工作失敗: {str(e)}'
+        }), 500
+
+    response = jsonify({
+        'status': 'success',
+        'data': {
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/jobs/{job_id}'
+        }
+    })
+    response.headers['Location'] = f'/api/jobs/{job_id}'
+    return response, 202
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_ocr_job(job_id):
+    """查詢非同步OCR工作的狀態與結果"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({
+            'status': 'error',
+            'error': '找不到工作'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'data': job
+    })
+
+@bp.route('/api/ocr/refine', methods=['POST'])
+def refine_ocr():
+    """只重新辨識名片缺少的欄位
+
+    請求內容：image_path、data（目前的名片資訊，格式同 /api/ocr 的 data）、
+    選填的 fields（要重新辨識的欄位，未指定時使用空白或格式錯誤的欄位）。
+    只有最可能包含欄位的區域會被裁切並送出，stats.refine 記錄與整張重新辨識相比的傳送量。
+    """
+    data = request.json
+    if not data or 'image_path' not in data:
+        return jsonify({'error': '缺少圖片路徑'}), 400
+
+    image_path = data['image_path']
+    ocr_fields = {target: field for field, target in CARD_FIELD_NAMES.items()}
+    card = {ocr_fields[key]: value for key, value in (data.get('data') or {}).items() if key in ocr_fields}
+    fields = data.get('fields')
+    if fields is not None:
+        fields = [ocr_fields.get(field, field) for field in fields]
+
+    try:
+        content = load_image(image_path)
+    except OSError as e:
+        logger.error(f"讀取圖片失敗: {image_path}, {str(e)}")
+        return jsonify({'status': 'error', 'error': '無法讀取圖片'}), 400
+
+    try:
+        stats = {}
+        result = card_ocr.refine_fields(content, card, fields=fields, stats=stats, source=image_path)
+        return jsonify({
+            'status': 'success',
+            'data': to_card_data(result),
+            'stats': stats
+        })
+
+    except QuotaExceeded as e:
+        return quota_response(e)
+    except Exception as e:
+        logger.error(f"欄位重新辨識失敗: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'error': f'欄位重新辨識失敗: {str(e)}'
+        }), 500
+
+@bp.route('/api/ocr/batch', methods=['POST'])
+def process_ocr_batch():
+    """批次處理多張名片的OCR請求
+
+    接受JSON格式的 image_paths 列表，或 multipart 的多個 files 欄位。
+    結果依輸入順序返回，每個項目包含各自的狀態與耗時。
+    """
+    items = []
+    if request.files:
+        for file in request.files.getlist('files'):
+            if not file.filename or not allowed_file(file.filename):
+                return jsonify({'error': f'不支援的檔案類型: {file.filename}'}), 400
+            items.append({'source': file.filename, 'content': file.read()})
+        max_workers = request.form.get('max_workers', type=int)
+    else:
+        data = request.json
+        if not data or not data.get('image_paths'):
+            return jsonify({'error': '缺少圖片路徑列表'}), 400
+        items = [{'source': path, 'path': path} for path in data['image_paths']]
+        max_workers = data.get('max_workers')
+        if max_workers is not None:
+            try:
+                max_workers = int(max_workers)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'max_workers 需為整數'}), 400
+
+    if not items:
+        return jsonify({'error': '沒有檔案'}), 400
+
+    if len(items) > OCR_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'單次最多處理 {OCR_BATCH_MAX_ITEMS} 張圖片'}), 400
+
+    max_workers = batch_workers(max_workers)
+
+    def process_item(item):
+        stats = {}
+        if 'content' in item:
+            result = card_ocr.process_image_bytes(item['content'], stats=stats, source=item['source'])
+        else:
+            result = card_ocr.process_image_bytes(load_image(item['path']), stats=stats, source=item['path'])
+        item['stats'] = stats
+        return result
+
+    logger.info(f"開始批次處理OCR: {len(items)} 張圖片, 並行數 {max_workers}")
+    start = time.perf_counter()
+    outcomes = run_bounded(process_item, items, max_workers=max_workers)
+    total_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    results = []
+    for item, outcome in zip(items, outcomes):
+        entry = {
+            'index': outcome['index'],
+            'source': item['source'],
+            'status': outcome['status'],
+            'elapsed_ms': outcome['elapsed_ms'],
+            'stats': item.get('stats', {})
+        }
+        if outcome['status'] == 'success':
+            entry['data'] = to_card_data(outcome['result'])
+        else:
+            entry['error'] = outcome['error'] or '無法辨識名片資訊'
+        results.append(entry)
+
+    succeeded = sum(1 for entry in results if entry['status'] == 'success')
+    logger.info(f"批次OCR處理完成: 成功 {succeeded}/{len(results)}, 耗時 {total_ms}ms")
+    return jsonify({
+        'status': 'success',
+        'data': results,
+        'summary': {
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'max_workers': max_workers,
+            'elapsed_ms': total_ms,
+            'images_per_second': round(len(results) / (total_ms / 1000), 2) if total_ms else 0.0
+        }
+    })
+
+@bp.route('/api/ocr/ingest', methods=['POST'])
+def ingest_ocr():
+    """大量匯入：辨識ZIP壓縮檔或多頁PDF中的所有名片
+
+    multipart欄位：file（zip、pdf或單張圖片）、選填的 max_workers。
+    上傳檔案由Werkzeug暫存於磁碟，逐一解出項目後送入OCR，同時處理中的項目數固定；
+    以NDJSON逐行回報進度：每個項目一行 item 事件（依完成順序），最後一行 done 摘要。
+    """
+    file = request.files.get('file')
+    if file is None or not file.filename:
+        return jsonify({'error': '沒有檔案'}), 400
+    if not allowed_ingest_file(file.filename):
+        return jsonify({'error': f'不支援的檔案類型: {file.filename}'}), 400
+    max_workers = batch_workers(request.form.get('max_workers', type=int))
+    filename = secure_filename(file.filename) or 'upload'
+
+    def process_item(item):
+        if item['skipped']:
+            raise ValueError(item['skipped'])
+        content = item.pop('content')
+        return card_ocr.process_image_bytes(content, stats=item['stats'], source=item['source'])
+
+    def generate():
+        logger.info(f"開始大量匯入: {filename}, 並行數 {max_workers}")
+        start = time.perf_counter()
+        succeeded = failed = 0
+        # 處理中的項目（圖片內容在送入OCR時即移除，只保留來源與統計）
+        in_flight = {}
+
+        def items():
+            for index, item in enumerate(iter_ingest_items(file.stream, filename)):
+                if index >= OCR_INGEST_MAX_ITEMS:
+                    raise IngestError(f'單一檔案最多處理 {OCR_INGEST_MAX_ITEMS} 張名片')
+                item['stats'] = {}
+                in_flight[index] = item
+                yield item
+
+        try:
+            for outcome in iter_bounded(process_item, items(), max_workers=max_workers,
+                                        max_in_flight=max_workers * 2):
+                item = in_flight.pop(outcome['index'])
+                entry = {
+                    'event': 'item',
+                    'index': outcome['index'],
+                    'source': item['source'],
+                    'status': outcome['status'],
+                    'elapsed_ms': outcome['elapsed_ms'],
+                    'stats': item['stats']
+                }
+                if outcome['status'] == 'success':
+                    entry['data'] = to_card_data(outcome['result'])
+                    succeeded += 1
+                else:
+                    entry['error'] = outcome['error'] or '無法辨識名片資訊'
+                    failed += 1
+                yield json.dumps(entry, ensure_ascii=False) + '\n'
+        except IngestError as e:
+            logger.error(f"大量匯入失敗: {filename}, {str(e)}")
+            yield json.dumps({'event': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+        except Exception as e:
+            logger.error(f"大量匯入失敗: {filename}, {str(e)}")
+            yield json.dumps({'event': 'error', 'error': f'大量匯入失敗: {str(e)}'}, ensure_ascii=False) + '\n'
+
+        total_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"大量匯入完成: {filename}, 成功 {succeeded}/{succeeded + failed}, 耗時 {total_ms}ms")
+        yield json.dumps({
+            'event': 'done',
+            'summary': {
+                'total': succeeded + failed,
+                'succeeded': succeeded,
+                'failed': failed,
+                'max_workers': max_workers,
+                'elapsed_ms': total_ms,
+                'images_per_second': round((succeeded + failed) / (total_ms / 1000), 2) if total_ms else 0.0
+            }
+        }, ensure_ascii=False) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/ocr/sheet', methods=['POST'])
+def process_ocr_sheet():
+    """辨識一張照片中的多張名片
+
+    接受 multipart 的 file 欄位，或JSON格式的 image_path。
+    """
+    if 'file' in request.files:
+        file = request.files['file']
+        if not file.filename or not allowed_file(file.filename):
+            return jsonify({'error': '不支援的檔案類型'}), 400
+        source = file.filename
+        content = file.read()
+    else:
+        data = request.json
+        if not data or 'image_path' not in data:
+            return jsonify({'error': '缺少圖片路徑'}), 400
+        source = data['image_path']
+        try:
+            content = load_image(source)
+        except OSError as e:
+            logger.error(f"讀取圖片失敗: {source}, {str(e)}")
+            return jsonify({'status': 'error', 'error': '無法讀取圖片'}), 400
+
+    try:
+        logger.info(f"開始處理多張名片OCR: {source}")
+        stats = {}
+        cards = card_ocr.process_card_sheet(content, stats=stats, source=source)
+
+        results = []
+        for index, item in enumerate(cards):
+            entry = {
+                'index': index,
+                'bbox': item['bbox'],
+                'status': item['status'],
+                'elapsed_ms': item['elapsed_ms'],
+                'stats': item['stats']
+            }
+            if item['status'] == 'success':
+                entry['data'] = to_card_data(item['card'])
+            else:
+                entry['error'] = item['error'] or '無法辨識名片資訊'
+            results.append(entry)
+
+        logger.info(f"多張名片OCR處理完成: {source}, 共 {len(results)} 張")
+        return jsonify({
+            'status': 'success',
+            'data': results,
+            'stats': stats
+        })
+
+    except Exception as e:
+        logger.error(f"多張名片OCR處理失敗: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'error': f'OCR處理失敗: {str(e)}'
+        }), 500
+
+@bp.route('/api/ocr/cache', methods=['GET'])
+def ocr_cache_stats():
+    """取得OCR結果快取的命中統計"""
+    if not card_ocr.cache:
+        return jsonify({
+            'status': 'error',
+            'error': 'OCR結果快取未啟用'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'data': card_ocr.cache.stats()
+    })
+
+@bp.route('/api/company-cache', methods=['GET'])
+def company_cache_stats():
+    """取得公司分析快取的命中統計"""
+    if not company_analyzer.company_cache:
+        return jsonify({
+            'status': 'error',
+            'error': '公司分析快取未啟用'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'data': company_analyzer.company_cache.stats()
+    })
+
+@bp.route('/api/ocr/dedup', methods=['GET'])
+def ocr_dedup_stats():
+    """取得名片重複偵測的命中統計"""
+    if not card_ocr.dedup:
+        return jsonify({
+            'status': 'error',
+            'error': '名片重複偵測未啟用'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'data': card_ocr.dedup.stats()
+    })
+
+@bp.route('/api/ocr/preprocess', methods=['GET'])
+def ocr_preprocess_stats():
+    """取得前處理各步驟的像素縮減量與OCR成功率統計"""
+    return jsonify({
+        'status': 'success',
+        'data': card_ocr.preprocess_stats.snapshot()
+    })
+
+@bp.route('/api/ocr/backends', methods=['GET'])
+def ocr_backends():
+    """取得OCR後端順序與可用狀態"""
+    backends = []
+    for backend in card_ocr.backends:
+        entry = {'name': backend.name, 'available': backend.available}
+        if hasattr(backend, 'stats'):
+            entry['stats'] = backend.stats()
+        backends.append(entry)
+
+    return jsonify({
+        'status': 'success',
+        'data': backends
+    })
+
+@bp.route('/api/ocr/hedge', methods=['GET'])
+def ocr_hedge_stats():
+    """取得OCR對沖請求的觸發率與尾端延遲統計"""
+    return jsonify({
+        'status': 'success',
+        'data': card_ocr.hedge_stats.snapshot()
+    })
+
+@bp.route('/api/ocr/router', methods=['GET'])
+def ocr_router_stats():
+    """取得OCR分級路由的決策統計"""
+    return jsonify({
+        'status': 'success',
+        'data': card_ocr.router_stats.snapshot()
+    })
+
+@bp.route('/api/ratelimit', methods=['GET'])
+def ratelimit_stats():
+    """取得Gemini限流統計（可用配額、進行中與等候中的呼叫數、拒絕次數）"""
+    return jsonify({
+        'status': 'success',
+        'data': gemini_limiter.stats()
+    })
+
+@bp.route('/api/idempotency', methods=['GET'])
+def idempotency_stats():
+    """取得冪等鍵的重播與等候統計"""
+    if not idempotency_store:
+        return jsonify({
+            'status': 'error',
+            'error': '冪等鍵未啟用'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'data': idempotency_store.stats()
+    })
+
+@bp.route('/api/storage', methods=['GET'])
+def storage_stats():
+    """取得上傳儲存統計（檔案數、容量、重複上傳數與最近一次垃圾回收）"""
+    return jsonify({
+        'status': 'success',
+        'data': upload_store.stats()
+    })
+
+@bp.route('/api/storage/gc', methods=['POST'])
+def storage_gc():
+    """立即執行上傳儲存垃圾回收（使用設定的保留秒數與容量上限，不接受用戶端覆寫）"""
+    report = upload_store.collect()
+    return jsonify({
+        'status': 'success',
+        'data': report
+    })
+
 @bp.route('/api/analyze', methods=['POST'])
+@idempotent
 def analyze_company():
     """分析公司資訊"""
     data = request.json
@@ -147,6 +829,8 @@ def analyze_company():
             'data': result
         })
         
+    except QuotaExceeded as e:
+        return quota_response(e)
     except Exception as e:
         logger.error(f"公司分析失敗: {str(e)}")
         return jsonify({
@@ -155,6 +839,7 @@ def analyze_company():
         }), 500
 
 @bp.route('/api/generate-email', methods=['POST'])
+@idempotent
 def generate_email():
     """生成開發信"""
     data = request.json
@@ -193,6 +878,8 @@ def generate_email():
             'data': result
         })
         
+    except QuotaExceeded as e:
+        return quota_response(e)
     except Exception as e:
         logger.error(f"開發信生成失敗: {str(e)}")
         return jsonify({
@@ -200,7 +887,112 @@ def generate_email():
             'error': f'開發信生成失敗: {str(e)}'
         }), 500
 
+@bp.route('/api/pipeline', methods=['POST'])
+@in_memory_upload
+def run_card_pipeline():
+    """一次完成名片辨識、公司分析與開發信產生，以SSE依完成順序串流各階段結果
+
+    接受 multipart 的 file（與選填的 back）欄位及 my_company 欄位（JSON字串），
+    或JSON格式的 image_path（與選填的 back_image_path）及 my_company（同 /api/generate-email）。
+    OCR完成後公司分析與詳細分析並行執行，公司分析一完成即開始產生開發信。
+
+    事件依完成順序為 ocr、analysis、details、email（data 含 status，以及 data 或 error，
+    格式分別同 /api/ocr、/api/analyze、/api/analyze-details、/api/generate-email 的回應），
+    最後為 done（各階段耗時）或 error。
+    """
+    extra = {}
+    try:
+        if request.files:
+            file = request.files.get('file')
+            back = request.files.get('back')
+            if file is None or not file.filename:
+                return jsonify({'status': 'error', 'error': '沒有檔案'}), 400
+            for upload in (file, back):
+                if upload and upload.filename and not allowed_file(upload.filename):
+                    return jsonify({'status': 'error', 'error': '不支援的檔案類型'}), 400
+            content = file.read()
+            back_content = back.read() if back and back.filename else None
+            if not content:
+                return jsonify({'status': 'error', 'error': '檔案內容為空'}), 400
+            source = f'upload:{secure_filename(file.filename)}'
+            if OCR_UPLOAD_SAVE:
+                extra['path'] = upload_saver.save(content)
+            try:
+                my_company = json.loads(request.form.get('my_company') or 'null')
+            except ValueError:
+                return jsonify({'status': 'error', 'error': 'my_company 需為JSON格式'}), 400
+        else:
+            data = request.get_json(silent=True)
+            if not data or 'image_path' not in data:
+                return jsonify({'status': 'error', 'error': '缺少圖片路徑'}), 400
+            source = data['image_path']
+            my_company = data.get('my_company')
+            try:
+                content = load_image(data['image_path'])
+                back_content = load_image(data['back_image_path']) if data.get('back_image_path') else None
+            except OSError as e:
+                logger.error(f"讀取圖片失敗: {source}, {str(e)}")
+                return jsonify({'status': 'error', 'error': '無法讀取圖片'}), 400
+    except RequestEntityTooLarge as e:
+        logger.error(f"上傳失敗: 檔案過大 - {e.description}")
+        return jsonify({'status': 'error', 'error': '檔案過大'}), 413
+
+    if not isinstance(my_company, dict) or not my_company.get('name'):
+        return jsonify({'status': 'error', 'error': '缺少寄件公司資訊'}), 400
+
+    logger.info(f"開始處理流程: {source}")
+    start = time.perf_counter()
+    stats = {}
+    events = run_pipeline(content, my_company, back_content, source=source, stats=stats)
+    # 取得OCR結果後才送出回應標頭，Gemini配額不足時仍可返回429
+    try:
+        first = next(events)
+    except QuotaExceeded as e:
+        return quota_response(e, extra)
+    except Exception as e:
+        logger.error(f"處理流程OCR失敗: {str(e)}")
+        return jsonify({'status': 'error', 'error': f'OCR處理失敗: {str(e)}'}), 500
+
+    def generate():
+        stages = {}
+        try:
+            for outcome in itertools.chain([first], events):
+                stage = outcome['stage']
+                stages[stage] = {'status': outcome['status'], 'elapsed_ms': outcome['elapsed_ms']}
+                payload = {'status': outcome['status']}
+                if outcome['status'] == 'success':
+                    payload['data'] = to_card_data(outcome['result']) if stage == 'ocr' else outcome['result']
+                else:
+                    payload['error'] = outcome['error']
+                    if 'retry_after' in outcome:
+                        payload['retry_after'] = outcome['retry_after']
+                if stage == 'ocr':
+                    payload.update(extra, stats=stats)
+                yield sse_event(stage, payload)
+        except Exception as e:
+            logger.error(f"處理流程失敗: {str(e)}")
+            yield sse_event('error', {'status': 'error', 'error': f'處理流程失敗: {str(e)}'})
+            return
+
+        total_ms = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"處理流程完成: {source}, 耗時 {total_ms}ms")
+        statuses = {stage['status'] for stage in stages.values()}
+        yield sse_event('done', {
+            'status': 'success' if statuses == {'success'} else ('partial' if 'success' in statuses else 'error'),
+            'stages': stages,
+            'elapsed_ms': total_ms,
+            # 依序呼叫各階段所需的時間，供比較
+            'sequential_ms': round(sum(stage['elapsed_ms'] for stage in stages.values()), 2)
+        })
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @bp.route('/api/send-email', methods=['POST'])
+@idempotent
 def send_email():
     """發送開發信"""
     data = request.json
@@ -239,6 +1031,7 @@ def send_email():
         }), 500
 
 @bp.route('/api/analyze-details', methods=['POST'])
+@idempotent
 def analyze_company_details():
     """分析公司詳細資料"""
     data = request.json
@@ -279,6 +1072,8 @@ def analyze_company_details():
             'data': result
         })
         
+    except QuotaExceeded as e:
+        return quota_response(e)
     except Exception as e:
         logger.error(f"公司詳細分析失敗: {str(e)}")
         return jsonify({
@@ -0,0 +1,221 @@
+"""
+名片OCR與客戶開發信系統 - 效能指標模組
+
+記錄各處理階段的耗時分佈、各路由的請求數與錯誤數、以及備用路徑的使用次數，
+並以Prometheus文字格式（0.0.4版）輸出於 /metrics。不依賴 prometheus_client。
+
+處理階段（stage 標籤）：
+- upload_save：上傳圖片寫入儲存
+- image_decode：圖片解碼
+- gemini：Gemini OCR請求（串流模式為完整串流時間）
+- gemini_analyze：Gemini公司分析與開發信產生
+- vision：Vision API文字偵測
+- json_parse：模型回覆的JSON解析（不含請模型修正的時間）
+- sheets_append：寫入Google Sheets
+- gmail_send：Gmail寄信
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# 預設的耗時分佈區間（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    """跳脫標籤值中的反斜線、雙引號與換行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """只增不減的計數器"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        """增加計數"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """取得目前計數"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        """產生Prometheus文字格式的樣本行"""
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}'
+
+
+class Histogram:
+    """數值分佈（累積區間計數、總和與次數）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """記錄一個數值"""
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def collect(self):
+        """產生Prometheus文字格式的樣本行"""
+        with self._lock:
+            series = sorted((key, dict(value, counts=list(value['counts']))) for key, value in self._series.items())
+        for key, value in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, value['counts']):
+                cumulative += count
+                bucket_labels = labels + [('le', _format_value(bound))]
+                yield f'{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {_format_value(value["sum"])}'
+            yield f'{self.name}_count{_format_labels(labels)} {value["count"]}'
+
+
+class MetricsRegistry:
+    """指標登錄表"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """輸出Prometheus文字格式"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# 建立全域指標
+registry = MetricsRegistry()
+stage_seconds = registry.histogram(
+    'card_stage_duration_seconds', '各處理階段耗時（秒）', ('stage', 'outcome')
+)
+http_requests = registry.counter(
+    'card_http_requests_total', '各路由的請求數', ('endpoint', 'method', 'status')
+)
+http_request_seconds = registry.histogram(
+    'card_http_request_duration_seconds', '各路由產生回應標頭的耗時（秒）', ('endpoint',)
+)
+http_errors = registry.counter(
+    'card_http_errors_total', '各路由的錯誤數（client：4xx，server：5xx，exception：未處理的例外）',
+    ('endpoint', 'kind')
+)
+fallbacks = registry.counter(
+    'card_fallbacks_total', '改用備用路徑的次數', ('component', 'reason')
+)
+rate_limit_rejections = registry.counter(
+    'card_rate_limit_rejections_total', '限流器拒絕的呼叫數（queue_full、timeout、upstream）', ('limiter', 'reason')
+)
+rate_limit_wait_seconds = registry.histogram(
+    'card_rate_limit_wait_seconds', '等候限流配額的時間（秒）', ('limiter',)
+)
+idempotency_requests = registry.counter(
+    'card_idempotency_requests_total',
+    '帶冪等鍵的請求數（started、replayed、invalid_key、mismatch、in_progress）', ('endpoint', 'outcome')
+)
+
+
+@contextmanager
+def observe_stage(stage):
+    """記錄處理階段的耗時，區塊拋出例外時 outcome 為 error"""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'success'
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage, outcome=outcome)
+
+
+def record_fallback(component, reason):
+    """記錄一次備用路徑"""
+    fallbacks.inc(component=component, reason=reason)
+
+
+def init_app(app):
+    """為Flask應用程式加上請求計數與耗時記錄
+
+    串流回應（SSE、NDJSON）的耗時只計算到回應標頭產生為止。
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or 'unmatched'
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            http_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+        http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            http_errors.inc(endpoint=endpoint, kind='server')
+        elif response.status_code >= 400:
+            http_errors.inc(endpoint=endpoint, kind='client')
+        return response
+
+    @app.teardown_request
+    def record_exception(error):
+        if error is not None:
+            http_errors.inc(endpoint=request.endpoint or 'unmatched', kind='exception')
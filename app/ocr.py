@@ -3,173 +3,1154 @@
 """
 import os
 import io
+import asyncio
+import hashlib
 import logging
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
-import google.generativeai as genai
-from google.oauth2 import service_account
-from google.cloud import vision
+from app.backends import create_backends, record_response
+from app.batch import run_bounded
+from app.cache import OCRResultCache
+from app.cardmerge import merge_card_sides, normalize_bilingual
+from app.dedup import DuplicateIndex
+from app.hedge import LatencyTracker, HedgeStats
+from app.jsonstream import JSONFieldStream
+from app.llm_json import parse_llm_json, parse_llm_json_async, LLMJSONError
+from app.lazy import LazyInstance
+from app.metrics import observe_stage, record_fallback
+from app.preprocess import ImagePreprocessor, PreprocessStats
+from app.ratelimit import GovernedModel, QuotaExceeded, gemini_limiter
+from app.refine import (
+    locate_field, vision_text_lines, crop_region, accept_answer, estimate_image_tokens
+)
+from app.router import RouterStats, score_card
+from app.segment import split_cards, find_text_lines
+from app.textmatch import (
+    EMAIL_RE, WEBSITE_RE, PHONE_RE, TAX_ID_RE, TITLE_RE,
+    card_classifier, fallback_classifier,
+    COMPANY, TITLE, ADDRESS, PHONE_LABEL, MOBILE_LABEL, TAX_LABEL, WEBSITE_HINT, EMAIL_HINT, NAME_EXCLUDE,
+    VALUE_HINTS
+)
+from app.config import (
+    OCR_CACHE_ENABLED, OCR_CACHE_PATH, OCR_CACHE_MAX_ENTRIES, OCR_CACHE_MAX_BYTES,
+    OCR_PREPROCESS_ENABLED, OCR_MAX_EDGE, OCR_GRAYSCALE, OCR_IMAGE_FORMAT, OCR_IMAGE_QUALITY,
+    OCR_DESKEW_ENABLED, OCR_CROP_ENABLED, OCR_DESKEW_MAX_ANGLE, OCR_GEOMETRY_HOLDOUT,
+    OCR_BATCH_MAX_WORKERS, OCR_SEGMENT_MIN_AREA, OCR_SEGMENT_MAX_CARDS,
+    OCR_HEDGE_ENABLED, OCR_HEDGE_PERCENTILE, OCR_HEDGE_MIN_SAMPLES, OCR_HEDGE_DELAY_SECONDS,
+    OCR_HEDGE_MAX_WORKERS, OCR_ROUTER_ENABLED, OCR_ROUTER_THRESHOLD, OCR_ROUTER_ESCALATION,
+    OCR_DEDUP_ENABLED, OCR_DEDUP_PATH, OCR_DEDUP_THRESHOLD, OCR_DEDUP_CONFIRM_THRESHOLD, OCR_DEDUP_MAX_ENTRIES,
+    OCR_PAIR_MODE, OCR_BACKENDS, OCR_STUB_RECORDINGS, OCR_STUB_LATENCY, OCR_STUB_ERROR_RATE, OCR_STUB_SEED,
+    OCR_RECORD_RESPONSES_PATH
+)
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 判斷OCR結果是否可用的關鍵欄位
+KEY_CARD_FIELDS = ('name', 'company', 'email', 'phone', 'mobile')
+
+
+class FallbackCard(dict):
+    """Gemini回覆不是有效JSON時以規則解析回覆文字得到的名片（降級結果，不寫入快取）"""
+
+
+# 名片欄位說明（用於只擷取部分欄位的提示詞）
+FIELD_DESCRIPTIONS = {
+    'name': '人名',
+    'title': '職稱',
+    'company': '公司名稱',
+    'phone': '電話號碼',
+    'mobile': '手機號碼',
+    'email': '電子郵件',
+    'address': '地址',
+    'website': '網站',
+    'tax_id': '統一編號（8位數字）'
+}
+
+# Gemini OCR回覆的欄位定義
+CARD_SCHEMA = {
+    'fields': {field: str for field in FIELD_DESCRIPTIONS},
+    'required': ()
+}
+
+# Gemini OCR使用的模型
+GEMINI_OCR_MODEL = 'gemini-2.5-flash-preview-05-20'
+
+# Gemini OCR提示詞
+GEMINI_OCR_PROMPT = """
+這是一張名片圖片。請執行OCR提取所有文字，並將資訊結構化為以下JSON格式：
+{
+  "name": "人名",
+  "title": "職稱",
+  "company": "公司名稱",
+  "phone": "電話號碼",
+  "mobile": "手機號碼",
+  "email": "電子郵件",
+  "address": "地址",
+  "website": "網站",
+  "tax_id": "統一編號（如果有）",
+  "raw_text": "完整提取的文字"
+}
+
+請注意：
+1. 名片通常包含人名、職稱、公司名稱、聯絡資訊等
+2. 人名通常位於名片上方，字體較大
+3. 統一編號通常是8位數字，可能標示為「統一編號」或「統編」
+4. 請盡可能準確提取所有資訊
+5. 如果某些欄位資訊不存在，請將對應值設為空字串
+6. 只需回覆JSON格式，不需要其他說明
+"""
+
+# 只擷取指定欄位的精簡提示詞
+GEMINI_FIELDS_PROMPT = """
+這是一張名片圖片。請只擷取以下欄位，並以JSON格式回覆：
+{fields}
+
+如果某個欄位不存在，請將對應值設為空字串。只需回覆JSON格式，不需要其他說明。
+"""
+
+# 雙面名片OCR提示詞（正反面圖片在同一次呼叫中送出）
+GEMINI_PAIR_PROMPT = """
+這兩張圖片是同一張名片的正面與背面（第一張為正面，第二張為背面），通常一面為中文、另一面為英文。
+請合併兩面的資訊，將結果結構化為以下JSON格式：
+{
+  "name": "中文人名",
+  "name_en": "英文人名",
+  "title": "中文職稱",
+  "title_en": "英文職稱",
+  "company": "中文公司名稱",
+  "company_en": "英文公司名稱",
+  "phone": "電話號碼",
+  "mobile": "手機號碼",
+  "email": "電子郵件",
+  "address": "中文地址",
+  "address_en": "英文地址",
+  "website": "網站",
+  "tax_id": "統一編號（如果有）",
+  "raw_text": "兩面完整提取的文字"
+}
+
+請注意：
+1. 兩面重複出現的電話、電子郵件、網站只需填寫一次
+2. 如果名片只有一種語言，對應的中文或英文欄位請設為空字串
+3. 統一編號通常是8位數字，可能標示為「統一編號」或「統編」
+4. 如果某些欄位資訊不存在，請將對應值設為空字串
+5. 只需回覆JSON格式，不需要其他說明
+"""
+
+# 雙面名片OCR回覆的欄位定義
+CARD_PAIR_SCHEMA = {
+    'fields': dict(
+        CARD_SCHEMA['fields'],
+        name_en=str, title_en=str, company_en=str, address_en=str, raw_text=str
+    ),
+    'required': ()
+}
+
 class BusinessCardOCR:
     """名片OCR類別"""
     
     def __init__(self):
         """初始化OCR處理器"""
         self.vision_client = None
+        self.vision_credentials = None
         self.gemini_model = None
+        self._vision_async_client = None
+        self._vision_async_loop = None
+        self.cache = None
+        self.dedup = None
+        self.gemini_latency = LatencyTracker()
+        self.hedge_stats = HedgeStats()
+        self.router_stats = RouterStats()
+        self.preprocess_stats = PreprocessStats()
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=OCR_HEDGE_MAX_WORKERS, thread_name_prefix='ocr-hedge'
+        )
+        self.preprocessor = ImagePreprocessor(
+            max_edge=OCR_MAX_EDGE,
+            grayscale=OCR_GRAYSCALE,
+            image_format=OCR_IMAGE_FORMAT,
+            quality=OCR_IMAGE_QUALITY,
+            enabled=OCR_PREPROCESS_ENABLED,
+            deskew=OCR_DESKEW_ENABLED,
+            crop=OCR_CROP_ENABLED,
+            max_angle=OCR_DESKEW_MAX_ANGLE,
+            holdout=OCR_GEOMETRY_HOLDOUT
+        )
         
         # 檢查是否有設定Google Cloud認證
         credentials_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
         gemini_api_key = os.environ.get('GEMINI_API_KEY')  # Required: set via environment variable
         
-        # 初始化Vision API客戶端（作為備用）
-        if credentials_path and os.path.exists(credentials_path):
+        # 初始化Vision API客戶端（作為備用；未設定vision後端時不建立）
+        if 'vision' in OCR_BACKENDS and credentials_path and os.path.exists(credentials_path):
             try:
+                from google.oauth2 import service_account
+                from google.cloud import vision
                 credentials = service_account.Credentials.from_service_account_file(credentials_path)
                 self.vision_client = vision.ImageAnnotatorClient(credentials=credentials)
+                self.vision_credentials = credentials
                 logger.info("Google Vision API客戶端初始化成功")
             except Exception as e:
                 logger.error(f"初始化Google Vision API客戶端失敗: {str(e)}")
-        else:
+        elif 'vision' in OCR_BACKENDS:
             logger.warning("未設定Google Cloud認證或檔案不存在，Vision API功能可能無法正常運作")
         
-        # 初始化Gemini API客戶端
+        # 初始化Gemini API客戶端（未設定gemini後端時不建立）
+        if 'gemini' in OCR_BACKENDS:
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=gemini_api_key)
+                # 使用Gemini 2.5 Flash模型（經由共用的Gemini限流器呼叫）
+                self.gemini_model = GovernedModel(genai.GenerativeModel(GEMINI_OCR_MODEL), gemini_limiter)
+                logger.info("Gemini API客戶端初始化成功")
+            except Exception as e:
+                logger.error(f"初始化Gemini API客戶端失敗: {str(e)}")
+                logger.warning("Gemini API初始化失敗，OCR功能可能無法正常運作")
+        
+        # 依設定順序建立OCR後端
+        self.backends = create_backends(OCR_BACKENDS, self, stub={
+            'recordings_path': OCR_STUB_RECORDINGS,
+            'latency': OCR_STUB_LATENCY,
+            'error_rate': OCR_STUB_ERROR_RATE,
+            'seed': OCR_STUB_SEED
+        })
+        
+        # 初始化OCR結果快取
+        if OCR_CACHE_ENABLED:
+            try:
+                self.cache = OCRResultCache(
+                    OCR_CACHE_PATH,
+                    max_entries=OCR_CACHE_MAX_ENTRIES,
+                    max_bytes=OCR_CACHE_MAX_BYTES
+                )
+            except Exception as e:
+                logger.error(f"初始化OCR結果快取失敗: {str(e)}")
+        
+        # 初始化名片重複偵測索引
+        if OCR_DEDUP_ENABLED:
+            try:
+                self.dedup = DuplicateIndex(
+                    OCR_DEDUP_PATH,
+                    version=self.cache_version,
+                    threshold=OCR_DEDUP_THRESHOLD,
+                    confirm_threshold=OCR_DEDUP_CONFIRM_THRESHOLD,
+                    max_entries=OCR_DEDUP_MAX_ENTRIES
+                )
+            except Exception as e:
+                logger.error(f"初始化名片重複偵測索引失敗: {str(e)}")
+    
+    @property
+    def cache_version(self):
+        """快取版本：模型、提示詞或前處理設定變更時，舊的快取結果自動失效"""
+        fingerprint = (
+            f"{GEMINI_OCR_MODEL}\n{GEMINI_OCR_PROMPT}\n{self.preprocessor.fingerprint}\n"
+            f"{','.join(OCR_BACKENDS)}"
+        )
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+    
+    def process_image(self, image_path, stats=None):
+        """處理圖片並辨識文字
+        
+        Args:
+            image_path: 圖片檔案路徑
+            stats: 選填的dict，用於收集本次處理的快取與耗時資訊
+        """
+        try:
+            with io.open(image_path, 'rb') as image_file:
+                content = image_file.read()
+        except OSError as e:
+            logger.error(f"讀取圖片失敗: {image_path}, {str(e)}")
+            return None
+        
+        return self.process_image_bytes(content, stats=stats, source=image_path)
+    
+    def process_image_pair(self, front_path, back_path, stats=None):
+        """處理雙面名片圖片檔案並合併為一張名片
+        
+        Args:
+            front_path: 正面圖片檔案路徑
+            back_path: 背面圖片檔案路徑
+            stats: 選填的dict，用於收集本次處理的快取與耗時資訊
+        """
         try:
-            genai.configure(api_key=gemini_api_key)
-            # 使用Gemini 2.5 Flash模型
-            self.gemini_model = genai.GenerativeModel('gemini-2.5-flash-preview-05-20')
-            logger.info("Gemini API客戶端初始化成功")
+            with io.open(front_path, 'rb') as image_file:
+                front = image_file.read()
+            with io.open(back_path, 'rb') as image_file:
+                back = image_file.read()
+        except OSError as e:
+            logger.error(f"讀取圖片失敗: {front_path}, {back_path}, {str(e)}")
+            return None
+        
+        return self.process_card_pair(front, back, stats=stats, source=front_path)
+    
+    def process_image_bytes(self, content, stats=None, source='<memory>'):
+        """處理記憶體中的圖片內容並辨識文字
+        
+        Args:
+            content: 圖片的原始位元組
+            stats: 選填的dict，用於收集本次處理的快取與耗時資訊
+            source: 記錄日誌用的來源描述（例如檔案路徑）
+        """
+        if stats is None:
+            stats = {}
+        
+        cache_key, signature, known = self._lookup_known(content, stats, source)
+        if known is not None:
+            return known
+        
+        start = time.perf_counter()
+        image_data, mime_type = self._prepare_image(content, stats, source)
+        result = self._run_ocr(image_data, mime_type, source, stats)
+        stats['ocr_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        self._record_preprocess(stats, result)
+        
+        self._remember(result, cache_key, signature, source, stats)
+        return result
+    
+    async def process_image_bytes_async(self, content, stats=None, source='<memory>'):
+        """process_image_bytes 的非同步版本（ASGI模式使用）
+        
+        快取查詢與圖片前處理在執行緒中執行；OCR後端以原生非同步客戶端呼叫，
+        等待回應時不佔用執行緒。依設定順序嘗試後端（不使用分級路由與對沖請求）。
+        """
+        if stats is None:
+            stats = {}
+        
+        cache_key, signature, known = await asyncio.to_thread(self._lookup_known, content, stats, source)
+        if known is not None:
+            return known
+        
+        start = time.perf_counter()
+        image_data, mime_type = await asyncio.to_thread(self._prepare_image, content, stats, source)
+        result = await self._run_backends_async(image_data, mime_type, source, stats)
+        stats['ocr_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        self._record_preprocess(stats, result)
+        
+        await asyncio.to_thread(self._remember, result, cache_key, signature, source, stats)
+        return result
+    
+    def stream_image_bytes(self, content, stats=None, source='<memory>'):
+        """以串流方式辨識圖片，欄位一完成即產生事件
+        
+        第一個可用後端支援串流時（Gemini或重播後端），回應以增量JSON解析器處理；
+        快取命中、重複名片或改用其他後端時，所有欄位在取得結果後一次產生。
+        
+        Args:
+            content: 圖片的原始位元組
+            stats: 選填的dict，用於收集本次處理的快取與耗時資訊
+            source: 記錄日誌用的來源描述
+        
+        Yields:
+            tuple: ('field', 欄位名稱, 值) 或最後的 ('result', 名片dict或None, None)
+        """
+        if stats is None:
+            stats = {}
+        
+        start = time.perf_counter()
+        first_field_ms = None
+        streamed = set()
+        
+        cache_key, signature, result = self._lookup_known(content, stats, source)
+        if result is None:
+            image_data, mime_type = self._prepare_image(content, stats, source)
+            
+            backend = self._available_backends()[:1]
+            backend = backend[0] if backend and backend[0].streaming else None
+            if backend:
+                try:
+                    parser = JSONFieldStream()
+                    for text in backend.stream(image_data, mime_type, source):
+                        for field, value in parser.feed(text):
+                            if first_field_ms is None:
+                                first_field_ms = round((time.perf_counter() - start) * 1000, 2)
+                            streamed.add(field)
+                            yield 'field', field, value
+                    
+                    try:
+                        result = parse_llm_json(parser.text, CARD_SCHEMA)
+                    except LLMJSONError:
+                        logger.error(f"串流回應不是有效的JSON: {parser.text}")
+                        record_fallback('json_parse', 'text_fallback')
+                        result = self._parse_text_fallback(parser.text)
+                    stats['backend'] = backend.name
+                    logger.info(f"成功使用 {backend.name} 串流處理圖片文字: {source}")
+                except QuotaExceeded:
+                    raise
+                except Exception as e:
+                    logger.error(f"使用 {backend.name} 串流處理圖片失敗: {str(e)}")
+                    record_fallback('ocr_stream', f'{backend.name}_error')
+            
+            if result is None:
+                result = self._run_backends(image_data, mime_type, source, stats, skip=backend)
+            
+            stats['ocr_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self._record_preprocess(stats, result)
+            self._remember(result, cache_key, signature, source, stats)
+        
+        # 補送未以串流產生的欄位（快取、重複名片、備用解析或Vision API結果）
+        for field, value in (result or {}).items():
+            if field not in streamed:
+                if first_field_ms is None:
+                    first_field_ms = round((time.perf_counter() - start) * 1000, 2)
+                yield 'field', field, value
+        
+        stats['time_to_first_field_ms'] = first_field_ms
+        stats['fields_streamed'] = len(streamed)
+        stats['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        logger.info(f"串流OCR完成: {source}, 首個欄位 {first_field_ms}ms, 共 {stats['total_ms']}ms")
+        yield 'result', result, None
+    
+    def _lookup_known(self, content, stats, source):
+        """查詢OCR結果快取與重複名片索引
+        
+        Returns:
+            tuple: (快取鍵, 名片簽章, 已知的辨識結果或None)
+        """
+        # 先查詢OCR結果快取，重複上傳的名片不再呼叫API
+        cache_key = None
+        if self.cache:
+            cache_key = OCRResultCache.make_key(content, self.cache_version)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                stats['cache'] = 'hit'
+                logger.info(f"OCR快取命中: {source}")
+                return cache_key, None, cached
+            stats['cache'] = 'miss'
+        
+        # 再查詢外觀相近且文字區域相同的名片（同一張名片重拍）
+        signature, duplicate = self._find_duplicate(content, stats, source)
+        if duplicate is not None:
+            self._remember(duplicate['result'], cache_key, None, source, stats)
+            return cache_key, signature, duplicate['result']
+        
+        return cache_key, signature, None
+    
+    def _is_degraded(self, result, stats):
+        """辨識結果是否來自降級路徑：Gemini回覆的規則解析，或前一個後端失敗後改用的後端結果
+        
+        後端失敗後的備援路徑會在stats設定degraded；分級路由的Vision結果、對沖請求中
+        Vision先完成的結果屬於正常路徑，照常寫入快取。
+        """
+        return isinstance(result, FallbackCard) or bool(stats.get('degraded'))
+    
+    def _remember(self, result, cache_key, signature, source, stats):
+        """將辨識結果寫入重複名片索引與OCR結果快取（降級結果只返回不保存，下次重新辨識）"""
+        if not result:
+            return
+        
+        if self._is_degraded(result, stats):
+            stats['degraded'] = True
+            logger.info(f"降級的辨識結果不寫入快取: {source}, 後端 {stats.get('backend')}")
+            return
+        
+        if signature is not None:
+            try:
+                self.dedup.add(signature, result, source=source)
+            except Exception as e:
+                logger.error(f"寫入名片重複偵測索引失敗: {str(e)}")
+        
+        if cache_key:
+            try:
+                self.cache.put(cache_key, result)
+            except Exception as e:
+                logger.error(f"寫入OCR快取失敗: {str(e)}")
+    
+    def _find_duplicate(self, content, stats, source):
+        """計算名片簽章並搜尋重複名片
+        
+        Returns:
+            tuple: (簽章, 重複名片資訊)；未啟用或計算失敗時簽章為None
+        """
+        if not self.dedup:
+            return None, None
+        
+        start = time.perf_counter()
+        try:
+            signature = self.dedup.hash_image(content)
+            duplicate = self.dedup.lookup(signature)
         except Exception as e:
-            logger.error(f"初始化Gemini API客戶端失敗: {str(e)}")
-            logger.warning("Gemini API初始化失敗，OCR功能可能無法正常運作")
+            logger.error(f"名片重複偵測失敗: {source}, {str(e)}")
+            return None, None
+        
+        report = {
+            'hash': format(signature[0], 'x'),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+            'duplicate': duplicate is not None
+        }
+        if duplicate is not None:
+            report['distance'] = duplicate['distance']
+            report['ink_distance'] = duplicate['ink_distance']
+            report['duplicate_of'] = duplicate['source']
+            logger.info(f"偵測到重複名片: {source} 與 {duplicate['source']} 距離 {duplicate['distance']}")
+        stats['dedup'] = report
+        return signature, duplicate
     
-    def process_image(self, image_path):
-        """處理圖片並辨識文字"""
-        # 優先使用Gemini 2.5 Flash進行OCR
-        if self.gemini_model:
+    def process_card_pair(self, front, back, stats=None, source='<memory>'):
+        """辨識雙面名片並合併為一張名片
+        
+        預設將正反面圖片放在同一次Gemini呼叫中；失敗或設定為 concurrent 時，
+        改為並行辨識兩面後依欄位合併。
+        
+        Args:
+            front: 正面圖片位元組
+            back: 背面圖片位元組
+            stats: 選填的dict，用於收集快取與耗時資訊
+            source: 記錄日誌用的來源描述
+        
+        Returns:
+            dict: 合併後的名片（含 name_en、title_en、company_en），失敗時返回None
+        """
+        if stats is None:
+            stats = {}
+        
+        cache_key = None
+        if self.cache:
+            cache_key = OCRResultCache.make_key(front + b'\0' + back, f'{self.cache_version}:pair')
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                stats['cache'] = 'hit'
+                logger.info(f"雙面名片OCR快取命中: {source}")
+                return cached
+            stats['cache'] = 'miss'
+        
+        start = time.perf_counter()
+        result = None
+        
+        if OCR_PAIR_MODE == 'single' and self.gemini_model:
             try:
-                return self._process_with_gemini(image_path)
+                result = self._process_pair_with_gemini(front, back, stats, source)
+                stats['pair_mode'] = 'single'
+            except QuotaExceeded:
+                raise
             except Exception as e:
-                logger.error(f"使用Gemini處理圖片失敗: {str(e)}")
-                logger.info("嘗試使用備用Vision API...")
+                logger.error(f"Gemini雙面名片辨識失敗，改為分別辨識: {str(e)}")
+                record_fallback('card_pair', 'single_failed')
         
-        # 備用：使用Google Vision API
+        if not self._is_acceptable(result):
+            sides = [('front', front), ('back', back)]
+            side_stats = {name: {} for name, _ in sides}
+            rejected = []
+            
+            def process_side(side):
+                name, content = side
+                try:
+                    return self.process_image_bytes(content, stats=side_stats[name], source=f'{source}#{name}')
+                except QuotaExceeded as e:
+                    rejected.append(e)
+                    raise
+            
+            outcomes = run_bounded(process_side, sides, max_workers=2)
+            if rejected:
+                raise rejected[0]
+            result = merge_card_sides(outcomes[0]['result'], outcomes[1]['result'])
+            stats['pair_mode'] = 'concurrent'
+            stats['sides'] = side_stats
+        
+        stats['ocr_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        
+        # 任一面為降級結果時不寫入快取
+        degraded = any(side.get('degraded') for side in stats.get('sides', {}).values())
+        if result and cache_key and not degraded:
+            try:
+                self.cache.put(cache_key, result)
+            except Exception as e:
+                logger.error(f"寫入OCR快取失敗: {str(e)}")
+        
+        return result
+    
+    def process_card_sheet(self, content, stats=None, source='<memory>'):
+        """辨識一張照片中平鋪的多張名片
+        
+        先以投影分析切割出每張名片，再並行對各張名片執行OCR。
+        
+        Args:
+            content: 原始圖片位元組
+            stats: 選填的dict，用於收集切割與處理耗時資訊
+            source: 記錄日誌用的來源描述
+        
+        Returns:
+            list: 每張名片一個dict，包含bbox、status、card、stats與elapsed_ms
+        """
+        if stats is None:
+            stats = {}
+        
+        start = time.perf_counter()
+        crops = split_cards(content, min_area=OCR_SEGMENT_MIN_AREA, max_cards=OCR_SEGMENT_MAX_CARDS)
+        stats['segment_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        stats['cards_found'] = len(crops)
+        logger.info(f"名片切割完成: {source}, 共 {len(crops)} 張")
+        
+        crop_stats = [{} for _ in crops]
+        
+        def process_crop(index):
+            bbox, crop = crops[index]
+            return self.process_image_bytes(
+                crop, stats=crop_stats[index], source=f"{source}#{index}{bbox}"
+            )
+        
+        outcomes = run_bounded(process_crop, range(len(crops)), max_workers=OCR_BATCH_MAX_WORKERS)
+        stats['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        
+        return [
+            {
+                'bbox': crops[index][0],
+                'status': outcome['status'],
+                'card': outcome['result'],
+                'error': outcome['error'],
+                'stats': crop_stats[index],
+                'elapsed_ms': outcome['elapsed_ms']
+            }
+            for index, outcome in enumerate(outcomes)
+        ]
+    
+    def refine_fields(self, content, card, fields=None, stats=None, source='<memory>'):
+        """只重新辨識名片缺少的欄位
+        
+        找出各欄位最可能所在的文字區域，只把裁切後的區域與欄位專用的
+        精簡提示詞送給Gemini；格式正確的答案才合併回原結果。
+        
+        Args:
+            content: 原始圖片位元組
+            card: 目前的名片dict
+            fields: 要重新辨識的欄位；未指定時使用缺少或格式錯誤的欄位
+            stats: 選填的dict，記錄各區域的位元組數與token估計（與整張重新辨識比較）
+            source: 記錄日誌用的來源描述
+        
+        Returns:
+            dict: 合併後的名片
+        """
+        if stats is None:
+            stats = {}
+        card = dict(card or {})
+        
+        if fields is None:
+            fields = score_card(card)['missing']
+            if 'phone' in fields and not card.get('mobile'):
+                fields.append('mobile')
+        fields = [field for field in dict.fromkeys(fields) if field in FIELD_DESCRIPTIONS]
+        report = {'fields': fields, 'filled': [], 'unresolved': list(fields), 'regions': []}
+        stats['refine'] = report
+        if not fields:
+            return card
+        if not self.gemini_model:
+            logger.error("Gemini客戶端未初始化，無法重新辨識欄位")
+            report['error'] = 'Gemini客戶端未初始化'
+            return card
+        
+        start = time.perf_counter()
+        cache_key = OCRResultCache.make_key(content, self.cache_version) if self.cache else None
+        raw_text = card.get('raw_text')
+        if not raw_text and cache_key:
+            # 前端表單不含原始文字，改由快取中的原辨識結果取得
+            raw_text = (self.cache.get(cache_key) or {}).get('raw_text')
+        
+        image_data, _ = self._prepare_image(content, stats, source)
+        image = Image.open(io.BytesIO(image_data))
+        image.load()
+        
+        lines = None
         if self.vision_client:
             try:
-                return self._process_with_vision_api(image_path)
+                lines = vision_text_lines(self.vision_client, image_data)
             except Exception as e:
-                logger.error(f"使用Vision API處理圖片失敗: {str(e)}")
+                logger.error(f"取得Vision文字外框失敗: {str(e)}")
+        line_boxes = find_text_lines(image)
+        
+        # 區域重疊的欄位合併為一次請求
+        located = sorted(
+            (locate_field(field, image.size, lines=lines, line_boxes=line_boxes, raw_text=raw_text), field)
+            for field in fields
+        )
+        regions = []
+        for (box, method), field in located:
+            previous = regions[-1] if regions else None
+            if previous and box[1] < previous['box'][3]:
+                x0, y0, x1, y1 = previous['box']
+                previous['box'] = (min(x0, box[0]), y0, max(x1, box[2]), max(y1, box[3]))
+                previous['fields'].append(field)
+                if method not in previous['method']:
+                    previous['method'] += f'+{method}'
+            else:
+                regions.append({'box': box, 'method': method, 'fields': [field]})
+        
+        rejected = []
+        
+        def ask(region):
+            crop, size = crop_region(image, region['box'], quality=self.preprocessor.quality)
+            region['bytes'] = len(crop)
+            region['image_tokens_est'] = estimate_image_tokens(size)
+            region['prompt_chars'] = len(self._fields_prompt(region['fields']))
+            try:
+                return self._process_with_gemini_fields(
+                    crop, 'image/jpeg', f"{source}#{list(region['box'])}", region['fields']
+                )
+            except QuotaExceeded as e:
+                rejected.append(e)
+                raise
+        
+        outcomes = run_bounded(ask, regions, max_workers=OCR_BATCH_MAX_WORKERS)
+        if rejected:
+            raise rejected[0]
+        for region, outcome in zip(regions, outcomes):
+            answer = outcome['result'] or {}
+            for field in region['fields']:
+                value = answer.get(field)
+                if accept_answer(field, value):
+                    card[field] = value.strip()
+                    report['filled'].append(field)
+                    report['unresolved'].remove(field)
+            report['regions'].append(dict(
+                region, box=list(region['box']), status=outcome['status'], error=outcome['error']
+            ))
+        
+        # 與整張圖片重新辨識的傳送量比較
+        report.update({
+            'bytes_sent': sum(region.get('bytes', 0) for region in regions),
+            'full_image_bytes': len(image_data),
+            'image_tokens_est': sum(region.get('image_tokens_est', 0) for region in regions),
+            'full_image_tokens_est': estimate_image_tokens(image.size),
+            'prompt_chars': sum(region.get('prompt_chars', 0) for region in regions),
+            'full_prompt_chars': len(GEMINI_OCR_PROMPT),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+        logger.info(
+            f"欄位重新辨識完成: {source}, 補齊 {report['filled']}, "
+            f"傳送 {report['bytes_sent']} / {report['full_image_bytes']} bytes"
+        )
+        
+        if report['filled'] and cache_key:
+            self._remember(card, cache_key, None, source, stats)
+        return card
+    
+    def _prepare_image(self, content, stats, source):
+        """縮放並重新編碼圖片以減少上傳量，失敗時使用原始內容"""
+        try:
+            image_data, mime_type, report = self.preprocessor.process(content)
+            stats['preprocess'] = report
+            return image_data, mime_type
+        except Exception as e:
+            logger.error(f"圖片前處理失敗，改用原始圖片: {source}, {str(e)}")
+            record_fallback('preprocess', 'error')
+            return content, 'image/jpeg'
+    
+    def _record_preprocess(self, stats, result):
+        """記錄前處理步驟與OCR是否成功，用於比較各步驟對成功率的影響"""
+        report = stats.get('preprocess')
+        if report and 'steps' in report:
+            self.preprocess_stats.record(report, self._is_acceptable(result))
+    
+    @staticmethod
+    def _is_acceptable(result):
+        """判斷OCR結果是否至少包含一個關鍵欄位"""
+        return bool(result) and any(result.get(field) for field in KEY_CARD_FIELDS)
+    
+    def _hedge_delay(self):
+        """取得觸發對沖請求前的等待秒數（依Gemini延遲百分位數估計）"""
+        if self.gemini_latency.count() >= OCR_HEDGE_MIN_SAMPLES:
+            return self.gemini_latency.percentile(OCR_HEDGE_PERCENTILE) / 1000.0
+        return OCR_HEDGE_DELAY_SECONDS
+    
+    def _timed_gemini(self, content, mime_type, source):
+        """呼叫Gemini並記錄成功請求的延遲"""
+        start = time.perf_counter()
+        result = self._process_with_gemini(content, mime_type, source)
+        self.gemini_latency.record((time.perf_counter() - start) * 1000)
+        return result
+    
+    async def _timed_gemini_async(self, content, mime_type, source):
+        """_timed_gemini 的非同步版本"""
+        start = time.perf_counter()
+        result = await self._process_with_gemini_async(content, mime_type, source)
+        self.gemini_latency.record((time.perf_counter() - start) * 1000)
+        return result
+    
+    def _run_ocr(self, content, mime_type, source, stats):
+        """依分級路由、對沖請求或設定的後端順序辨識圖片"""
+        if OCR_ROUTER_ENABLED and self.vision_client:
+            return self._run_ocr_routed(content, mime_type, source, stats)
+        
+        if OCR_HEDGE_ENABLED and self.gemini_model and self.vision_client:
+            return self._run_ocr_hedged(content, mime_type, source, stats)
+        
+        return self._run_backends(content, mime_type, source, stats)
+    
+    def _available_backends(self):
+        """可用的OCR後端（依設定順序）"""
+        return [backend for backend in self.backends if backend.available]
+    
+    def _run_backends(self, content, mime_type, source, stats, skip=None):
+        """依設定順序嘗試各OCR後端，返回第一個辨識結果
+        
+        前面的後端失敗（含串流失敗而略過的skip後端）後才取得的結果標記為降級結果。
+        """
+        failed = skip is not None
+        for backend in self._available_backends():
+            if backend is skip:
+                continue
+            try:
+                result = backend.recognize(content, mime_type, source)
+            except QuotaExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"使用 {backend.name} 處理圖片失敗: {str(e)}")
+                record_fallback('ocr_backend', f'{backend.name}_error')
+                failed = True
+                continue
+            if result is not None:
+                stats['backend'] = backend.name
+                if failed:
+                    stats['degraded'] = True
+                return result
+            record_fallback('ocr_backend', f'{backend.name}_empty')
+            failed = True
+        
+        logger.error("所有OCR處理方法均失敗")
+        return None
+    
+    async def _run_backends_async(self, content, mime_type, source, stats):
+        """_run_backends 的非同步版本"""
+        failed = False
+        for backend in self._available_backends():
+            try:
+                result = await backend.recognize_async(content, mime_type, source)
+            except QuotaExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"使用 {backend.name} 處理圖片失敗: {str(e)}")
+                record_fallback('ocr_backend', f'{backend.name}_error')
+                failed = True
+                continue
+            if result is not None:
+                stats['backend'] = backend.name
+                if failed:
+                    stats['degraded'] = True
+                return result
+            record_fallback('ocr_backend', f'{backend.name}_empty')
+            failed = True
         
         logger.error("所有OCR處理方法均失敗")
         return None
     
-    def _process_with_gemini(self, image_path):
+    def _run_ocr_hedged(self, content, mime_type, source, stats):
+        """對沖模式：Gemini超過預期延遲仍未回應時，並行啟動Vision API，採用先完成的可用結果"""
+        start = time.perf_counter()
+        delay = self._hedge_delay()
+        hedge_info = {'fired': False, 'delay_ms': round(delay * 1000, 2), 'winner': None}
+        stats['hedge'] = hedge_info
+        
+        gemini_future = self._hedge_executor.submit(self._timed_gemini, content, mime_type, source)
+        futures = {gemini_future: 'gemini'}
+        
+        done, _ = wait([gemini_future], timeout=delay)
+        if done:
+            result = self._future_result(gemini_future)
+            if self._is_acceptable(result):
+                hedge_info['winner'] = 'gemini'
+                stats['backend'] = 'gemini'
+                self.hedge_stats.record_request((time.perf_counter() - start) * 1000, False, 'gemini')
+                return result
+            # Gemini提早失敗，直接改用Vision API（降級結果）
+            record_fallback('hedge', 'gemini_failed')
+            stats['degraded'] = True
+            futures = {}
+        else:
+            logger.info(f"Gemini超過 {hedge_info['delay_ms']}ms 未回應，啟動Vision API對沖請求: {source}")
+            hedge_info['fired'] = True
+        
+        vision_future = self._hedge_executor.submit(self._process_with_vision_api, content, source)
+        futures[vision_future] = 'vision'
+        
+        result = None
+        pending = set(futures)
+        while pending and result is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                candidate = self._future_result(future)
+                if self._is_acceptable(candidate):
+                    result = candidate
+                    hedge_info['winner'] = futures[future]
+                    stats['backend'] = futures[future]
+                    break
+                if future is gemini_future:
+                    # 對沖後Gemini先以失敗結束，Vision結果改為降級結果
+                    stats['degraded'] = True
+        
+        # 取消落後的請求（已開始執行的請求無法中斷，其結果將被捨棄）
+        for future in pending:
+            future.cancel()
+        
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.hedge_stats.record_request(latency_ms, hedge_info['fired'], hedge_info['winner'])
+        
+        # 對沖勝出時，待Gemini完成後記錄節省的尾端延遲
+        if hedge_info['winner'] == 'vision' and gemini_future in pending:
+            def record_saving(future):
+                if not future.cancelled():
+                    primary_ms = (time.perf_counter() - start) * 1000
+                    self.hedge_stats.record_saving(primary_ms - latency_ms)
+            gemini_future.add_done_callback(record_saving)
+        
+        if result is None:
+            logger.error("所有OCR處理方法均失敗")
+        return result
+    
+    def _run_ocr_routed(self, content, mime_type, source, stats):
+        """分級路由：先以Vision API＋規則解析擷取，信心不足時才升級至Gemini"""
+        start = time.perf_counter()
+        cheap = self._process_with_vision_api(content, source)
+        cheap_ms = (time.perf_counter() - start) * 1000
+        
+        quality = score_card(cheap)
+        route = {
+            'score': quality['score'],
+            'missing': quality['missing'],
+            'invalid': quality['invalid'],
+            'cheap_ms': round(cheap_ms, 2)
+        }
+        stats['route'] = route
+        
+        if cheap and quality['score'] >= OCR_ROUTER_THRESHOLD and not quality['required_missing']:
+            route['decision'] = 'cheap'
+            stats['backend'] = 'vision'
+            self.router_stats.record('cheap', cheap_ms=cheap_ms)
+            logger.info(f"名片信心分數 {quality['score']}，略過Gemini: {source}")
+            return cheap
+        
+        if not self.gemini_model:
+            route['decision'] = 'cheap_only'
+            stats['backend'] = 'vision'
+            self.router_stats.record('cheap_only', cheap_ms=cheap_ms)
+            return cheap
+        
+        # 只缺少部分欄位時，以精簡提示詞請Gemini補齊；否則完整重新擷取
+        fields = list(quality['missing'])
+        if 'phone' in fields:
+            fields.append('mobile')
+        partial = cheap and OCR_ROUTER_ESCALATION == 'missing'
+        route['decision'] = 'gemini_fields' if partial else 'gemini_full'
+        logger.info(f"名片信心分數 {quality['score']}，升級至Gemini（{route['decision']}）: {source}")
+        
+        gemini_start = time.perf_counter()
+        try:
+            if partial:
+                answer = self._process_with_gemini_fields(content, mime_type, source, fields)
+                result = dict(cheap)
+                for field in fields:
+                    if answer.get(field):
+                        result[field] = answer[field]
+            else:
+                result = self._timed_gemini(content, mime_type, source)
+                # 以Vision結果補上Gemini留空的欄位
+                for field, value in (cheap or {}).items():
+                    if value and not result.get(field):
+                        result[field] = value
+            stats['backend'] = 'gemini'
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"使用Gemini處理圖片失敗: {str(e)}")
+            record_fallback('router', 'gemini_failed')
+            route['decision'] += '_failed'
+            stats['backend'] = 'vision'
+            stats['degraded'] = True
+            result = cheap
+        
+        gemini_ms = (time.perf_counter() - gemini_start) * 1000
+        route['gemini_ms'] = round(gemini_ms, 2)
+        self.router_stats.record(route['decision'], cheap_ms=cheap_ms, gemini_ms=gemini_ms)
+        return result
+    
+    @staticmethod
+    def _future_result(future):
+        """取得已完成請求的結果，發生例外時返回None（Gemini配額不足除外）"""
+        try:
+            return future.result()
+        except QuotaExceeded:
+            raise
+        except Exception as e:
+            logger.error(f"OCR請求失敗: {str(e)}")
+            return None
+    
+    def _process_with_gemini(self, content, mime_type, source):
         """使用Gemini 2.5 Flash處理圖片OCR"""
-        logger.info(f"使用Gemini 2.5 Flash處理圖片: {image_path}")
+        logger.info(f"使用Gemini 2.5 Flash處理圖片: {source}")
         
         try:
-            # 讀取圖片
-            image = Image.open(image_path)
-            
-            # 準備提示詞
-            prompt = """
-            這是一張名片圖片。請執行OCR提取所有文字，並將資訊結構化為以下JSON格式：
-            {
-              "name": "人名",
-              "title": "職稱",
-              "company": "公司名稱",
-              "phone": "電話號碼",
-              "mobile": "手機號碼",
-              "email": "電子郵件",
-              "address": "地址",
-              "website": "網站",
-              "tax_id": "統一編號（如果有）",
-              "raw_text": "完整提取的文字"
-            }
-            
-            請注意：
-            1. 名片通常包含人名、職稱、公司名稱、聯絡資訊等
-            2. 人名通常位於名片上方，字體較大
-            3. 統一編號通常是8位數字，可能標示為「統一編號」或「統編」
-            4. 請盡可能準確提取所有資訊
-            5. 如果某些欄位資訊不存在，請將對應值設為空字串
-            6. 只需回覆JSON格式，不需要其他說明
-            """
+            # 直接傳送已編碼的圖片內容，避免SDK再次轉檔
+            image = {'mime_type': mime_type, 'data': content}
             
             # 呼叫Gemini API
-            response = self.gemini_model.generate_content([prompt, image])
-            response_text = response.text
-            
-            # 嘗試從回應中提取JSON
-            try:
-                # 移除可能的Markdown格式
-                if "```json" in response_text:
-                    response_text = response_text.split("```json")[1].split("```")[0].strip()
-                elif "```" in response_text:
-                    response_text = response_text.split("```")[1].split("```")[0].strip()
-                
-                import json
-                card_info = json.loads(response_text)
-                logger.info(f"成功使用Gemini處理圖片文字: {image_path}")
-                return card_info
-            
-            except json.JSONDecodeError as e:
-                logger.error(f"解析Gemini回應JSON失敗: {response_text}")
-                logger.error(f"JSON錯誤: {str(e)}")
-                # 嘗試使用備用方法解析文字
-                return self._parse_text_fallback(response_text)
+            start = time.perf_counter()
+            with observe_stage('gemini'):
+                response = self.gemini_model.generate_content([GEMINI_OCR_PROMPT, image])
+            if OCR_RECORD_RESPONSES_PATH:
+                record_response(OCR_RECORD_RESPONSES_PATH, response.text, (time.perf_counter() - start) * 1000)
+            return self._parse_gemini_reply(response.text, source)
+        
+        except Exception as e:
+            logger.error(f"Gemini處理圖片失敗: {str(e)}")
+            raise
+    
+    def _parse_gemini_reply(self, response_text, source):
+        """從Gemini回應中提取名片JSON（必要時以簡短提示詞請模型修正）"""
+        try:
+            card_info = parse_llm_json(response_text, CARD_SCHEMA, model=self.gemini_model)
+            logger.info(f"成功使用Gemini處理圖片文字: {source}")
+            return card_info
         
+        except LLMJSONError as e:
+            logger.error(f"解析Gemini回應JSON失敗: {response_text}")
+            logger.error(f"JSON錯誤: {str(e)}")
+            # 嘗試使用備用方法解析文字
+            record_fallback('json_parse', 'text_fallback')
+            return self._parse_text_fallback(response_text)
+    
+    async def _process_with_gemini_async(self, content, mime_type, source):
+        """_process_with_gemini 的非同步版本"""
+        logger.info(f"使用Gemini 2.5 Flash處理圖片: {source}")
+        image = {'mime_type': mime_type, 'data': content}
+        try:
+            with observe_stage('gemini'):
+                response = await self.gemini_model.generate_content_async([GEMINI_OCR_PROMPT, image])
         except Exception as e:
             logger.error(f"Gemini處理圖片失敗: {str(e)}")
             raise
+        
+        try:
+            return await parse_llm_json_async(response.text, CARD_SCHEMA, model=self.gemini_model)
+        except LLMJSONError as e:
+            logger.error(f"解析Gemini回應JSON失敗: {response.text}")
+            logger.error(f"JSON錯誤: {str(e)}")
+            record_fallback('json_parse', 'text_fallback')
+            return self._parse_text_fallback(response.text)
+    
+    def _stream_gemini(self, content, mime_type):
+        """以串流方式呼叫Gemini，逐段產生回應文字"""
+        with observe_stage('gemini'):
+            response = self.gemini_model.generate_content([
+                GEMINI_OCR_PROMPT, {'mime_type': mime_type, 'data': content}
+            ], stream=True)
+            for chunk in response:
+                yield chunk.text
     
-    def _process_with_vision_api(self, image_path):
+    def _process_pair_with_gemini(self, front, back, stats, source):
+        """以單次Gemini呼叫辨識正反面圖片"""
+        logger.info(f"使用Gemini處理雙面名片: {source}")
+        front_stats, back_stats = {}, {}
+        front_data, front_mime = self._prepare_image(front, front_stats, f'{source}#front')
+        back_data, back_mime = self._prepare_image(back, back_stats, f'{source}#back')
+        stats['preprocess'] = {
+            'front': front_stats.get('preprocess'),
+            'back': back_stats.get('preprocess')
+        }
+        
+        with observe_stage('gemini'):
+            response = self.gemini_model.generate_content([
+                GEMINI_PAIR_PROMPT,
+                {'mime_type': front_mime, 'data': front_data},
+                {'mime_type': back_mime, 'data': back_data}
+            ])
+        card_info = parse_llm_json(response.text, CARD_PAIR_SCHEMA, model=self.gemini_model)
+        logger.info(f"成功使用Gemini處理雙面名片: {source}")
+        return normalize_bilingual(card_info)
+    
+    @staticmethod
+    def _fields_prompt(fields):
+        """只擷取指定欄位的提示詞"""
+        field_lines = ',\n'.join(
+            f'  "{field}": "{FIELD_DESCRIPTIONS.get(field, field)}"' for field in fields
+        )
+        return GEMINI_FIELDS_PROMPT.format(fields='{\n' + field_lines + '\n}')
+    
+    def _process_with_gemini_fields(self, content, mime_type, source, fields):
+        """使用Gemini只擷取指定欄位（提示詞與回應皆較短）"""
+        logger.info(f"使用Gemini擷取部分欄位 {fields}: {source}")
+        
+        image = {'mime_type': mime_type, 'data': content}
+        with observe_stage('gemini'):
+            response = self.gemini_model.generate_content([self._fields_prompt(fields), image])
+        schema = {'fields': {field: str for field in fields}, 'required': ()}
+        answer = parse_llm_json(response.text, schema, model=self.gemini_model)
+        return {field: answer.get(field, '') for field in fields}
+    
+    def _process_with_vision_api(self, content, source):
         """使用Google Vision API處理圖片OCR（備用方法）"""
         if not self.vision_client:
             logger.error("Google Vision API客戶端未初始化")
             return None
         
         try:
-            # 讀取圖片
-            with io.open(image_path, 'rb') as image_file:
-                content = image_file.read()
+            from google.cloud import vision
             
             # 建立圖片物件
             image = vision.Image(content=content)
             
             # 執行OCR
-            response = self.vision_client.text_detection(image=image)
-            texts = response.text_annotations
-            
-            if not texts:
-                logger.warning(f"未在圖片中找到文字: {image_path}")
-                return None
-            
-            # 取得完整文字
-            full_text = texts[0].description
-            logger.info(f"成功使用Vision API辨識圖片文字: {image_path}")
-            
-            # 解析名片資訊
-            card_info = self._parse_business_card(full_text)
+            with observe_stage('vision'):
+                response = self.vision_client.text_detection(image=image)
+            return self._vision_card(response, source)
+        
+        except Exception as e:
+            logger.error(f"Vision API處理圖片失敗: {str(e)}")
+            return None
+    
+    async def _process_with_vision_api_async(self, content, source):
+        """_process_with_vision_api 的非同步版本
+        
+        非同步gRPC客戶端綁定建立時的事件迴圈，因此在第一次使用時（或事件迴圈更換後）才建立。
+        """
+        if not self.vision_credentials:
+            logger.error("Google Vision API客戶端未初始化")
+            return None
+        
+        try:
+            from google.cloud import vision
             
-            # 檢查是否有錯誤
-            if response.error.message:
-                logger.error(f"Google Vision API錯誤: {response.error.message}")
+            loop = asyncio.get_running_loop()
+            if self._vision_async_client is None or self._vision_async_loop is not loop:
+                self._vision_async_client = vision.ImageAnnotatorAsyncClient(credentials=self.vision_credentials)
+                self._vision_async_loop = loop
             
-            return card_info
+            request = vision.AnnotateImageRequest(
+                image=vision.Image(content=content),
+                features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)]
+            )
+            with observe_stage('vision'):
+                batch = await self._vision_async_client.batch_annotate_images(requests=[request])
+            return self._vision_card(batch.responses[0], source)
         
         except Exception as e:
             logger.error(f"Vision API處理圖片失敗: {str(e)}")
             return None
     
+    def _vision_card(self, response, source):
+        """將Vision API文字偵測回應解析為名片資訊"""
+        texts = response.text_annotations
+        
+        if not texts:
+            logger.warning(f"未在圖片中找到文字: {source}")
+            return None
+        
+        # 取得完整文字
+        full_text = texts[0].description
+        logger.info(f"成功使用Vision API辨識圖片文字: {source}")
+        
+        # 解析名片資訊
+        card_info = self._parse_business_card(full_text)
+        
+        # 檢查是否有錯誤
+        if response.error.message:
+            logger.error(f"Google Vision API錯誤: {response.error.message}")
+        
+        return card_info
+    
     def _parse_text_fallback(self, text):
         """當JSON解析失敗時的備用解析方法"""
         # 初始化結果
-        result = {
+        result = FallbackCard({
             'name': '',
             'title': '',
             'company': '',
@@ -180,33 +1161,41 @@ class BusinessCardOCR:
             'website': '',
             'tax_id': '',
             'raw_text': text
-        }
+        })
         
         # 嘗試從文字中提取資訊
         try:
-            # 提取電子郵件
-            email_match = re.search(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', text)
-            if email_match:
-                result['email'] = email_match.group(0)
+            lines = text.split('\n')
+            line_categories = fallback_classifier.classify_lines(text)
             
-            # 提取網站
-            website_match = re.search(r'(https?://)?([a-zA-Z0-9][-a-zA-Z0-9]*\.)+[a-zA-Z]{2,}(/[-a-zA-Z0-9%_.~#?&=]*)?', text)
-            if website_match:
-                result['website'] = website_match.group(0)
+            # 提取電子郵件與網站（兩者都不會跨行，只需依序搜尋含 @ 或 . 的行）
+            for line, categories in zip(lines, line_categories):
+                if categories & EMAIL_HINT and not result['email']:
+                    email_match = EMAIL_RE.search(line)
+                    if email_match:
+                        result['email'] = email_match.group(0)
+                
+                if categories & WEBSITE_HINT and not result['website']:
+                    website_match = WEBSITE_RE.search(line)
+                    if website_match:
+                        result['website'] = website_match.group(0)
             
             # 提取電話號碼
-            phone_match = re.search(r'[\(\)（）]?\d{2,4}[\(\)（）]?[-\s]?\d{3,4}[-\s]?\d{3,4}', text)
+            phone_match = PHONE_RE.search(text)
             if phone_match:
                 result['phone'] = phone_match.group(0)
             
             # 提取統一編號
-            tax_id_match = re.search(r'\d{8}', text)
+            tax_id_match = TAX_ID_RE.search(text)
             if tax_id_match:
                 result['tax_id'] = tax_id_match.group(0)
             
             # 嘗試提取其他資訊
-            lines = text.split('\n')
-            for i, line in enumerate(lines):
+            for i, (line, categories) in enumerate(zip(lines, line_categories)):
+                # 前三行之後只有命中關鍵字的行可能被採用
+                if i >= 3 and not categories:
+                    continue
+                
                 line = line.strip()
                 
                 # 跳過空行
@@ -214,20 +1203,19 @@ class BusinessCardOCR:
                     continue
                 
                 # 提取公司名稱
-                if ('公司' in line or '企業' in line or '集團' in line) and not result['company'] and len(line) < 30:
+                if categories & COMPANY and not result['company'] and len(line) < 30:
                     result['company'] = line
                 
                 # 提取姓名（通常是較短的行，且在名片的前幾行）
-                if i < 3 and not result['name'] and len(line) < 10:
-                    if not any(x in line.lower() for x in ['電話', 'tel', 'www', 'http', '@', '股份', '有限']):
-                        result['name'] = line
+                if i < 3 and not result['name'] and len(line) < 10 and not categories & NAME_EXCLUDE:
+                    result['name'] = line
                 
                 # 提取職稱
-                if ('經理' in line or '主任' in line or '總監' in line or '工程師' in line) and not result['title'] and len(line) < 20:
+                if categories & TITLE and not result['title'] and len(line) < 20:
                     result['title'] = line
                 
                 # 提取地址
-                if ('市' in line or '縣' in line or '路' in line or '街' in line) and not result['address'] and len(line) > 10:
+                if categories & ADDRESS and not result['address'] and len(line) > 10:
                     result['address'] = line
         
         except Exception as e:
@@ -254,63 +1242,69 @@ class BusinessCardOCR:
         # 分行處理
         lines = text.split('\n')
         
-        # 解析每一行
-        for i, line in enumerate(lines):
+        # 解析每一行（整段文字只掃描一次關鍵字）
+        line_categories = card_classifier.classify_lines(text)
+        for i, (line, categories) in enumerate(zip(lines, line_categories)):
+            # 前三行之後只有命中關鍵字的行可能被採用
+            if i >= 3 and not categories:
+                continue
+            
             line = line.strip()
             
             # 跳過空行
             if not line:
                 continue
             
-            # 提取電子郵件
-            if '@' in line and not result['email']:
-                email_match = re.search(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', line)
-                if email_match:
-                    result['email'] = email_match.group(0)
-                    continue
-            
-            # 提取網站
-            if ('http://' in line or 'https://' in line or 'www.' in line) and not result['website']:
-                website_match = re.search(r'(https?://)?([a-zA-Z0-9][-a-zA-Z0-9]*\.)+[a-zA-Z]{2,}(/[-a-zA-Z0-9%_.~#?&=]*)?', line)
-                if website_match:
-                    result['website'] = website_match.group(0)
-                    continue
-            
-            # 提取電話號碼
-            if ('電話' in line or 'Tel' in line.lower() or 'T:' in line) and not result['phone']:
-                phone_match = re.search(r'[\(\)（）]?\d{2,4}[\(\)（）]?[-\s]?\d{3,4}[-\s]?\d{3,4}', line)
-                if phone_match:
-                    result['phone'] = phone_match.group(0)
-                    continue
-            
-            # 提取手機號碼
-            if ('手機' in line or 'Mobile' in line.lower() or 'M:' in line) and not result['mobile']:
-                mobile_match = re.search(r'[\(\)（）]?\d{2,4}[\(\)（）]?[-\s]?\d{3,4}[-\s]?\d{3,4}', line)
-                if mobile_match:
-                    result['mobile'] = mobile_match.group(0)
-                    continue
-            
-            # 提取統一編號
-            if ('統一編號' in line or '統編' in line) and not result['tax_id']:
-                tax_id_match = re.search(r'\d{8}', line)
-                if tax_id_match:
-                    result['tax_id'] = tax_id_match.group(0)
-                    continue
+            # 以正規表示式擷取值的欄位（多數行不含這些標籤，一次檢查即可略過）
+            if categories & VALUE_HINTS:
+                # 提取電子郵件
+                if categories & EMAIL_HINT and not result['email']:
+                    email_match = EMAIL_RE.search(line)
+                    if email_match:
+                        result['email'] = email_match.group(0)
+                        continue
+                
+                # 提取網站
+                if categories & WEBSITE_HINT and not result['website']:
+                    website_match = WEBSITE_RE.search(line)
+                    if website_match:
+                        result['website'] = website_match.group(0)
+                        continue
+                
+                # 提取電話號碼
+                if categories & PHONE_LABEL and not result['phone']:
+                    phone_match = PHONE_RE.search(line)
+                    if phone_match:
+                        result['phone'] = phone_match.group(0)
+                        continue
+                
+                # 提取手機號碼
+                if categories & MOBILE_LABEL and not result['mobile']:
+                    mobile_match = PHONE_RE.search(line)
+                    if mobile_match:
+                        result['mobile'] = mobile_match.group(0)
+                        continue
+                
+                # 提取統一編號
+                if categories & TAX_LABEL and not result['tax_id']:
+                    tax_id_match = TAX_ID_RE.search(line)
+                    if tax_id_match:
+                        result['tax_id'] = tax_id_match.group(0)
+                        continue
             
             # 提取地址（通常較長且包含地址相關詞）
-            if ('市' in line or '縣' in line or '路' in line or '街' in line or '區' in line) and not result['address']:
+            if categories & ADDRESS and not result['address']:
                 # 檢查是否為地址（通常地址較長）
                 if len(line) > 10:
                     result['address'] = line
                     continue
             
             # 提取職稱（通常在名字後面或公司前面）
-            if ('經理' in line or '主任' in line or '總監' in line or '工程師' in line or 
-                'Manager' in line or 'Director' in line or 'Engineer' in line) and not result['title']:
+            if categories & TITLE and not result['title']:
                 # 如果這行包含職稱關鍵字，但不是完整的地址或其他已識別資訊
-                if not result['title'] and len(line) < 20:
+                if len(line) < 20:
                     # 嘗試提取職稱部分
-                    title_match = re.search(r'(?:^|\s)([^0-9]+(?:經理|主任|總監|工程師|Manager|Director|Engineer)[^0-9]*)(?:\s|$)', line)
+                    title_match = TITLE_RE.search(line)
                     if title_match:
                         result['title'] = title_match.group(1).strip()
                     else:
@@ -318,7 +1312,7 @@ class BusinessCardOCR:
                     continue
             
             # 提取公司名稱（通常包含「公司」、「企業」、「集團」等字眼）
-            if ('公司' in line or '企業' in line or '集團' in line or 'Co.' in line or 'Ltd' in line or 'Inc' in line) and not result['company']:
+            if categories & COMPANY and not result['company']:
                 # 如果這行可能是公司名稱
                 if len(line) < 30:  # 避免取到太長的行
                     result['company'] = line
@@ -327,7 +1321,7 @@ class BusinessCardOCR:
             # 提取姓名（通常是較短的行，且在名片的前幾行）
             if i < 3 and not result['name'] and len(line) < 10:
                 # 檢查是否為可能的姓名（不含常見的非姓名元素）
-                if not any(x in line.lower() for x in ['電話', 'tel', 'www', 'http', '@', '股份', '有限']):
+                if not categories & NAME_EXCLUDE:
                     result['name'] = line
                     continue
         
@@ -348,5 +1342,5 @@ class BusinessCardOCR:
         # 返回結果
         return result
 
-# 建立全域實例
-card_ocr = BusinessCardOCR() 
+# 建立全域實例（第一次使用時才初始化API客戶端）
+card_ocr = LazyInstance('card_ocr', BusinessCardOCR) 
@@ -0,0 +1,150 @@
+"""
+名片OCR與客戶開發信系統 - 一次完成的處理流程模組
+
+名片圖片經OCR後，公司分析（analyze_company）與詳細分析（analyze_company_details）並行執行，
+公司分析一完成即開始產生開發信，不等待詳細分析；各階段依完成順序產生結果。
+端對端延遲約為 OCR + max(詳細分析, 公司分析 + 開發信)，而非所有階段的總和。
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.ocr import card_ocr
+from app.analyzer import company_analyzer
+from app.metrics import observe_stage
+from app.ratelimit import QuotaExceeded
+from app.config import PIPELINE_MAX_WORKERS
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 處理流程的階段
+PIPELINE_STAGES = ('ocr', 'analysis', 'details', 'email')
+
+# OCR之後的階段共用的執行緒池（每個流程同時最多佔用兩個執行緒）
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix='pipeline')
+
+
+class StageFailed(Exception):
+    """階段未取得有效結果"""
+
+
+def _analysis(card):
+    result = company_analyzer.analyze_company(card.get('company', ''), None, card.get('tax_id', ''), card.get('address', ''))
+    if not result:
+        raise StageFailed('無法分析公司資訊')
+    return result
+
+
+def _details(card):
+    result = company_analyzer.analyze_company_details(card.get('company', ''), card.get('tax_id', ''), card.get('address', ''))
+    if result and result.get('status') == 'error':
+        raise StageFailed(result.get('error', '無法分析公司詳細資料'))
+    if not result or 'company_description' not in result:
+        raise StageFailed('公司詳細分析失敗: API 返回格式無效')
+    return result
+
+
+def _email(card, analysis, my_company):
+    target_company = {
+        'name': card.get('company', ''),
+        'profile': analysis.get('company_profile', ''),
+        'type': analysis.get('company_type', ''),
+        'industry': analysis.get('industry', ''),
+        'contact_person': card.get('name', ''),
+        'title': card.get('title', '')
+    }
+    result = company_analyzer.generate_email(target_company, my_company)
+    if result and result.get('status') == 'error':
+        raise StageFailed(result.get('error', '無法生成開發信'))
+    if not result or not ('subject' in result and 'content' in result):
+        raise StageFailed('開發信生成失敗: API 返回格式無效')
+    return result
+
+
+def _run_stage(stage, func, *args):
+    """執行單一階段並記錄狀態與耗時（不拋出例外）"""
+    start = time.perf_counter()
+    outcome = {'stage': stage, 'status': 'error', 'result': None, 'error': None}
+    try:
+        with observe_stage(f'pipeline_{stage}'):
+            outcome['result'] = func(*args)
+        outcome['status'] = 'success'
+    except QuotaExceeded as e:
+        outcome['error'] = str(e)
+        outcome['retry_after'] = e.retry_after
+    except Exception as e:
+        logger.error(f"處理流程階段失敗: {stage}, {str(e)}")
+        outcome['error'] = str(e)
+    outcome['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return outcome
+
+
+def _skipped(stage, reason):
+    return {'stage': stage, 'status': 'error', 'result': None, 'error': reason, 'elapsed_ms': 0.0}
+
+
+def run_pipeline(content, my_company, back_content=None, source='pipeline', stats=None):
+    """執行名片OCR、公司分析、詳細分析與開發信產生，依完成順序產生各階段結果
+
+    OCR在呼叫端的執行緒中執行（第一個結果產生前即可判斷配額是否不足），
+    其餘階段在共用的執行緒池中執行；呼叫端中途停止迭代時，尚未開始的階段會被取消。
+
+    Args:
+        content: 名片正面圖片內容
+        my_company: 寄件公司資訊（同 /api/generate-email 的 my_company）
+        back_content: 選填的名片背面圖片內容
+        source: 記錄用的圖片來源
+        stats: 選填的dict，會填入OCR統計
+
+    Yields:
+        dict: 包含 stage、status、result（OCR為原始名片dict）、error、elapsed_ms；
+            因配額不足失敗的階段另含 retry_after
+
+    Raises:
+        QuotaExceeded: OCR階段Gemini配額不足
+    """
+    stats = {} if stats is None else stats
+    start = time.perf_counter()
+    with observe_stage('pipeline_ocr'):
+        if back_content:
+            card = card_ocr.process_card_pair(content, back_content, stats=stats, source=source)
+        else:
+            card = card_ocr.process_image_bytes(content, stats=stats, source=source)
+    yield {
+        'stage': 'ocr',
+        'status': 'success' if card else 'error',
+        'result': card,
+        'error': None if card else '無法辨識名片資訊',
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+    if not card:
+        return
+    if not card.get('company'):
+        for stage in PIPELINE_STAGES[1:]:
+            yield _skipped(stage, '名片中沒有公司名稱')
+        return
+
+    pending = {
+        _executor.submit(_run_stage, 'analysis', _analysis, card): 'analysis',
+        _executor.submit(_run_stage, 'details', _details, card): 'details'
+    }
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                outcome = future.result()
+                skipped = None
+                if outcome['stage'] == 'analysis':
+                    # 公司分析完成即開始產生開發信，不等待詳細分析
+                    if outcome['status'] == 'success':
+                        pending[_executor.submit(_run_stage, 'email', _email, card, outcome['result'], my_company)] = 'email'
+                    else:
+                        skipped = _skipped('email', '公司分析失敗，未產生開發信')
+                yield outcome
+                if skipped:
+                    yield skipped
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,402 @@
+"""
+名片OCR與客戶開發信系統 - 圖片前處理模組
+"""
+import io
+import logging
+import math
+import random
+import threading
+import time
+import numpy as np
+from PIL import Image, ImageOps
+from app.metrics import observe_stage
+from app.segment import find_card_boxes
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 支援的輸出格式與對應MIME類型
+OUTPUT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png'
+}
+
+# EXIF方向標籤
+EXIF_ORIENTATION_TAG = 0x0112
+
+# 傾斜估計與名片裁切使用的縮圖長邊像素數
+GEOMETRY_ANALYSIS_EDGE = 800
+
+# 小於此角度（度）的傾斜不旋轉，避免無謂的重新取樣
+MIN_DESKEW_ANGLE = 0.3
+
+# 名片外框面積佔整張圖片的比例範圍：過小可能只是名片上的色塊，過大則不需裁切
+CROP_MIN_AREA = 0.1
+CROP_MAX_AREA = 0.92
+
+
+def _pixels(image):
+    """圖片的像素數"""
+    return image.size[0] * image.size[1]
+
+
+def estimate_skew(gray, max_angle=15.0, coarse_step=1.0, fine_step=0.1, max_points=60000):
+    """以投影輪廓估計文字行的傾斜角度
+
+    取邊緣強度最高的像素，對每個候選角度計算旋轉後的水平投影輪廓；
+    文字行與名片邊緣對齊水平方向時輪廓最尖銳（平方和最大）。
+    先以粗步長搜尋，再於最佳角度附近細搜尋。
+
+    Args:
+        gray: HxW 灰階NumPy陣列
+        max_angle: 搜尋的最大傾斜角度（度）
+        coarse_step: 粗搜尋步長（度）
+        fine_step: 細搜尋步長（度）
+        max_points: 參與計算的最多像素數
+
+    Returns:
+        float: 校正角度（度），可直接傳給 PIL 的 Image.rotate
+    """
+    gray = gray.astype(np.float32)
+    grad_y = np.abs(np.diff(gray, axis=0))[:, :-1]
+    grad_x = np.abs(np.diff(gray, axis=1))[:-1, :]
+    magnitude = grad_x + grad_y
+    if magnitude.max() <= 0:
+        return 0.0
+
+    ys, xs = np.nonzero(magnitude > np.percentile(magnitude, 90))
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > max_points:
+        chosen = np.random.default_rng(0).choice(len(ys), max_points, replace=False)
+        ys, xs = ys[chosen], xs[chosen]
+    ys = ys.astype(np.float32)
+    xs = xs.astype(np.float32)
+
+    def sharpness(angle):
+        theta = math.radians(angle)
+        projected = ys * math.cos(theta) + xs * math.sin(theta)
+        counts = np.bincount((projected - projected.min()).astype(np.int64))
+        return float((counts.astype(np.float64) ** 2).sum())
+
+    def search(center, radius, step):
+        angles = np.arange(center - radius, center + radius + step / 2, step)
+        scores = [sharpness(angle) for angle in angles]
+        return float(angles[int(np.argmax(scores))])
+
+    best = search(0.0, max_angle, coarse_step)
+    best = search(best, coarse_step, fine_step)
+    # 投影座標系的傾斜角與校正旋轉方向相反
+    return round(-best, 2) + 0.0
+
+
+def _rotation_matrix(size, angle):
+    """與 Image.rotate(angle, expand=True) 相同的仿射矩陣（輸出座標 -> 原圖座標）
+
+    Returns:
+        tuple: (仿射矩陣, 旋轉後的圖片大小)
+    """
+    w, h = size
+    theta = -math.radians(angle)
+    a, b, d, e = math.cos(theta), math.sin(theta), -math.sin(theta), math.cos(theta)
+    cx, cy = w / 2.0, h / 2.0
+    c = a * -cx + b * -cy + cx
+    f = d * -cx + e * -cy + cy
+
+    corners = [(a * x + b * y + c, d * x + e * y + f) for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    xs = [x for x, _ in corners]
+    ys = [y for _, y in corners]
+    nw = math.ceil(max(xs)) - math.floor(min(xs))
+    nh = math.ceil(max(ys)) - math.floor(min(ys))
+    ox, oy = -(nw - w) / 2.0, -(nh - h) / 2.0
+    return (a, b, a * ox + b * oy + c, d, e, d * ox + e * oy + f), (nw, nh)
+
+
+def straighten(image, deskew=True, crop=True, max_angle=15.0):
+    """校正傾斜並裁切到名片邊界
+
+    傾斜角度與名片外框都在縮圖上估計；原圖只做一次仿射轉換，
+    且只重新取樣裁切後的名片區域，大圖的旋轉成本與名片大小成正比。
+
+    Args:
+        image: 已依EXIF轉正的PIL圖片
+        deskew: 是否校正傾斜
+        crop: 是否裁切到名片邊界
+        max_angle: 傾斜估計的最大角度（度）
+
+    Returns:
+        tuple: (處理後的圖片, 各步驟報告列表)
+    """
+    steps = []
+    if not (deskew or crop):
+        return image, steps
+
+    rgb = image if image.mode in ('RGB', 'L') else image.convert('RGB')
+    scale = min(1.0, GEOMETRY_ANALYSIS_EDGE / float(max(rgb.size)))
+    small = rgb.convert('RGB')
+    if scale < 1.0:
+        small = small.resize((max(1, round(rgb.size[0] * scale)), max(1, round(rgb.size[1] * scale))), Image.BILINEAR)
+    pixels = np.asarray(small)
+
+    # 以背景色填補旋轉後的角落，避免被誤判為名片
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    fill = tuple(int(value) for value in np.median(border, axis=0))
+
+    angle = 0.0
+    size = rgb.size
+    if deskew:
+        angle = estimate_skew(pixels.mean(axis=2), max_angle=max_angle)
+        applied = abs(angle) >= MIN_DESKEW_ANGLE
+        if not applied:
+            angle = 0.0
+        else:
+            small = small.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=fill)
+            size = _rotation_matrix(rgb.size, angle)[1]
+        steps.append({
+            'step': 'deskew',
+            'applied': applied,
+            'angle': angle,
+            'pixels_before': _pixels(rgb),
+            'pixels_after': size[0] * size[1]
+        })
+
+    # 名片外框（縮圖座標換算為原圖旋轉後的座標）
+    box = None
+    if crop:
+        boxes = find_card_boxes(small, min_area=CROP_MIN_AREA, max_cards=4)
+        if boxes:
+            found = max(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]))
+            ratio = (size[0] / float(small.size[0]), size[1] / float(small.size[1]))
+            box = (
+                max(0, int(found[0] * ratio[0])), max(0, int(found[1] * ratio[1])),
+                min(size[0], math.ceil(found[2] * ratio[0])), min(size[1], math.ceil(found[3] * ratio[1]))
+            )
+            if (box[2] - box[0]) * (box[3] - box[1]) > size[0] * size[1] * CROP_MAX_AREA:
+                box = None
+        steps.append({
+            'step': 'crop',
+            'applied': box is not None,
+            'box': list(box) if box else None,
+            'pixels_before': size[0] * size[1],
+            'pixels_after': (box[2] - box[0]) * (box[3] - box[1]) if box else size[0] * size[1]
+        })
+
+    if angle:
+        if rgb.mode == 'L':
+            fill = int(sum(fill) / 3)
+        matrix, _ = _rotation_matrix(rgb.size, angle)
+        left, top, right, bottom = box or (0, 0) + size
+        a, b, c, d, e, f = matrix
+        matrix = (a, b, a * left + b * top + c, d, e, d * left + e * top + f)
+        return rgb.transform(
+            (right - left, bottom - top), Image.AFFINE, matrix, resample=Image.BICUBIC, fillcolor=fill
+        ), steps
+    if box:
+        return rgb.crop(box), steps
+    return image, steps
+
+
+class PreprocessStats:
+    """前處理步驟統計：各步驟的像素縮減量，以及套用與否對OCR成功率的影響"""
+
+    def __init__(self):
+        self.steps = {}
+        self.groups = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rate(success, total):
+        return round(success / total, 4) if total else None
+
+    def record(self, report, success):
+        """記錄一次前處理報告與OCR是否成功
+
+        Args:
+            report: ImagePreprocessor.process 返回的處理報告
+            success: OCR結果是否可用
+        """
+        group = 'holdout' if report.get('holdout') else 'treatment'
+        with self._lock:
+            counts = self.groups.setdefault(group, {'requests': 0, 'success': 0})
+            counts['requests'] += 1
+            counts['success'] += int(bool(success))
+
+            for step in report.get('steps', ()):
+                entry = self.steps.setdefault(step['step'], {
+                    'applied': 0, 'applied_success': 0, 'skipped': 0, 'skipped_success': 0,
+                    'pixel_ratio_total': 0.0
+                })
+                key = 'applied' if step['applied'] else 'skipped'
+                entry[key] += 1
+                entry[f'{key}_success'] += int(bool(success))
+                if step['applied'] and step['pixels_before']:
+                    entry['pixel_ratio_total'] += step['pixels_after'] / step['pixels_before']
+
+    def snapshot(self):
+        """取得統計摘要"""
+        with self._lock:
+            steps = {
+                name: {
+                    'applied': entry['applied'],
+                    'skipped': entry['skipped'],
+                    'success_rate_applied': self._rate(entry['applied_success'], entry['applied']),
+                    'success_rate_skipped': self._rate(entry['skipped_success'], entry['skipped']),
+                    'avg_pixel_ratio': round(entry['pixel_ratio_total'] / entry['applied'], 4)
+                    if entry['applied'] else None
+                }
+                for name, entry in self.steps.items()
+            }
+            groups = {
+                name: dict(counts, success_rate=self._rate(counts['success'], counts['requests']))
+                for name, counts in self.groups.items()
+            }
+            return {'steps': steps, 'groups': groups}
+
+
+class ImagePreprocessor:
+    """上傳OCR前的圖片轉正、裁切、縮放與重新編碼處理器"""
+
+    def __init__(self, max_edge=1600, grayscale=False, image_format='JPEG', quality=85, enabled=True,
+                 deskew=True, crop=True, max_angle=15.0, holdout=0.0):
+        """初始化前處理器
+
+        Args:
+            max_edge: 長邊的最大像素數，超過時等比例縮小
+            grayscale: 是否轉為灰階
+            image_format: 重新編碼格式（JPEG或WEBP）
+            quality: 重新編碼品質（1-100）
+            enabled: 是否啟用前處理，停用時直接返回原始內容
+            deskew: 是否校正傾斜
+            crop: 是否裁切到名片邊界
+            max_angle: 傾斜估計的最大角度（度）
+            holdout: 略過傾斜校正與裁切的請求比例（0-1），用於比較OCR成功率
+        """
+        image_format = image_format.upper()
+        if image_format not in OUTPUT_MIME_TYPES:
+            logger.warning(f"不支援的輸出格式: {image_format}，改用JPEG")
+            image_format = 'JPEG'
+
+        self.max_edge = max_edge
+        self.grayscale = grayscale
+        self.image_format = image_format
+        self.quality = quality
+        self.enabled = enabled
+        self.deskew = deskew
+        self.crop = crop
+        self.max_angle = max_angle
+        self.holdout = holdout
+
+    @property
+    def fingerprint(self):
+        """前處理設定的識別字串，設定變更會影響OCR結果"""
+        if not self.enabled:
+            return 'raw'
+        fingerprint = f"{self.max_edge}:{int(self.grayscale)}:{self.image_format}:{self.quality}"
+        if self.deskew or self.crop:
+            fingerprint += f":geo{int(self.deskew)}{int(self.crop)}:{self.max_angle}"
+        return fingerprint
+
+    def process(self, content):
+        """依EXIF轉正、校正傾斜、裁切到名片邊界，再縮放並重新編碼圖片
+
+        Args:
+            content: 原始圖片位元組
+
+        Returns:
+            tuple: (處理後的位元組, MIME類型, 處理報告dict)；
+                   報告的 steps 記錄每個步驟是否套用與前後像素數
+        """
+        start = time.perf_counter()
+        image = Image.open(io.BytesIO(content))
+        original_format = image.format or 'JPEG'
+        original_size = image.size
+
+        report = {
+            'original_bytes': len(content),
+            'original_size': list(original_size)
+        }
+
+        if not self.enabled:
+            report.update({
+                'output_bytes': len(content),
+                'output_size': list(original_size),
+                'bytes_saved': 0,
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+            })
+            return content, Image.MIME.get(original_format, 'image/jpeg'), report
+
+        with observe_stage('image_decode'):
+            image.load()
+
+        # 依EXIF方向資訊轉正（手機照片常以旋轉標記儲存）
+        rotated = image.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1
+        image = ImageOps.exif_transpose(image)
+        steps = [{
+            'step': 'exif_transpose',
+            'applied': rotated,
+            'pixels_before': _pixels(image),
+            'pixels_after': _pixels(image)
+        }]
+
+        # 校正傾斜並裁切掉桌面背景（保留比例的請求略過，作為成功率的對照組）
+        holdout = self.holdout > 0 and random.random() < self.holdout
+        geometry = False
+        if (self.deskew or self.crop) and not holdout:
+            image, geometry_steps = straighten(
+                image, deskew=self.deskew, crop=self.crop, max_angle=self.max_angle
+            )
+            steps.extend(geometry_steps)
+            geometry = any(step['applied'] for step in geometry_steps)
+
+        # 長邊超過上限時等比例縮小
+        resized = False
+        before = _pixels(image)
+        if max(image.size) > self.max_edge:
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            resized = True
+        steps.append({
+            'step': 'resize',
+            'applied': resized,
+            'pixels_before': before,
+            'pixels_after': _pixels(image)
+        })
+
+        if self.grayscale:
+            image = image.convert('L')
+        elif image.mode not in ('RGB', 'L'):
+            # JPEG不支援透明度，以白色背景合成
+            background = Image.new('RGB', image.size, 'white')
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.split()[-1])
+            image = background
+
+        buffer = io.BytesIO()
+        save_kwargs = {'quality': self.quality}
+        if self.image_format == 'JPEG':
+            save_kwargs['optimize'] = True
+        image.save(buffer, format=self.image_format, **save_kwargs)
+        output = buffer.getvalue()
+        mime_type = OUTPUT_MIME_TYPES[self.image_format]
+        output_size = image.size
+
+        # 未做任何轉換且重新編碼反而變大時，保留原始內容
+        if not (resized or rotated or geometry or self.grayscale) and len(output) >= len(content):
+            output = content
+            mime_type = Image.MIME.get(original_format, 'image/jpeg')
+            output_size = original_size
+
+        report.update({
+            'output_bytes': len(output),
+            'output_size': list(output_size),
+            'bytes_saved': len(content) - len(output),
+            'holdout': holdout,
+            'steps': steps,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+        logger.info(
+            f"圖片前處理完成: {report['original_bytes']} -> {report['output_bytes']} bytes, "
+            f"{original_size} -> {output_size}, 耗時 {report['elapsed_ms']}ms"
+        )
+        return output, mime_type, report
@@ -0,0 +1,470 @@
+"""
+名片OCR與客戶開發信系統 - Gemini限流模組
+
+多位使用者或批次工作同時呼叫Gemini時，很容易超過專案的每分鐘請求數與token數配額。
+所有Gemini呼叫（OCR、公司分析、開發信、JSON修正）都經由同一個限流器：
+- 每分鐘請求數（RPM）與每分鐘token數（TPM）以令牌桶計算；
+- 同時進行中的呼叫數有上限；
+- 等候的呼叫依到達順序（先進先出）取得配額，大請求不會被小請求插隊而無限期延後；
+- 等候佇列過長或預估等候時間過久時拋出 QuotaExceeded，路由以429與 Retry-After 回應，
+  不再默默改用備用路徑或模擬資料。
+"""
+import asyncio
+import io
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from app.config import (
+    GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_CONCURRENCY, GEMINI_MAX_QUEUE,
+    GEMINI_MAX_WAIT_SECONDS, GEMINI_OUTPUT_TOKENS, GEMINI_QUOTA_COOLDOWN_SECONDS
+)
+from app.metrics import rate_limit_rejections, rate_limit_wait_seconds
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(Exception):
+    """Gemini配額不足（等候佇列已滿、等候逾時或API回報配額用盡）"""
+
+    def __init__(self, limiter, reason, retry_after):
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__(f'{limiter} 配額不足（{reason}），請於 {self.retry_after} 秒後重試')
+
+
+class TokenBucket:
+    """每分鐘補充固定數量的令牌桶（容量為一分鐘的配額，rate 為0表示不限制）"""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """取得 amount 個令牌前需要等候的秒數"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount, now):
+        if self.rate:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """退回（正數）或補扣（負數）令牌，例如以實際token用量修正預估"""
+        if self.rate:
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, now):
+        """清空令牌（API回報配額用盡時使用）"""
+        if self.rate:
+            self._refill(now)
+            self.level = min(self.level, 0.0)
+
+
+class _Waiter:
+    """等候配額的呼叫"""
+
+    def __init__(self, tokens, loop=None):
+        self.tokens = tokens
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self, now):
+        self.granted = True
+        self.granted_at = now
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class RateLimiter:
+    """每分鐘請求數、每分鐘token數與並行數的共用限流器（先進先出）"""
+
+    def __init__(self, name, rpm=0, tpm=0, max_concurrency=0, max_queue=0, max_wait=None,
+                 output_tokens=0, cooldown=0.0):
+        """初始化限流器
+
+        Args:
+            name: 限流器名稱（用於錯誤訊息與指標）
+            rpm: 每分鐘請求數上限（0表示不限制）
+            tpm: 每分鐘token數上限（0表示不限制）
+            max_concurrency: 同時進行中的呼叫數上限（0表示不限制）
+            max_queue: 等候佇列長度上限，超過時立即拒絕（0表示不限制）
+            max_wait: 最長等候秒數，逾時拒絕（None表示不限制）
+            output_tokens: 預估每次呼叫的輸出token數（計入TPM預扣）
+            cooldown: API回報配額用盡後暫停放行的秒數
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.output_tokens = output_tokens
+        self.cooldown = cooldown
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._queue = deque()
+        self._active = 0
+        self._paused_until = 0.0
+        self._timer = None
+        self._timer_deadline = None
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.throttled = 0
+        self.tokens_reserved = 0
+        self.tokens_used = 0
+        self.peak_waiting = 0
+        self._avg_hold = None
+
+    @property
+    def enabled(self):
+        return bool(self._requests.rate or self._tokens.rate or self.max_concurrency)
+
+    # ---- 取得與釋放配額 ----
+
+    def acquire(self, tokens=1):
+        """等候配額（阻塞目前執行緒）
+
+        Returns:
+            _Waiter: 取得的配額，使用完畢後以 release 釋放
+
+        Raises:
+            QuotaExceeded: 等候佇列已滿或等候逾時
+        """
+        waiter = _Waiter(tokens)
+        self._enqueue(waiter)
+        if not waiter.event.wait(self.max_wait) and self._abandon(waiter):
+            raise self._reject('等候逾時')
+        self._record_wait(waiter)
+        return waiter
+
+    async def acquire_async(self, tokens=1):
+        """acquire 的非同步版本（等候時不佔用執行緒）"""
+        waiter = _Waiter(tokens, asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except asyncio.TimeoutError:
+            if self._abandon(waiter):
+                raise self._reject('等候逾時')
+        except BaseException:
+            # 請求被取消（例如用戶端中斷連線）：放棄等候，已取得的配額立即歸還
+            if not self._abandon(waiter):
+                self.release(waiter)
+            raise
+        self._record_wait(waiter)
+        return waiter
+
+    def release(self, waiter, used_tokens=None):
+        """釋放配額；提供實際token用量時修正TPM預扣"""
+        now = time.monotonic()
+        with self._lock:
+            self._active -= 1
+            if used_tokens is not None:
+                self._tokens.adjust(waiter.tokens - used_tokens)
+                self.tokens_used += used_tokens
+            else:
+                self.tokens_used += waiter.tokens
+            if waiter.granted_at is not None:
+                hold = now - waiter.granted_at
+                self._avg_hold = hold if self._avg_hold is None else self._avg_hold * 0.9 + hold * 0.1
+            self._dispatch(now)
+
+    def penalize(self, retry_after=None):
+        """API回報配額用盡：清空令牌並暫停放行一段時間
+
+        Returns:
+            float: 建議的重試秒數
+        """
+        now = time.monotonic()
+        pause = retry_after if retry_after is not None else self.cooldown
+        with self._lock:
+            self.throttled += 1
+            self._requests.drain(now)
+            self._tokens.drain(now)
+            self._paused_until = max(self._paused_until, now + pause)
+            return max(pause, self._estimate_wait(now))
+
+    @contextmanager
+    def slot(self, tokens=1):
+        """在區塊內持有配額"""
+        waiter = self.acquire(tokens)
+        try:
+            yield waiter
+        finally:
+            self.release(waiter)
+
+    @asynccontextmanager
+    async def slot_async(self, tokens=1):
+        """slot 的非同步版本"""
+        waiter = await self.acquire_async(tokens)
+        try:
+            yield waiter
+        finally:
+            self.release(waiter)
+
+    # ---- 內部排程 ----
+
+    def _enqueue(self, waiter):
+        now = time.monotonic()
+        with self._lock:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                retry_after = self._estimate_wait(now)
+                self.rejected += 1
+                rate_limit_rejections.inc(limiter=self.name, reason='queue_full')
+                raise QuotaExceeded(self.name, '等候佇列已滿', retry_after)
+            self.tokens_reserved += waiter.tokens
+            self._queue.append(waiter)
+            self.peak_waiting = max(self.peak_waiting, len(self._queue))
+            self._dispatch(now)
+
+    def _dispatch(self, now):
+        """依到達順序放行佇列前端的呼叫（呼叫端須持有鎖）"""
+        while self._queue:
+            if self.max_concurrency and self._active >= self.max_concurrency:
+                return
+            head = self._queue[0]
+            delay = max(
+                self._paused_until - now,
+                self._requests.delay(1, now),
+                self._tokens.delay(head.tokens, now)
+            )
+            if delay > 0:
+                self._schedule(delay, now)
+                return
+            self._requests.take(1, now)
+            self._tokens.take(head.tokens, now)
+            self._queue.popleft()
+            self._active += 1
+            self.granted += 1
+            head.grant(now)
+
+    def _schedule(self, delay, now):
+        """在令牌補足時重新放行（同一時間只保留最早的一個計時器）"""
+        deadline = now + delay
+        if self._timer is not None and self._timer_deadline <= deadline:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer_deadline = deadline
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch(time.monotonic())
+
+    def _abandon(self, waiter):
+        """放棄等候；已取得配額時返回False"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queue.remove(waiter)
+            self.tokens_reserved -= waiter.tokens
+            self.timed_out += 1
+            self._dispatch(time.monotonic())
+            return True
+
+    def _reject(self, reason):
+        with self._lock:
+            retry_after = self._estimate_wait(time.monotonic())
+        rate_limit_rejections.inc(limiter=self.name, reason='timeout')
+        return QuotaExceeded(self.name, reason, retry_after)
+
+    def _record_wait(self, waiter):
+        rate_limit_wait_seconds.observe(waiter.granted_at - waiter.enqueued_at, limiter=self.name)
+
+    def _estimate_wait(self, now):
+        """預估新的呼叫需要等候的秒數（呼叫端須持有鎖）"""
+        waiting = len(self._queue) + 1
+        estimates = [self._paused_until - now]
+        if self._requests.rate:
+            estimates.append((waiting - self._requests.level) / self._requests.rate)
+        if self._tokens.rate:
+            queued_tokens = sum(waiter.tokens for waiter in self._queue)
+            estimates.append((queued_tokens + self.output_tokens - self._tokens.level) / self._tokens.rate)
+        if self.max_concurrency and self._avg_hold:
+            estimates.append(waiting / float(self.max_concurrency) * self._avg_hold)
+        return max(1.0, *estimates)
+
+    def stats(self):
+        """取得限流統計"""
+        now = time.monotonic()
+        with self._lock:
+            self._requests._refill(now)
+            self._tokens._refill(now)
+            return {
+                'name': self.name,
+                'enabled': self.enabled,
+                'rpm': self._requests.per_minute,
+                'tpm': self._tokens.per_minute,
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'max_wait': self.max_wait,
+                'active': self._active,
+                'waiting': len(self._queue),
+                'peak_waiting': self.peak_waiting,
+                'requests_available': round(self._requests.level, 2) if self._requests.rate else None,
+                'tokens_available': round(self._tokens.level) if self._tokens.rate else None,
+                'paused_for': round(max(0.0, self._paused_until - now), 2),
+                'granted': self.granted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'throttled': self.throttled,
+                'tokens_reserved': self.tokens_reserved,
+                'tokens_used': self.tokens_used,
+                'avg_hold_ms': round(self._avg_hold * 1000, 2) if self._avg_hold is not None else None
+            }
+
+
+def estimate_text_tokens(text):
+    """估計文字的token數（中文約每字一個token，英文約每4個字元一個token，取UTF-8位元組數的1/3作為保守估計）"""
+    return max(1, len(text.encode('utf-8')) // 3)
+
+
+def estimate_tokens(contents):
+    """估計Gemini請求內容的輸入token數
+
+    Args:
+        contents: 提示詞字串，或字串與 {'mime_type', 'data'} 圖片的列表
+    """
+    from app.refine import estimate_image_tokens
+
+    if isinstance(contents, (str, dict)):
+        contents = [contents]
+    total = 0
+    for part in contents:
+        if isinstance(part, str):
+            total += estimate_text_tokens(part)
+        elif isinstance(part, dict) and isinstance(part.get('data'), bytes):
+            if part.get('mime_type', '').startswith('text/'):
+                total += estimate_text_tokens(part['data'].decode('utf-8', errors='replace'))
+                continue
+            try:
+                from PIL import Image
+                # 只讀取檔頭取得尺寸，不解碼整張圖片
+                total += estimate_image_tokens(Image.open(io.BytesIO(part['data'])).size)
+            except Exception:
+                total += 258
+        else:
+            total += 258
+    return total
+
+
+def usage_tokens(response):
+    """取得回應的實際token用量（SDK未提供時返回None）"""
+    usage = getattr(response, 'usage_metadata', None)
+    total = getattr(usage, 'total_token_count', None)
+    return int(total) if total else None
+
+
+def _is_quota_error(error):
+    """是否為Gemini API回報的配額用盡錯誤（HTTP 429 / RESOURCE_EXHAUSTED）"""
+    try:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+    except ImportError:
+        return False
+    return isinstance(error, (ResourceExhausted, TooManyRequests))
+
+
+class GovernedModel:
+    """經由限流器呼叫Gemini的模型代理
+
+    generate_content 與 generate_content_async 先取得配額再呼叫；串流回應在讀取完畢後才釋放。
+    API回報配額用盡時暫停限流器放行並改拋出 QuotaExceeded。其他屬性直接轉交原模型。
+    """
+
+    def __init__(self, model, limiter):
+        self.model = model
+        self.limiter = limiter
+
+    def __getattr__(self, item):
+        return getattr(self.model, item)
+
+    def _quota_error(self, error):
+        retry_after = self.limiter.penalize()
+        logger.warning(f"Gemini回報配額用盡，暫停 {retry_after:.0f} 秒: {str(error)}")
+        rate_limit_rejections.inc(limiter=self.limiter.name, reason='upstream')
+        return QuotaExceeded(self.limiter.name, 'Gemini回報配額用盡', retry_after)
+
+    def generate_content(self, contents, *args, stream=False, **kwargs):
+        waiter = self.limiter.acquire(estimate_tokens(contents) + self.limiter.output_tokens)
+        try:
+            response = self.model.generate_content(contents, *args, stream=stream, **kwargs)
+        except Exception as e:
+            self.limiter.release(waiter)
+            if _is_quota_error(e):
+                raise self._quota_error(e) from e
+            raise
+        if stream:
+            return self._stream(response, waiter)
+        self.limiter.release(waiter, usage_tokens(response))
+        return response
+
+    def _stream(self, response, waiter):
+        """逐段轉交串流回應，讀取完畢（或中止）時釋放配額"""
+        try:
+            for chunk in response:
+                yield chunk
+        except Exception as e:
+            if _is_quota_error(e):
+                raise self._quota_error(e) from e
+            raise
+        finally:
+            self.limiter.release(waiter, usage_tokens(response))
+
+    async def generate_content_async(self, contents, *args, **kwargs):
+        waiter = await self.limiter.acquire_async(estimate_tokens(contents) + self.limiter.output_tokens)
+        try:
+            response = await self.model.generate_content_async(contents, *args, **kwargs)
+        except Exception as e:
+            self.limiter.release(waiter)
+            if _is_quota_error(e):
+                raise self._quota_error(e) from e
+            raise
+        self.limiter.release(waiter, usage_tokens(response))
+        return response
+
+
+# 建立全域Gemini限流器（OCR與公司分析共用同一個API金鑰的配額）
+gemini_limiter = RateLimiter(
+    'gemini',
+    rpm=GEMINI_RPM,
+    tpm=GEMINI_TPM,
+    max_concurrency=GEMINI_MAX_CONCURRENCY,
+    max_queue=GEMINI_MAX_QUEUE,
+    max_wait=GEMINI_MAX_WAIT_SECONDS or None,
+    output_tokens=GEMINI_OUTPUT_TOKENS,
+    cooldown=GEMINI_QUOTA_COOLDOWN_SECONDS
+)
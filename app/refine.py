@@ -0,0 +1,179 @@
+"""
+名片OCR與客戶開發信系統 - 欄位局部重新辨識模組
+
+名片只缺少少數欄位（例如電話或統一編號）時，不必重新辨識整張圖片：
+先找出最可能包含該欄位的文字區域，只把這一小塊裁切圖片
+連同欄位專用的精簡提示詞送給模型，再把答案合併回原本的結果。
+
+文字區域的定位依序使用：
+1. Vision API的文字外框（可取得時）；
+2. 原辨識結果的 raw_text 行序對應到影像上偵測到的文字行；
+3. 各欄位在名片上的常見位置。
+"""
+import io
+import math
+import re
+from PIL import Image
+from app.cardmerge import FIELD_VALIDATORS
+from app.metrics import observe_stage
+from app.textmatch import (
+    label_classifier, EMAIL_RE, WEBSITE_RE, PHONE_RE, TAX_ID_RE,
+    COMPANY, TITLE, ADDRESS, PHONE_LABEL, MOBILE_LABEL, TAX_LABEL, WEBSITE_HINT, EMAIL_HINT
+)
+
+# 各欄位的行分類與值的正規表示式（用於在文字行中找出欄位所在位置）
+FIELD_HINTS = {
+    'company': (COMPANY, None),
+    'title': (TITLE, None),
+    'address': (ADDRESS, None),
+    'phone': (PHONE_LABEL, PHONE_RE),
+    'mobile': (MOBILE_LABEL, re.compile(r'09\d{2}[-\s]?\d{3}[-\s]?\d{3}')),
+    'tax_id': (TAX_LABEL, TAX_ID_RE),
+    'email': (EMAIL_HINT, EMAIL_RE),
+    'website': (WEBSITE_HINT, WEBSITE_RE)
+}
+
+# 各欄位在名片上的常見垂直位置（高度比例範圍），無法由文字定位時使用
+FIELD_REGIONS = {
+    'name': (0.0, 0.6),
+    'title': (0.0, 0.65),
+    'company': (0.0, 0.5),
+    'phone': (0.35, 1.0),
+    'mobile': (0.35, 1.0),
+    'email': (0.4, 1.0),
+    'website': (0.45, 1.0),
+    'address': (0.45, 1.0),
+    'tax_id': (0.3, 1.0)
+}
+
+# 裁切圖片的最大長邊（Gemini每個 768x768 圖塊計 258 個token）
+CROP_MAX_EDGE = 768
+
+# 裁切區域上下額外保留的文字行高度比例
+LINE_PADDING = 0.6
+
+
+def estimate_image_tokens(size):
+    """估計Gemini處理一張圖片的輸入token數
+
+    兩邊皆不超過384像素時計258個token；較大的圖片切成 768x768 的圖塊，每塊258個token。
+    """
+    width, height = size
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768.0) * math.ceil(height / 768.0)
+
+
+def match_field_line(field, text):
+    """文字行與欄位的符合程度：含欄位標籤得2分，含欄位值形狀得1分"""
+    category, pattern = FIELD_HINTS.get(field, (0, None))
+    score = 0
+    if category and label_classifier.classify(text) & category:
+        score += 2
+    if pattern and pattern.search(text):
+        score += 1
+    return score
+
+
+def vision_text_lines(vision_client, content):
+    """以Vision API取得文字行與外框
+
+    Returns:
+        list: [(文字, (x0, y0, x1, y1)), ...]，由上而下排序
+    """
+    from google.cloud import vision
+
+    with observe_stage('vision'):
+        response = vision_client.text_detection(image=vision.Image(content=content))
+    words = []
+    for annotation in response.text_annotations[1:]:
+        xs = [vertex.x for vertex in annotation.bounding_poly.vertices]
+        ys = [vertex.y for vertex in annotation.bounding_poly.vertices]
+        words.append((annotation.description, (min(xs), min(ys), max(xs), max(ys))))
+
+    # 垂直中心落在前一行範圍內的字詞歸為同一行
+    lines = []
+    for text, box in sorted(words, key=lambda word: (word[1][1] + word[1][3]) / 2):
+        center = (box[1] + box[3]) / 2
+        if lines and lines[-1][1][1] <= center <= lines[-1][1][3]:
+            line_text, line_box = lines[-1]
+            lines[-1] = (
+                f'{line_text} {text}',
+                (min(line_box[0], box[0]), min(line_box[1], box[1]),
+                 max(line_box[2], box[2]), max(line_box[3], box[3]))
+            )
+        else:
+            lines.append((text, box))
+    return lines
+
+
+def _band(boxes, size):
+    """多個文字行外框的聯集，橫向延伸至整張名片（欄位值常在標籤右側）並加上上下邊距"""
+    width, height = size
+    top = min(box[1] for box in boxes)
+    bottom = max(box[3] for box in boxes)
+    pad = int(min(box[3] - box[1] for box in boxes) * LINE_PADDING)
+    return (0, max(0, top - pad), width, min(height, bottom + pad))
+
+
+def locate_field(field, size, lines=None, line_boxes=None, raw_text=None):
+    """找出最可能包含欄位的區域
+
+    Args:
+        field: 欄位名稱
+        size: 圖片大小 (寬, 高)
+        lines: Vision API的文字行 [(文字, 外框), ...]
+        line_boxes: 影像上偵測到的文字行外框（無文字內容）
+        raw_text: 原辨識結果的完整文字，用於把行序對應到文字行外框
+
+    Returns:
+        tuple: ((x0, y0, x1, y1), 定位方式)
+    """
+    width, height = size
+
+    if lines:
+        scores = [match_field_line(field, text) for text, _ in lines]
+        if scores and max(scores) > 0:
+            # 取符合的行與下一行（只有標籤時，欄位值可能在下一行）
+            index = scores.index(max(scores))
+            return _band([box for _, box in lines[index:index + 2]], size), 'vision'
+
+    if line_boxes and raw_text:
+        raw_lines = [line.strip() for line in raw_text.split('\n') if line.strip()]
+        scores = [match_field_line(field, line) for line in raw_lines]
+        if scores and max(scores) > 0:
+            # 依行序比例對應到影像上的文字行，前後各多取一行以容忍對應誤差
+            position = scores.index(max(scores)) / float(max(1, len(raw_lines) - 1))
+            index = int(round(position * (len(line_boxes) - 1)))
+            return _band(line_boxes[max(0, index - 1):index + 2], size), 'layout'
+
+    top, bottom = FIELD_REGIONS.get(field, (0.0, 1.0))
+    top, bottom = int(height * top), int(math.ceil(height * bottom))
+    inside = [box for box in (line_boxes or []) if top <= (box[1] + box[3]) / 2 <= bottom]
+    if inside:
+        return _band(inside, size), 'region'
+    return (0, top, width, bottom), 'region'
+
+
+def crop_region(image, box, quality=85):
+    """裁切區域並重新編碼為JPEG，長邊超過 CROP_MAX_EDGE 時等比例縮小
+
+    Returns:
+        tuple: (JPEG位元組, 裁切圖片大小)
+    """
+    crop = image.crop(box)
+    if max(crop.size) > CROP_MAX_EDGE:
+        crop.thumbnail((CROP_MAX_EDGE, CROP_MAX_EDGE), Image.LANCZOS)
+    if crop.mode not in ('RGB', 'L'):
+        crop = crop.convert('RGB')
+    buffer = io.BytesIO()
+    crop.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue(), crop.size
+
+
+def accept_answer(field, value):
+    """模型答案是否可合併（非空且通過欄位格式檢查）"""
+    if not isinstance(value, str) or not value.strip():
+        return False
+    validator = FIELD_VALIDATORS.get(field)
+    return validator is None or validator(value.strip())
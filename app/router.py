@@ -0,0 +1,144 @@
+"""
+名片OCR與客戶開發信系統 - OCR分級路由模組
+
+先以低成本的Vision API＋規則解析擷取名片，依欄位完整度與格式正確性評分，
+只有信心不足的名片才升級交由Gemini處理。
+"""
+import re
+import threading
+from app.textmatch import EMAIL_RE
+
+# 各欄位的評分權重（合計為1）
+FIELD_WEIGHTS = {
+    'name': 0.2,
+    'company': 0.2,
+    'phone': 0.15,
+    'email': 0.15,
+    'title': 0.1,
+    'address': 0.1,
+    'tax_id': 0.05,
+    'website': 0.05
+}
+
+# 必要欄位：任一缺少時一律升級
+REQUIRED_FIELDS = ('name', 'company', 'phone', 'email')
+
+# 統一編號檢查碼權重
+TAX_ID_WEIGHTS = (1, 2, 1, 2, 1, 2, 4, 1)
+
+
+def validate_tax_id(tax_id):
+    """驗證統一編號（8位數字）檢查碼
+
+    各位數乘上權重後取十位數與個位數相加再加總，總和可被5整除即有效；
+    第7位為7時，其乘積28的位數和可視為1或0，兩者之一可被5整除即有效。
+    """
+    if not tax_id or not re.fullmatch(r'\d{8}', tax_id):
+        return False
+
+    total = 0
+    for digit, weight in zip(tax_id, TAX_ID_WEIGHTS):
+        product = int(digit) * weight
+        total += product // 10 + product % 10
+
+    if total % 5 == 0:
+        return True
+    return tax_id[6] == '7' and (total + 1) % 5 == 0
+
+
+def _digits(value):
+    """取出字串中的數字"""
+    return re.sub(r'\D', '', value or '')
+
+
+def validate_phone(phone):
+    """檢查電話號碼形狀（含區碼7至12位數字）"""
+    return 7 <= len(_digits(phone)) <= 12
+
+
+def validate_mobile(mobile):
+    """檢查台灣手機號碼形狀（09開頭共10碼，可含+886國碼）"""
+    digits = _digits(mobile)
+    if digits.startswith('886'):
+        digits = '0' + digits[3:]
+    return re.fullmatch(r'09\d{8}', digits) is not None
+
+
+def validate_email(email):
+    """檢查電子郵件格式"""
+    return bool(email) and EMAIL_RE.fullmatch(email.strip()) is not None
+
+
+def score_card(card):
+    """評估名片擷取結果的信心分數
+
+    Args:
+        card: OCR解析出的名片dict
+
+    Returns:
+        dict: score（0至1）、missing（缺少或格式錯誤的欄位）、invalid（格式錯誤的欄位）
+    """
+    card = card or {}
+    invalid = []
+    present = {}
+
+    for field in FIELD_WEIGHTS:
+        value = (card.get(field) or '').strip()
+        present[field] = bool(value)
+
+    # 電話欄位：市話或手機任一有效即可
+    phone_ok = validate_phone(card.get('phone')) or validate_mobile(card.get('mobile'))
+    if (card.get('phone') or card.get('mobile')) and not phone_ok:
+        invalid.append('phone')
+    present['phone'] = phone_ok
+
+    if present['email'] and not validate_email(card.get('email')):
+        invalid.append('email')
+        present['email'] = False
+
+    if present['tax_id'] and not validate_tax_id((card.get('tax_id') or '').strip()):
+        invalid.append('tax_id')
+        present['tax_id'] = False
+
+    score = sum(weight for field, weight in FIELD_WEIGHTS.items() if present[field])
+    missing = [field for field in FIELD_WEIGHTS if not present[field]]
+
+    return {
+        'score': round(score, 4),
+        'missing': missing,
+        'invalid': invalid,
+        'required_missing': [field for field in REQUIRED_FIELDS if not present[field]]
+    }
+
+
+class RouterStats:
+    """路由決策統計，用於衡量省下的Gemini呼叫次數與延遲"""
+
+    def __init__(self):
+        self.decisions = {}
+        self.requests = 0
+        self.cheap_ms_total = 0.0
+        self.gemini_ms_total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, decision, cheap_ms=0.0, gemini_ms=0.0):
+        """記錄一次路由決策與各階段耗時（毫秒）"""
+        with self._lock:
+            self.requests += 1
+            self.decisions[decision] = self.decisions.get(decision, 0) + 1
+            self.cheap_ms_total += cheap_ms
+            self.gemini_ms_total += gemini_ms
+
+    def snapshot(self):
+        """取得統計摘要"""
+        with self._lock:
+            skipped = self.decisions.get('cheap', 0)
+            return {
+                'requests': self.requests,
+                'decisions': dict(self.decisions),
+                'gemini_skipped': skipped,
+                'gemini_skip_rate': round(skipped / self.requests, 4) if self.requests else 0.0,
+                'avg_cheap_ms': round(self.cheap_ms_total / self.requests, 2) if self.requests else None,
+                'avg_gemini_ms': round(self.gemini_ms_total / (self.requests - skipped), 2)
+                if self.requests - skipped else None
+            }
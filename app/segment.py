@@ -0,0 +1,243 @@
+"""
+名片OCR與客戶開發信系統 - 多張名片切割與版面分析模組
+"""
+import io
+import logging
+import numpy as np
+from PIL import Image, ImageOps
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 分析用的縮圖長邊像素數（在縮圖上找邊界，再換算回原圖座標）
+ANALYSIS_EDGE = 800
+
+
+def _box_filter(mask, radius):
+    """以積分影像計算方形鄰域平均值"""
+    if radius <= 0:
+        return mask.astype(np.float32)
+
+    padded = np.pad(mask.astype(np.float32), radius + 1, mode='edge')
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    size = 2 * radius + 1
+    total = (
+        integral[size:, size:] - integral[:-size, size:]
+        - integral[size:, :-size] + integral[:-size, :-size]
+    )
+    return total[:mask.shape[0], :mask.shape[1]] / float(size * size)
+
+
+def _otsu_threshold(values):
+    """以Otsu法求取單峰分離的門檻值"""
+    hist, edges = np.histogram(values, bins=256)
+    hist = hist.astype(np.float64)
+    centers = (edges[:-1] + edges[1:]) / 2
+
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * centers)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return centers[int(np.argmax(between))]
+
+
+def foreground_mask(pixels, smooth_radius=3):
+    """估計與背景（桌面）不同的前景區域
+
+    以影像邊框像素的中位數作為背景色，計算每個像素與背景的色差，
+    再結合邊緣強度並以Otsu法二值化，最後平滑以填補名片內的空隙。
+
+    Args:
+        pixels: HxWx3 或 HxW 的NumPy陣列
+        smooth_radius: 平滑用的鄰域半徑
+
+    Returns:
+        numpy.ndarray: 布林前景遮罩
+    """
+    pixels = pixels.astype(np.float32)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+
+    border = np.concatenate([
+        pixels[0, :, :], pixels[-1, :, :], pixels[:, 0, :], pixels[:, -1, :]
+    ])
+    background = np.median(border, axis=0)
+    distance = np.sqrt(((pixels - background) ** 2).sum(axis=2))
+
+    # 邊緣強度幫助分辨顏色與桌面接近的名片
+    gray = pixels.mean(axis=2)
+    grad_y = np.abs(np.diff(gray, axis=0, prepend=gray[:1, :]))
+    grad_x = np.abs(np.diff(gray, axis=1, prepend=gray[:, :1]))
+    score = distance + 0.5 * (grad_x + grad_y)
+
+    if score.max() - score.min() < 1e-6:
+        return np.zeros(score.shape, dtype=bool)
+
+    mask = score > _otsu_threshold(score.ravel())
+    return _box_filter(mask, smooth_radius) > 0.5
+
+
+def _runs(profile, min_fill, min_length):
+    """找出投影值高於門檻的連續區段"""
+    active = profile > min_fill
+    runs = []
+    start = None
+    for index, value in enumerate(active):
+        if value and start is None:
+            start = index
+        elif not value and start is not None:
+            if index - start >= min_length:
+                runs.append((start, index))
+            start = None
+    if start is not None and len(active) - start >= min_length:
+        runs.append((start, len(active)))
+    return runs
+
+
+def _xy_cut(mask, top, left, bottom, right, min_length, boxes, depth=0):
+    """遞迴XY切割：交替以水平與垂直投影的空白處分割區域"""
+    region = mask[top:bottom, left:right]
+    if not region.any() or depth > 12:
+        return
+
+    row_runs = _runs(region.mean(axis=1), 0.02, min_length)
+    col_runs = _runs(region.mean(axis=0), 0.02, min_length)
+
+    if len(row_runs) > 1:
+        for start, end in row_runs:
+            _xy_cut(mask, top + start, left, top + end, right, min_length, boxes, depth + 1)
+        return
+
+    if len(col_runs) > 1:
+        for start, end in col_runs:
+            _xy_cut(mask, top, left + start, bottom, left + end, min_length, boxes, depth + 1)
+        return
+
+    if row_runs and col_runs:
+        y0, y1 = row_runs[0]
+        x0, x1 = col_runs[0]
+        boxes.append((left + x0, top + y0, left + x1, top + y1))
+
+
+def find_card_boxes(image, min_area=0.01, max_cards=20):
+    """在整張照片中找出各張名片的外框
+
+    Args:
+        image: 已轉正的PIL圖片
+        min_area: 名片最小面積（佔整張圖片的比例）
+        max_cards: 最多返回的名片數量
+
+    Returns:
+        list: 原圖座標的外框列表 [(x0, y0, x1, y1), ...]，依由上而下、由左而右排序
+    """
+    width, height = image.size
+    scale = min(1.0, ANALYSIS_EDGE / float(max(width, height)))
+    small = image.convert('RGB')
+    if scale < 1.0:
+        small = small.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.BILINEAR)
+
+    mask = foreground_mask(np.asarray(small))
+    min_length = max(4, int(min(mask.shape) * 0.05))
+
+    boxes = []
+    _xy_cut(mask, 0, 0, mask.shape[0], mask.shape[1], min_length, boxes)
+
+    total_area = mask.shape[0] * mask.shape[1]
+    cards = []
+    for x0, y0, x1, y1 in boxes:
+        box_w, box_h = x1 - x0, y1 - y0
+        if box_w * box_h < total_area * min_area:
+            continue
+        # 名片長寬比約1.75，保留寬鬆範圍以容納傾斜與透視變形
+        aspect = max(box_w, box_h) / float(max(1, min(box_w, box_h)))
+        if aspect > 3.0:
+            continue
+        if mask[y0:y1, x0:x1].mean() < 0.5:
+            continue
+        cards.append((x0, y0, x1, y1))
+
+    # 換算回原圖座標並加上少量邊界
+    results = []
+    for x0, y0, x1, y1 in cards[:max_cards]:
+        pad = 2
+        results.append((
+            max(0, int((x0 - pad) / scale)),
+            max(0, int((y0 - pad) / scale)),
+            min(width, int((x1 + pad) / scale)),
+            min(height, int((y1 + pad) / scale))
+        ))
+
+    results.sort(key=lambda box: (box[1] // max(1, height // 10), box[0]))
+    logger.info(f"偵測到 {len(results)} 張名片")
+    return results
+
+
+def find_text_lines(image, min_fill=0.004):
+    """以水平投影找出名片上的文字行
+
+    以Otsu法分離文字與底色（深底淺字時自動反轉），每段有文字的連續列即為一行；
+    幾乎整欄或整列都是前景的部分（名片邊框或殘留的桌面）會先被去除。
+
+    Args:
+        image: 已裁切到名片範圍的PIL圖片
+        min_fill: 視為有文字的列最少前景比例
+
+    Returns:
+        list: 原圖座標的文字行外框 [(x0, y0, x1, y1), ...]，由上而下排序
+    """
+    width, height = image.size
+    scale = min(1.0, ANALYSIS_EDGE / float(max(width, height)))
+    small = image.convert('L')
+    if scale < 1.0:
+        small = small.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.BILINEAR)
+
+    gray = np.asarray(small, dtype=np.float32)
+    if gray.max() - gray.min() < 1e-6:
+        return []
+    ink = gray < _otsu_threshold(gray.ravel())
+    if ink.mean() > 0.5:
+        ink = ~ink
+    # 去除名片邊框與殘留背景（幾乎整欄或整列都是前景）
+    ink[:, ink.mean(axis=0) > 0.6] = False
+    ink[ink.mean(axis=1) > 0.6, :] = False
+
+    lines = []
+    for y0, y1 in _runs(ink.mean(axis=1), min_fill, 2):
+        band = ink[y0:y1]
+        columns = np.nonzero(band.any(axis=0))[0]
+        if len(columns) < 3:
+            continue
+        lines.append((
+            int(columns[0] / scale), int(y0 / scale),
+            min(width, int((columns[-1] + 1) / scale)), min(height, int(y1 / scale))
+        ))
+    return lines
+
+
+def split_cards(content, min_area=0.01, max_cards=20, quality=95):
+    """將多張名片的照片切割為個別名片圖片
+
+    Args:
+        content: 原始圖片位元組
+        min_area: 名片最小面積（佔整張圖片的比例）
+        max_cards: 最多切割的名片數量
+        quality: 裁切後重新編碼的JPEG品質
+
+    Returns:
+        list: [(外框, JPEG位元組), ...]；找不到名片時返回整張圖片
+    """
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(content))).convert('RGB')
+    boxes = find_card_boxes(image, min_area=min_area, max_cards=max_cards)
+    if not boxes:
+        boxes = [(0, 0, image.size[0], image.size[1])]
+
+    crops = []
+    for box in boxes:
+        buffer = io.BytesIO()
+        image.crop(box).save(buffer, format='JPEG', quality=quality)
+        crops.append((list(box), buffer.getvalue()))
+    return crops
@@ -6,6 +6,8 @@ import logging
 import gspread
 from google.oauth2.service_account import Credentials
 from datetime import datetime
+from app.lazy import LazyInstance
+from app.metrics import observe_stage
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -126,7 +128,8 @@ class SheetsProcessor:
                 row_data.append('')
             
             # 新增資料列
-            sheet.append_row(row_data)
+            with observe_stage('sheets_append'):
+                sheet.append_row(row_data)
             logger.info(f"成功將名片資訊儲存至Google Sheets: {card_data.get('company_name', '')}")
             
             return True
@@ -219,5 +222,5 @@ class SheetsProcessor:
             logger.error(f"從Google Sheets取得名片資訊失敗: {str(e)}")
             return []
 
-# 建立全域實例
-sheets_processor = SheetsProcessor() 
\ No newline at end of file
+# 建立全域實例（第一次使用時才初始化API客戶端）
+sheets_processor = LazyInstance('sheets_processor', SheetsProcessor) 
\ No newline at end of file
@@ -0,0 +1,301 @@
+"""
+名片OCR與客戶開發信系統 - 上傳檔案儲存模組
+
+上傳的圖片以內容的SHA-256作為鍵（內容定址）：
+- 相同內容只保存一份，不同手機上傳的同名檔案（例如 IMG_0001.jpg）不會互相覆蓋；
+- 檔案依鍵的前綴分層存放（ab/cd/abcd...），避免單一目錄內檔案過多；
+- 垃圾回收依最後存取時間刪除過期檔案，總容量超過上限時再由最久未存取的開始刪除。
+
+應用程式只透過 BlobStore 介面存取檔案；多台Flask節點共用儲存時，
+可註冊共享物件儲存的實作並以 OCR_STORAGE_BACKEND 切換。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from app.config import (
+    OCR_STORAGE_BACKEND, OCR_UPLOAD_FOLDER, OCR_STORAGE_SHARD_DEPTH,
+    OCR_STORAGE_TTL, OCR_STORAGE_MAX_BYTES, OCR_STORAGE_GC_INTERVAL
+)
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 儲存鍵格式（SHA-256十六進位）
+BLOB_KEY_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 已註冊的儲存實作
+STORES = {}
+
+
+def register_store(name):
+    """註冊儲存實作類別的裝飾器"""
+    def decorator(cls):
+        cls.name = name
+        STORES[name] = cls
+        return cls
+    return decorator
+
+
+def create_store(name, **options):
+    """依名稱建立儲存實例"""
+    cls = STORES.get(name)
+    if cls is None:
+        raise ValueError(f"未知的儲存實作: {name}")
+    return cls(**options)
+
+
+def blob_key(content):
+    """內容的儲存鍵"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def is_blob_key(value):
+    """字串是否為儲存鍵（而非檔案路徑）"""
+    return isinstance(value, str) and BLOB_KEY_RE.match(value) is not None
+
+
+class BlobStore:
+    """內容定址儲存介面"""
+
+    name = None
+
+    def put(self, content):
+        """保存內容並返回儲存鍵（已存在時只更新存取時間）"""
+        raise NotImplementedError
+
+    def get(self, key):
+        """讀取內容並更新存取時間
+
+        Raises:
+            KeyError: 鍵不存在（或已被回收）
+        """
+        raise NotImplementedError
+
+    def exists(self, key):
+        """鍵是否存在"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """刪除內容，返回是否確實刪除"""
+        raise NotImplementedError
+
+    def collect(self, ttl=None, max_bytes=None):
+        """垃圾回收，返回回收統計"""
+        raise NotImplementedError
+
+    def stats(self):
+        """取得儲存統計"""
+        raise NotImplementedError
+
+
+@register_store('local')
+class LocalBlobStore(BlobStore):
+    """本機檔案系統上的內容定址儲存
+
+    以檔案的修改時間作為最後存取時間：重複上傳與讀取都會更新它，
+    垃圾回收因此不會刪除仍在使用的圖片。
+    """
+
+    def __init__(self, root, shard_depth=2, ttl=None, max_bytes=None):
+        """初始化本機儲存
+
+        Args:
+            root: 儲存根目錄
+            shard_depth: 分層目錄數（每層使用鍵的兩個字元）
+            ttl: 預設保留秒數（None或0表示不依時間回收）
+            max_bytes: 預設總容量上限（None或0表示不限制）
+        """
+        self.root = root
+        self.shard_depth = shard_depth
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.puts = 0
+        self.deduplicated = 0
+        self.last_gc = None
+        self._lock = threading.Lock()
+
+    def path_for(self, key):
+        """鍵對應的檔案路徑"""
+        if not is_blob_key(key):
+            raise KeyError(key)
+        shards = [key[index * 2:index * 2 + 2] for index in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, key)
+
+    def put(self, content):
+        key = blob_key(content)
+        path = self.path_for(key)
+        with self._lock:
+            self.puts += 1
+        if self._touch(path):
+            with self._lock:
+                self.deduplicated += 1
+            return key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先寫入暫存檔再改名，讀取端不會看到寫到一半的檔案；並行寫入相同內容也只是覆蓋成相同的檔案
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+        return key
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+        self._touch(path)
+        return content
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path_for(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _touch(self, path):
+        """更新最後存取時間，檔案不存在時返回False"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _scan(self):
+        """列出所有檔案：[(最後存取時間, 大小, 路徑), ...]"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+        return entries
+
+    def collect(self, ttl=None, max_bytes=None):
+        """刪除超過保留時間的檔案，總容量仍超過上限時由最久未存取的開始刪除
+
+        殘留超過一小時的暫存檔（寫入途中行程中止）也會一併刪除。
+        """
+        ttl = self.ttl if ttl is None else ttl
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        start = time.perf_counter()
+        now = time.time()
+
+        entries = sorted(self._scan())
+        kept = []
+        removed = 0
+        removed_bytes = 0
+        for mtime, size, path in entries:
+            if path.endswith('.tmp'):
+                expired = now - mtime > 3600
+            else:
+                expired = bool(ttl) and now - mtime > ttl
+            if expired:
+                removed += self._remove(path)
+                removed_bytes += size
+            else:
+                kept.append((mtime, size, path))
+
+        total_bytes = sum(size for _, size, _ in kept)
+        while max_bytes and kept and total_bytes > max_bytes:
+            _, size, path = kept.pop(0)
+            removed += self._remove(path)
+            removed_bytes += size
+            total_bytes -= size
+
+        report = {
+            'removed': removed,
+            'removed_bytes': removed_bytes,
+            'remaining': len(kept),
+            'remaining_bytes': total_bytes,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2),
+            'finished_at': now
+        }
+        with self._lock:
+            self.last_gc = report
+        if removed:
+            logger.info(f"上傳儲存垃圾回收: 刪除 {removed} 個檔案（{removed_bytes} bytes），剩餘 {len(kept)} 個")
+        return report
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        # 順便移除空的分層目錄
+        directory = os.path.dirname(path)
+        while directory != self.root and directory.startswith(self.root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+        return 1
+
+    def stats(self):
+        entries = self._scan()
+        with self._lock:
+            return {
+                'backend': self.name,
+                'root': self.root,
+                'files': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'ttl': self.ttl,
+                'max_bytes': self.max_bytes,
+                'puts': self.puts,
+                'deduplicated': self.deduplicated,
+                'last_gc': self.last_gc
+            }
+
+
+class StorageCollector:
+    """定期執行儲存垃圾回收的背景執行緒"""
+
+    def __init__(self, store, interval):
+        self.store = store
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """啟動背景回收（interval 為0時不啟動）"""
+        if not self.interval or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='storage-gc', daemon=True)
+        self._thread.start()
+        logger.info(f"上傳儲存垃圾回收已啟動，每 {self.interval} 秒執行一次")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.store.collect()
+            except Exception as e:
+                logger.error(f"上傳儲存垃圾回收失敗: {str(e)}")
+
+
+# 建立全域上傳儲存實例
+upload_store = create_store(
+    OCR_STORAGE_BACKEND,
+    root=OCR_UPLOAD_FOLDER,
+    shard_depth=OCR_STORAGE_SHARD_DEPTH,
+    ttl=OCR_STORAGE_TTL,
+    max_bytes=OCR_STORAGE_MAX_BYTES
+)
+storage_collector = StorageCollector(upload_store, OCR_STORAGE_GC_INTERVAL)
@@ -2,6 +2,9 @@
 名片OCR與客戶開發信系統 - Streamlit介面
 """
 import os
+import time
+import uuid
+import hashlib
 import requests
 import streamlit as st
 from PIL import Image
@@ -28,6 +31,81 @@ st.set_page_config(
 # API端點
 API_BASE_URL = os.environ.get('API_BASE_URL', 'http://localhost:5001')
 
+# 非同步OCR工作模式（排入工作後輪詢結果，避免長時間佔用連線）
+OCR_ASYNC_JOBS = os.environ.get('OCR_ASYNC_JOBS', 'False') == 'True'
+OCR_JOB_POLL_INTERVAL = float(os.environ.get('OCR_JOB_POLL_INTERVAL', 1.0))
+OCR_JOB_TIMEOUT = float(os.environ.get('OCR_JOB_TIMEOUT', 180))
+
+# 串流OCR模式（欄位一辨識完成即顯示）
+OCR_STREAMING = os.environ.get('OCR_STREAMING', 'False') == 'True'
+
+def raise_for_status(response):
+    """檢查回應狀態；Gemini配額不足（429）時以可讀的訊息提示稍後重試"""
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After", "")
+        raise RuntimeError(f"Gemini配額不足，請於 {retry_after} 秒後重試")
+    response.raise_for_status()
+
+def idempotency_key(payload):
+    """由請求內容產生冪等鍵（重複點擊或重新執行時，伺服器返回第一次的結果而不重複寄信）"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def run_ocr_stream(endpoint, **request_kwargs):
+    """以SSE串流執行OCR並逐步顯示欄位，返回與 /api/ocr 相同格式的結果
+
+    Args:
+        endpoint: /api/ocr（request_kwargs 為 json）或 /api/ocr/upload（request_kwargs 為 files）
+    """
+    placeholder = st.empty()
+    partial = {}
+    result = {"status": "error", "error": "串流提前結束"}
+    
+    with requests.post(
+        f"{API_BASE_URL}{endpoint}",
+        headers={"Accept": "text/event-stream"},
+        stream=True,
+        **request_kwargs
+    ) as response:
+        raise_for_status(response)
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                payload = json.loads(line[5:].strip())
+                if event == "field":
+                    partial[payload["field"]] = payload["value"]
+                    placeholder.json(partial)
+                else:
+                    result = payload
+    
+    placeholder.empty()
+    return result
+
+def run_ocr_job(image_path, back_image_path=None):
+    """排入非同步OCR工作並輪詢直到完成，返回與 /api/ocr 相同格式的結果"""
+    payload = {"image_path": image_path}
+    if back_image_path:
+        payload["back_image_path"] = back_image_path
+    submit_response = requests.post(f"{API_BASE_URL}/api/jobs", json=payload)
+    submit_response.raise_for_status()
+    job_id = submit_response.json()["data"]["job_id"]
+    
+    deadline = time.monotonic() + OCR_JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        job_response = requests.get(f"{API_BASE_URL}/api/jobs/{job_id}")
+        job_response.raise_for_status()
+        job = job_response.json()["data"]
+        
+        if job["status"] == "succeeded":
+            return {"status": "success", **job["result"]}
+        if job["status"] == "failed":
+            return {"status": "error", "error": job.get("error") or "未知錯誤"}
+        
+        time.sleep(OCR_JOB_POLL_INTERVAL)
+    
+    return {"status": "error", "error": f"OCR工作逾時（{job_id}）"}
+
 def main():
     """主要應用程式"""
     st.title("名片OCR與客戶開發信系統")
@@ -40,6 +118,9 @@ def main():
     if 'card_data' not in st.session_state:
         st.session_state.card_data = {}
     
+    if 'image_path' not in st.session_state:
+        st.session_state.image_path = None
+    
     if 'company_data' not in st.session_state:
         st.session_state.company_data = {}
     
@@ -67,11 +148,14 @@ def step1_upload_card():
     st.header("步驟1: 上傳名片圖片", divider=True)
     
     uploaded_file = st.file_uploader("選擇名片圖片", type=["jpg", "jpeg", "png"])
+    back_file = st.file_uploader("名片背面（選填，正反面將合併辨識）", type=["jpg", "jpeg", "png"])
     
     if uploaded_file is not None:
         # 顯示圖片預覽
         image = Image.open(uploaded_file)
         st.image(image, caption="名片預覽", width=400)
+        if back_file is not None:
+            st.image(Image.open(back_file), caption="名片背面預覽", width=400)
         
         if st.button("上傳並辨識"):
             with st.spinner("正在上傳並辨識名片..."):
@@ -82,34 +166,34 @@ def step1_upload_card():
                     
                     # 創建一個帶有正確文件名的文件對象
                     files = {"file": (uploaded_file.name, uploaded_file.getvalue(), f"image/{uploaded_file.type.split('/')[1]}")}
+                    if back_file is not None:
+                        files["back"] = (back_file.name, back_file.getvalue(), f"image/{back_file.type.split('/')[1]}")
                     
                     # 顯示調試信息
                     st.write(f"正在上傳文件: {uploaded_file.name}, 類型: {uploaded_file.type}")
                     
-                    # 發送請求
-                    response = requests.post(f"{API_BASE_URL}/upload", files=files)
-                    
-                    # 顯示響應狀態
-                    st.write(f"上傳響應狀態碼: {response.status_code}")
-                    
-                    # 如果有錯誤信息，顯示它
-                    if response.status_code != 200:
-                        st.error(f"上傳失敗: {response.text}")
-                        return
-                    
-                    response.raise_for_status()
-                    upload_data = response.json()
-                    
-                    # 處理OCR
-                    ocr_response = requests.post(
-                        f"{API_BASE_URL}/api/ocr",
-                        json={"image_path": upload_data.get("path")}
-                    )
-                    ocr_response.raise_for_status()
-                    ocr_data = ocr_response.json()
+                    # 非同步工作模式需要先上傳取得路徑；其他模式在同一個請求中上傳並辨識（串流模式僅支援單面名片）
+                    if OCR_ASYNC_JOBS:
+                        response = requests.post(f"{API_BASE_URL}/upload", files=files)
+                        if response.status_code != 200:
+                            st.error(f"上傳失敗: {response.text}")
+                            return
+                        upload_data = response.json()
+                        ocr_data = run_ocr_job(upload_data.get("path"), upload_data.get("back_path"))
+                        ocr_data.setdefault("path", upload_data.get("path"))
+                    elif OCR_STREAMING and back_file is None:
+                        ocr_data = run_ocr_stream("/api/ocr/upload", files=files)
+                    else:
+                        response = requests.post(f"{API_BASE_URL}/api/ocr/upload", files=files)
+                        st.write(f"上傳響應狀態碼: {response.status_code}")
+                        if response.status_code == 413:
+                            st.error("上傳失敗: 檔案過大")
+                            return
+                        ocr_data = response.json()
                     
                     if ocr_data.get("status") == "success":
                         st.session_state.card_data = ocr_data.get("data", {})
+                        st.session_state.image_path = ocr_data.get("path")
                         st.session_state.step = 2
                         st.rerun()
                     else:
@@ -130,6 +214,34 @@ def step2_confirm_card_info():
         st.session_state.step = 1
         st.rerun()
     
+    # 只重新辨識空白的欄位（只送出欄位所在區域的裁切圖片）
+    empty_fields = [
+        field for field, value in st.session_state.card_data.items()
+        if not value and not field.endswith("_en")
+    ]
+    if st.session_state.image_path and empty_fields and st.button("補辨識空白欄位"):
+        with st.spinner("正在重新辨識空白欄位..."):
+            try:
+                refine_response = requests.post(
+                    f"{API_BASE_URL}/api/ocr/refine",
+                    json={
+                        "image_path": st.session_state.image_path,
+                        "data": st.session_state.card_data,
+                        "fields": empty_fields
+                    }
+                )
+                raise_for_status(refine_response)
+                refine_data = refine_response.json()
+                if refine_data.get("status") == "success":
+                    for field in empty_fields:
+                        if refine_data["data"].get(field):
+                            st.session_state.card_data[field] = refine_data["data"][field]
+                    st.rerun()
+                else:
+                    st.error(f"重新辨識失敗: {refine_data.get('error', '未知錯誤')}")
+            except Exception as e:
+                st.error(f"處理錯誤: {str(e)}")
+    
     # 顯示並允許編輯名片資訊
     with st.form("card_info_form"):
         col1, col2 = st.columns(2)
@@ -170,6 +282,24 @@ def step2_confirm_card_info():
                 value=st.session_state.card_data.get("address", "")
             )
         
+        # 雙面名片的英文欄位
+        col3, col4, col5 = st.columns(3)
+        with col3:
+            company_name_en = st.text_input(
+                "英文公司名稱",
+                value=st.session_state.card_data.get("company_name_en", "")
+            )
+        with col4:
+            person_name_en = st.text_input(
+                "英文姓名",
+                value=st.session_state.card_data.get("person_name_en", "")
+            )
+        with col5:
+            title_en = st.text_input(
+                "英文職稱",
+                value=st.session_state.card_data.get("title_en", "")
+            )
+        
         submit_button = st.form_submit_button("確認並分析公司資訊")
         
         if submit_button:
@@ -187,7 +317,10 @@ def step2_confirm_card_info():
                             "phone": phone,
                             "mobile": mobile,
                             "email": email,
-                            "address": address
+                            "address": address,
+                            "company_name_en": company_name_en,
+                            "person_name_en": person_name_en,
+                            "title_en": title_en
                         }
                         
                         # 分析公司資訊
@@ -199,7 +332,7 @@ def step2_confirm_card_info():
                                 "address": address
                             }
                         )
-                        analyze_response.raise_for_status()
+                        raise_for_status(analyze_response)
                         analyze_data = analyze_response.json()
                         
                         if analyze_data.get("status") == "success":
@@ -280,12 +413,15 @@ def step3_input_my_company():
                                     "title": my_title,
                                     "contact": my_contact
                                 }
-                            }
+                            },
+                            # 同一次產生的重送共用一個鍵，成功後下次重新產生
+                            headers={"Idempotency-Key": st.session_state.setdefault("generate_email_key", uuid.uuid4().hex)}
                         )
-                        generate_response.raise_for_status()
+                        raise_for_status(generate_response)
                         generate_data = generate_response.json()
                         
                         if generate_data.get("status") == "success":
+                            st.session_state.pop("generate_email_key", None)
                             st.session_state.email_data = generate_data.get("data", {})
                             st.session_state.my_company_data = {
                                 "name": my_company_name,
@@ -358,13 +494,15 @@ def step4_preview_and_send():
                     with st.spinner("正在發送郵件..."):
                         try:
                             # 發送郵件
+                            send_payload = {
+                                "email": recipient_email,
+                                "subject": subject,
+                                "content": content
+                            }
                             send_response = requests.post(
                                 f"{API_BASE_URL}/api/send-email",
-                                json={
-                                    "email": recipient_email,
-                                    "subject": subject,
-                                    "content": content
-                                }
+                                json=send_payload,
+                                headers={"Idempotency-Key": idempotency_key(send_payload)}
                             )
                             send_response.raise_for_status()
                             send_data = send_response.json()
@@ -0,0 +1,211 @@
+"""
+名片OCR與客戶開發信系統 - 名片文字關鍵字比對模組
+
+兩個名片文字解析器共用同一組預先編譯的正規表示式與行分類器。
+每個解析器的關鍵字編譯為一個前綴樹形式的多關鍵字交替正規表示式（較長的關鍵字優先），
+整段文字只掃描一次即可得到每一行命中分類的位元遮罩；
+關鍵字包含另一個關鍵字時（例如 https:// 包含 http），命中時同時計入兩者的分類。
+各解析器保留原本的關鍵字組合，解析結果與改寫前相同。
+"""
+import itertools
+import re
+
+# 行分類（位元遮罩）
+COMPANY = 1 << 0
+TITLE = 1 << 1
+ADDRESS = 1 << 2
+PHONE_LABEL = 1 << 3
+MOBILE_LABEL = 1 << 4
+TAX_LABEL = 1 << 5
+WEBSITE_HINT = 1 << 6
+EMAIL_HINT = 1 << 7
+NAME_EXCLUDE = 1 << 8
+
+# 需以正規表示式擷取值的欄位標籤
+VALUE_HINTS = EMAIL_HINT | WEBSITE_HINT | PHONE_LABEL | MOBILE_LABEL | TAX_LABEL
+
+# 含有這些字眼的行不會是人名（忽略大小寫）
+NAME_EXCLUDE_KEYWORDS = [
+    ('電話', NAME_EXCLUDE, True),
+    ('tel', NAME_EXCLUDE, True),
+    ('www', NAME_EXCLUDE, True),
+    ('http', NAME_EXCLUDE, True),
+    ('@', NAME_EXCLUDE, True),
+    ('股份', NAME_EXCLUDE, True),
+    ('有限', NAME_EXCLUDE, True),
+]
+
+# 名片解析器的關鍵字：(關鍵字, 分類, 是否忽略大小寫)
+CARD_KEYWORDS = [
+    ('@', EMAIL_HINT, False),
+    ('http://', WEBSITE_HINT, False),
+    ('https://', WEBSITE_HINT, False),
+    ('www.', WEBSITE_HINT, False),
+    ('電話', PHONE_LABEL, False),
+    ('T:', PHONE_LABEL, False),
+    ('手機', MOBILE_LABEL, False),
+    ('M:', MOBILE_LABEL, False),
+    ('統一編號', TAX_LABEL, False),
+    ('統編', TAX_LABEL, False),
+    ('市', ADDRESS, False),
+    ('縣', ADDRESS, False),
+    ('路', ADDRESS, False),
+    ('街', ADDRESS, False),
+    ('區', ADDRESS, False),
+    ('經理', TITLE, False),
+    ('主任', TITLE, False),
+    ('總監', TITLE, False),
+    ('工程師', TITLE, False),
+    ('Manager', TITLE, False),
+    ('Director', TITLE, False),
+    ('Engineer', TITLE, False),
+    ('公司', COMPANY, False),
+    ('企業', COMPANY, False),
+    ('集團', COMPANY, False),
+    ('Co.', COMPANY, False),
+    ('Ltd', COMPANY, False),
+    ('Inc', COMPANY, False),
+] + NAME_EXCLUDE_KEYWORDS
+
+# 備用解析器（JSON解析失敗時）只使用較少的中文關鍵字；@ 與 . 用於找出可能含電子郵件與網站的行
+FALLBACK_KEYWORDS = [
+    ('@', EMAIL_HINT, False),
+    ('.', WEBSITE_HINT, False),
+    ('公司', COMPANY, False),
+    ('企業', COMPANY, False),
+    ('集團', COMPANY, False),
+    ('經理', TITLE, False),
+    ('主任', TITLE, False),
+    ('總監', TITLE, False),
+    ('工程師', TITLE, False),
+    ('市', ADDRESS, False),
+    ('縣', ADDRESS, False),
+    ('路', ADDRESS, False),
+    ('街', ADDRESS, False),
+] + NAME_EXCLUDE_KEYWORDS
+
+# 欄位定位使用的標籤關鍵字（另外以忽略大小寫的方式辨識英文電話、手機與網址標籤）
+LABEL_KEYWORDS = CARD_KEYWORDS + [
+    ('tel', PHONE_LABEL, True),
+    ('mobile', MOBILE_LABEL, True),
+    ('http://', WEBSITE_HINT, True),
+    ('https://', WEBSITE_HINT, True),
+    ('www.', WEBSITE_HINT, True),
+]
+
+# 職稱關鍵字（供職稱擷取正規表示式使用）
+TITLE_KEYWORDS = [keyword for keyword, category, _ in CARD_KEYWORDS if category == TITLE]
+
+# 預先編譯的正規表示式
+# 網址與電話以可省略的部分開頭，開頭的前瞻斷言列出所有可能的首字元，
+# 讓引擎略過不可能開始命中的位置（命中結果不變）
+EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+WEBSITE_RE = re.compile(r'(?=[a-zA-Z0-9])(https?://)?([a-zA-Z0-9][-a-zA-Z0-9]*\.)+[a-zA-Z]{2,}(/[-a-zA-Z0-9%_.~#?&=]*)?')
+PHONE_RE = re.compile(r'(?=[\(\)（）\d])[\(\)（）]?\d{2,4}[\(\)（）]?[-\s]?\d{3,4}[-\s]?\d{3,4}')
+TAX_ID_RE = re.compile(r'\d{8}')
+TITLE_RE = re.compile(
+    r'(?:^|\s)([^0-9]+(?:' + '|'.join(map(re.escape, TITLE_KEYWORDS)) + r')[^0-9]*)(?:\s|$)'
+)
+
+
+def _case_variants(keyword):
+    """列出關鍵字所有大小寫組合（僅展開英文字母）"""
+    choices = [(ch.lower(), ch.upper()) if ch.isalpha() and ch.isascii() else (ch,) for ch in keyword]
+    return {''.join(combo) for combo in itertools.product(*choices)}
+
+
+def _trie_pattern(texts):
+    """把字面字串組成前綴樹形式的交替正規表示式
+
+    同一層的分支首字元都不同，引擎在每個位置最多只會進入一個分支；
+    較長的字串先嘗試，空分支放在最後，因此與「較長者優先」的平鋪交替命中相同的字串。
+    """
+    alternatives = []
+    for first, group in itertools.groupby(sorted(texts), key=lambda text: text[0]):
+        group = list(group)
+        rests = [text[1:] for text in group if len(text) > 1]
+        if not rests:
+            alternatives.append(re.escape(first))
+            continue
+        sub = _trie_pattern(rests)
+        if len(rests) < len(group):
+            # 首字元本身也是完整的字串：最後嘗試空分支
+            sub = f'(?:{sub}|)'
+        elif '|' in sub:
+            sub = f'(?:{sub})'
+        alternatives.append(re.escape(first) + sub)
+    return '|'.join(alternatives)
+
+
+class LineClassifier:
+    """以單一預先編譯的交替正規表示式分類文字行"""
+
+    def __init__(self, keywords):
+        """建立分類器
+
+        忽略大小寫的關鍵字展開為所有大小寫組合的字面字串：交替的分支全為字面字串時，
+        正規表示式引擎可先以首字元集合略過不可能命中的位置，比 (?i:...) 群組快數倍。
+
+        Args:
+            keywords: (關鍵字, 分類位元, 是否忽略大小寫) 的列表
+        """
+        self._keywords = keywords
+        texts = set()
+        for keyword, _, ignore_case in keywords:
+            texts |= _case_variants(keyword) if ignore_case else {keyword}
+
+        # 掃描時命中的字串彼此不重疊，跨在前一個命中字串結尾上的關鍵字會被略過
+        # （例如 wwww. 先命中 www，其後的 www. 就不會再被找到）。
+        # 因此把「前一個字串的結尾正好是關鍵字開頭」的組合也加入交替，
+        # 以最長命中取代；組合後沒有新增分類的不需要加入
+        pending = list(texts)
+        keyword_texts = frozenset(texts)
+        while pending:
+            text = pending.pop()
+            text_mask = self._mask_of(text)
+            for keyword_text in keyword_texts:
+                for size in range(1, min(len(text), len(keyword_text))):
+                    merged = text + keyword_text[size:]
+                    if (text.endswith(keyword_text[:size]) and merged not in texts
+                            and self._mask_of(keyword_text) & ~text_mask):
+                        texts.add(merged)
+                        pending.append(merged)
+
+        # 命中較長的字串時，其中包含的較短關鍵字也視為命中
+        self._masks = {text: self._mask_of(text) for text in texts}
+
+        # 換行也是一個分支，整段文字只需呼叫一次 findall 即可分出每一行的分類
+        self._findall = re.compile(_trie_pattern(texts | {'\n'})).findall
+
+    def _mask_of(self, text):
+        """計算字串中包含的所有關鍵字的分類位元遮罩"""
+        mask = 0
+        for keyword, category, ignore_case in self._keywords:
+            if (keyword.lower() in text.lower()) if ignore_case else (keyword in text):
+                mask |= category
+        return mask
+
+    def classify(self, line):
+        """返回單行文字命中的分類位元遮罩"""
+        return self.classify_lines(line)[0]
+
+    def classify_lines(self, text):
+        """掃描一次整段文字，返回與 text.split('\\n') 逐行對應的分類位元遮罩列表"""
+        masks = self._masks
+        result = []
+        append = result.append
+        mask = 0
+        for token in self._findall(text):
+            if token == '\n':
+                append(mask)
+                mask = 0
+            else:
+                mask |= masks[token]
+        append(mask)
+        return result
+
+
+# 建立共用實例
+card_classifier = LineClassifier(CARD_KEYWORDS)
+fallback_classifier = LineClassifier(FALLBACK_KEYWORDS)
+label_classifier = LineClassifier(LABEL_KEYWORDS)
@@ -0,0 +1,97 @@
+"""
+名片OCR與客戶開發信系統 - 記憶體上傳處理模組
+
+單一請求上傳＋OCR的檔案直接保存在記憶體（不經由暫存檔），
+寫入途中超過大小上限即中止請求；原始圖片可選擇在背景寫入上傳儲存。
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from app.config import OCR_UPLOAD_MAX_BYTES
+from app.storage import upload_store, blob_key
+from app.metrics import observe_stage
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LimitedBuffer(io.BytesIO):
+    """超過大小上限即拋出 413 的記憶體緩衝區"""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def write(self, data):
+        if self.tell() + len(data) > self.limit:
+            raise RequestEntityTooLarge(f'檔案超過 {self.limit} bytes 上限')
+        return super().write(data)
+
+
+def in_memory_upload(view):
+    """標記路由的上傳檔案保存在記憶體（見 InMemoryRequest）"""
+    view.in_memory_upload = True
+    return view
+
+
+class InMemoryRequest(Request):
+    """可將上傳檔案保存在記憶體的請求類別
+
+    Werkzeug預設將超過500KB的檔案寫入暫存檔；以 in_memory_upload 標記的路由
+    改用有上限的記憶體緩衝區，multipart解析器邊讀取邊寫入，
+    超過上限時立即中止而不必讀完整個請求。其他路由（例如批次上傳）維持預設行為。
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        view = current_app.view_functions.get(self.endpoint) if self.endpoint else None
+        if getattr(view, 'in_memory_upload', False):
+            return LimitedBuffer(OCR_UPLOAD_MAX_BYTES)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+class UploadSaver:
+    """在背景將上傳的原始圖片寫入上傳儲存（重複上傳不重複寫入）"""
+
+    def __init__(self, store, workers=2):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-save')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def save(self, content):
+        """排入背景寫入
+
+        Returns:
+            str: 寫入完成後可讀取的儲存鍵
+        """
+        key = blob_key(content)
+        with self._lock:
+            if key not in self._pending:
+                self._pending[key] = self._executor.submit(self._write, key, content)
+        return key
+
+    def _write(self, key, content):
+        try:
+            with observe_stage('upload_save'):
+                self.store.put(content)
+            logger.info(f"已儲存上傳圖片: {key}")
+        except OSError as e:
+            logger.error(f"儲存上傳圖片失敗: {key}, {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def wait(self, key, timeout=10.0):
+        """等待指定鍵的背景寫入完成（沒有待寫入的工作時立即返回）"""
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            future.result(timeout=timeout)
+
+
+# 建立全域上傳儲存實例
+upload_saver = UploadSaver(upload_store)
@@ -0,0 +1,209 @@
+"""
+名片OCR與客戶開發信系統 - 同步與非同步服務模式容量比較
+
+以重播後端（stub）模擬Gemini的固定延遲，分別以同步模式（執行緒池大小固定的WSGI伺服器，
+相當於 gunicorn gthread 的一個行程）與非同步模式（app.asgi）啟動服務，
+以大量並行用戶端呼叫 /api/ocr，比較吞吐量、尾端延遲與同時處理中的請求數。不需要網路連線。
+
+使用方式:
+    python benchmarks/bench_async.py [--mode both|sync|async] [--requests 600]
+        [--concurrency 300] [--latency fixed:2000] [--threads 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure(args, workdir):
+    """在匯入應用程式前設定環境變數（配置於匯入時讀取）"""
+    os.environ['OCR_BACKENDS'] = 'stub'
+    os.environ['OCR_STUB_LATENCY'] = args.latency
+    os.environ['INSTANCE_PATH'] = workdir
+    os.environ['OCR_UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    # 每個請求都實際經過OCR後端；停用前處理，讓兩種模式的差異只來自等待API的方式
+    os.environ['OCR_CACHE_ENABLED'] = 'False'
+    os.environ['OCR_DEDUP_ENABLED'] = 'False'
+    os.environ['OCR_JOBS_AUTOSTART'] = 'False'
+    os.environ['OCR_PREPROCESS_ENABLED'] = 'False'
+    os.environ['OCR_STORAGE_GC_INTERVAL'] = '0'
+    os.environ['ASGI_MAX_IN_FLIGHT'] = str(max(args.concurrency, 1))
+    # 只比較服務模式本身的並行能力，不套用Gemini限流
+    for name in ('GEMINI_RPM', 'GEMINI_TPM', 'GEMINI_MAX_CONCURRENCY', 'GEMINI_MAX_QUEUE'):
+        os.environ[name] = '0'
+
+
+class InFlight:
+    """計算同時處理中的請求數的WSGI中介層"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            with self._lock:
+                self.current -= 1
+
+
+def start_sync_server(wsgi_app, threads):
+    """同步模式：以固定大小的執行緒池處理請求的WSGI伺服器"""
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='sync-worker')
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer('127.0.0.1', 0, wsgi_app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server.shutdown
+
+
+def start_async_server(application):
+    """非同步模式：以 app.asgi 的內建伺服器在背景事件迴圈中處理請求"""
+    from app.asgi import start_server
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(start_server(application, '127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    port = server.sockets[0].getsockname()[1]
+
+    def stop():
+        loop.call_soon_threadsafe(server.close)
+
+    return f'http://127.0.0.1:{port}', stop
+
+
+def post_ocr(base_url, image_path):
+    """呼叫 /api/ocr，返回 (HTTP狀態碼, 是否成功)"""
+    body = json.dumps({'image_path': image_path}).encode('utf-8')
+    req = urllib.request.Request(
+        f'{base_url}/api/ocr', data=body, headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=600) as response:
+            payload = json.loads(response.read())
+            return response.status, payload.get('status') == 'success'
+    except urllib.error.HTTPError as e:
+        return e.code, False
+    except (urllib.error.URLError, ConnectionError) as e:
+        return type(e).__name__, False
+
+
+def run_load(base_url, images, args):
+    """以多個並行用戶端送出請求，返回統計"""
+    latencies = []
+    statuses = {}
+    successes = 0
+    lock = threading.Lock()
+
+    def worker(index):
+        nonlocal successes
+        start = time.perf_counter()
+        status, success = post_ocr(base_url, images[index % len(images)])
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            successes += int(success)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        'elapsed': elapsed,
+        'throughput': args.requests / elapsed,
+        'successes': successes,
+        'statuses': statuses,
+        'latencies': latencies
+    }
+
+
+def report(name, result, peak, args):
+    from app.hedge import percentile
+
+    latencies = result['latencies']
+    print(f"[{name}] 吞吐量: {result['throughput']:.1f} req/s（共 {result['elapsed']:.2f}s）")
+    print(f"[{name}] 成功: {result['successes']}/{args.requests} | 狀態碼: {result['statuses']}")
+    print(
+        f"[{name}] 延遲(ms): " + ', '.join(
+            f"p{pct} {percentile(latencies, pct):.0f}" for pct in (50, 90, 99)
+        ) + f", max {max(latencies):.0f} | 同時處理中的請求峰值: {peak}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同步與非同步服務模式容量比較（重播OCR後端）')
+    parser.add_argument('--mode', choices=('both', 'sync', 'async'), default='both', help='測試的服務模式')
+    parser.add_argument('--requests', type=int, default=600, help='每種模式的總請求數')
+    parser.add_argument('--concurrency', type=int, default=300, help='並行用戶端數')
+    parser.add_argument('--images', type=int, default=24, help='測試圖片數')
+    parser.add_argument('--latency', default='fixed:2000', help='重播後端延遲分佈（模擬Gemini回應時間）')
+    parser.add_argument('--threads', type=int, default=16, help='同步模式的工作執行緒數')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_async_')
+    configure(args, workdir)
+
+    import logging
+    logging.disable(logging.ERROR)
+    from bench_load import make_images
+    from app.asgi import application
+
+    images = make_images(args.images, workdir)
+    print(
+        f"後端: stub（延遲 {args.latency}）| 每種模式 {args.requests} 個請求，並行 {args.concurrency}，"
+        f"同步模式 {args.threads} 個執行緒"
+    )
+
+    if args.mode in ('both', 'sync'):
+        wsgi_app = InFlight(application.bridge.wsgi_app)
+        base_url, stop = start_sync_server(wsgi_app, args.threads)
+        post_ocr(base_url, images[0])
+        result = run_load(base_url, images, args)
+        stop()
+        report('sync', result, wsgi_app.peak, args)
+
+    if args.mode in ('both', 'async'):
+        base_url, stop = start_async_server(application)
+        post_ocr(base_url, images[0])
+        result = run_load(base_url, images, args)
+        stop()
+        report('async', result, application.stats()['peak_in_flight'], args)
+
+
+if __name__ == '__main__':
+    main()
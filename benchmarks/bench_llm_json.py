@@ -0,0 +1,120 @@
+"""
+名片OCR與客戶開發信系統 - Gemini JSON回覆解析基準
+
+以收集的異常回覆語料，比較舊版（``` 分割＋json.loads）與共用解析層
+（括號平衡擷取＋修復＋欄位驗證，不含重新詢問模型）的解析成功率與耗時。
+expected 為 null 的回覆無法在本地修復，計入「需重新詢問」。
+
+使用方式:
+    python benchmarks/bench_llm_json.py [--repeat 200] [--verbose]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.hedge import percentile  # noqa: E402
+from app.llm_json import parse_llm_json, LLMJSONError  # noqa: E402
+from app.ocr import CARD_SCHEMA  # noqa: E402
+from app.analyzer import COMPANY_SCHEMA, EMAIL_SCHEMA  # noqa: E402
+
+CORPUS_PATH = os.path.join(ROOT, 'benchmarks', 'data', 'malformed_replies.jsonl')
+
+
+def legacy_parse_json_reply(response_text):
+    """舊版Gemini JSON回覆解析（基準版本 79011b2 各處重複的寫法）：以 ``` 分割後直接 json.loads"""
+    # 移除可能的Markdown格式
+    if "```json" in response_text:
+        response_text = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        response_text = response_text.split("```")[1].split("```")[0].strip()
+
+    return json.loads(response_text)
+
+SCHEMAS = {
+    'card': CARD_SCHEMA,
+    'company': COMPANY_SCHEMA,
+    'email': EMAIL_SCHEMA
+}
+
+
+def load_corpus(path=CORPUS_PATH):
+    """讀取JSONL格式的回覆語料"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def matches(data, expected):
+    """解析結果是否包含所有預期欄位值"""
+    return isinstance(data, dict) and all(data.get(key) == value for key, value in expected.items())
+
+
+def run(parse, corpus, repeat):
+    """執行解析並統計成功數與每則耗時（微秒）"""
+    outcomes = []
+    timings = []
+    for case in corpus:
+        schema = SCHEMAS[case['kind']]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            try:
+                data = parse(case['reply'], schema)
+            except (ValueError, LLMJSONError):
+                data = None
+        timings.append((time.perf_counter() - start) / repeat * 1e6)
+        outcomes.append(data)
+    return outcomes, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gemini JSON回覆解析基準')
+    parser.add_argument('--repeat', type=int, default=200, help='每則回覆重複解析次數')
+    parser.add_argument('--verbose', action='store_true', help='列出每則回覆的結果')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    recoverable = [case for case in corpus if case['expected'] is not None]
+
+    def legacy(text, schema):
+        return legacy_parse_json_reply(text)
+
+    def current(text, schema):
+        return parse_llm_json(text, schema)
+
+    print(f"語料: {len(corpus)} 則回覆（可本地修復 {len(recoverable)} 則）, 每則重複 {args.repeat} 次")
+    results = {}
+    for name, parse in (('舊版', legacy), ('新版', current)):
+        outcomes, timings = run(parse, corpus, args.repeat)
+        correct = sum(
+            1 for case, data in zip(corpus, outcomes)
+            if case['expected'] is not None and matches(data, case['expected'])
+        )
+        rejected = sum(
+            1 for case, data in zip(corpus, outcomes)
+            if case['expected'] is None and data is None
+        )
+        results[name] = outcomes
+        print(
+            f"{name}: 正確解析 {correct}/{len(recoverable)} ({correct / len(recoverable):.0%}) | "
+            f"正確拒絕 {rejected}/{len(corpus) - len(recoverable)} | "
+            f"平均 {sum(timings) / len(timings):.1f}µs, p95 {percentile(timings, 95):.1f}µs"
+        )
+
+    if args.verbose:
+        for index, case in enumerate(corpus):
+            status = []
+            for name, outcomes in results.items():
+                data = outcomes[index]
+                if case['expected'] is None:
+                    status.append(f"{name}:{'拒絕' if data is None else '接受'}")
+                else:
+                    status.append(f"{name}:{'O' if matches(data, case['expected']) else 'X'}")
+            print(f"  [{case['kind']}] {case['defect']:<28} {' '.join(status)}")
+
+
+if __name__ == '__main__':
+    main()
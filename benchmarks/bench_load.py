@@ -0,0 +1,161 @@
+"""
+名片OCR與客戶開發信系統 - Flask應用程式離線壓力測試
+
+以重播後端（stub）取代Gemini與Vision API，在本機啟動Flask應用程式，
+以多個並行用戶端呼叫 /api/ocr，量測吞吐量與尾端延遲。不需要網路連線。
+
+使用方式:
+    python benchmarks/bench_load.py [--requests 200] [--concurrency 16]
+        [--latency lognormal:900:0.35] [--error-rate 0.02] [--images 24] [--stream]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def configure(args, workdir):
+    """在匯入應用程式前設定環境變數（配置於匯入時讀取）"""
+    os.environ['OCR_BACKENDS'] = 'stub'
+    os.environ['OCR_STUB_LATENCY'] = args.latency
+    os.environ['OCR_STUB_ERROR_RATE'] = str(args.error_rate)
+    os.environ['OCR_STUB_SEED'] = str(args.seed)
+    os.environ['INSTANCE_PATH'] = workdir
+    # 每個請求都實際經過OCR後端，避免快取與重複偵測讓結果失真
+    os.environ['OCR_CACHE_ENABLED'] = 'False'
+    os.environ['OCR_DEDUP_ENABLED'] = 'False'
+    os.environ['OCR_JOBS_AUTOSTART'] = 'False'
+    os.environ['OCR_PREPROCESS_ENABLED'] = str(not args.no_preprocess)
+
+
+def make_images(count, folder):
+    """產生測試用的名片照片（每張內容不同，對應不同的錄製回應）"""
+    from PIL import Image, ImageDraw
+
+    paths = []
+    for index in range(count):
+        image = Image.new('RGB', (1200, 900), (120, 100, 80))
+        card = Image.new('RGB', (700, 400), (245, 245, 240))
+        draw = ImageDraw.Draw(card)
+        lines = [f'Company {index:03d} Ltd', f'Person {index:03d}  Manager',
+                 f'Tel 02-{1000 + index:04d}-5678', f'user{index}@example.com.tw']
+        for row, text in enumerate(lines):
+            draw.text((40, 40 + row * 80), text, fill=(10, 10, 10))
+        image.paste(card, (250, 250))
+        path = os.path.join(folder, f'card_{index:03d}.jpg')
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def post_ocr(base_url, image_path, stream):
+    """呼叫 /api/ocr，返回 (HTTP狀態碼, 是否成功, 首個欄位毫秒數)"""
+    body = json.dumps({'image_path': image_path, 'stream': stream}).encode('utf-8')
+    req = urllib.request.Request(
+        f'{base_url}/api/ocr', data=body, headers={'Content-Type': 'application/json'}
+    )
+    start = time.perf_counter()
+    first_field_ms = None
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            if not stream:
+                payload = json.loads(response.read())
+                return response.status, payload.get('status') == 'success', None
+
+            success = False
+            for raw in response:
+                line = raw.decode('utf-8').strip()
+                if line == 'event: field' and first_field_ms is None:
+                    first_field_ms = (time.perf_counter() - start) * 1000
+                elif line == 'event: done':
+                    success = True
+            return response.status, success, first_field_ms
+    except urllib.error.HTTPError as e:
+        return e.code, False, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flask應用程式離線壓力測試（重播OCR後端）')
+    parser.add_argument('--requests', type=int, default=200, help='總請求數')
+    parser.add_argument('--concurrency', type=int, default=16, help='並行用戶端數')
+    parser.add_argument('--images', type=int, default=24, help='測試圖片數')
+    parser.add_argument('--latency', default='lognormal:900:0.35', help='重播後端延遲分佈')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='重播後端錯誤率')
+    parser.add_argument('--seed', type=int, default=0, help='重播後端隨機數種子')
+    parser.add_argument('--stream', action='store_true', help='使用SSE串流模式')
+    parser.add_argument('--no-preprocess', action='store_true', help='停用圖片前處理')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    configure(args, workdir)
+
+    import logging
+    logging.disable(logging.ERROR)
+    from werkzeug.serving import make_server
+    from app import create_app
+    from app.hedge import percentile
+
+    app = create_app()
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    images = make_images(args.images, workdir)
+    print(
+        f"後端: stub（延遲 {args.latency}，錯誤率 {args.error_rate}）| "
+        f"請求 {args.requests}，並行 {args.concurrency}，{'串流' if args.stream else '一般'}模式"
+    )
+
+    # 預熱：建立OCR實例與載入錄製回應
+    post_ocr(base_url, images[0], False)
+
+    latencies = []
+    first_fields = []
+    statuses = {}
+    successes = 0
+    lock = threading.Lock()
+
+    def worker(index):
+        nonlocal successes
+        start = time.perf_counter()
+        status, success, first_field_ms = post_ocr(base_url, images[index % len(images)], args.stream)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            successes += int(success)
+            if first_field_ms is not None:
+                first_fields.append(first_field_ms)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    print(f"吞吐量: {args.requests / elapsed:.1f} req/s（共 {elapsed:.2f}s）")
+    print(f"成功: {successes}/{args.requests} | 狀態碼: {dict(sorted(statuses.items()))}")
+    print(
+        "延遲(ms): " + ', '.join(
+            f"p{pct} {percentile(latencies, pct):.0f}" for pct in (50, 90, 95, 99)
+        ) + f", max {max(latencies):.0f}"
+    )
+    if first_fields:
+        print(
+            "首個欄位(ms): " + ', '.join(
+                f"p{pct} {percentile(first_fields, pct):.0f}" for pct in (50, 95, 99)
+            )
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+名片OCR與客戶開發信系統 - 名片文字解析器效能基準
+
+比較舊版（基準版本 79011b2 的實作，逐行寫死關鍵字與未編譯的正規表示式）與新版
+（app.textmatch 的單次掃描行分類器＋預先編譯正規表示式）解析器的每秒處理行數。
+舊版解析器直接以 git show 自基準版本的 app/ocr.py 取出，需在git工作目錄中執行。
+
+使用方式:
+    python benchmarks/bench_parsers.py [--repeat 50] [--rounds 100]
+"""
+import argparse
+import ast
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.ocr import BusinessCardOCR  # noqa: E402
+
+CORPUS_PATH = os.path.join(ROOT, 'benchmarks', 'data', 'card_texts.txt')
+
+# 改寫解析器之前的基準版本
+BASELINE_COMMIT = '79011b2'
+PARSER_METHODS = ('_parse_business_card', '_parse_text_fallback')
+
+
+def load_legacy_parser(commit=BASELINE_COMMIT):
+    """自指定版本的 app/ocr.py 取出 BusinessCardOCR 的解析方法，建立舊版解析器
+
+    只編譯解析方法本身（不匯入整個模組），因此不需要Gemini與Vision套件。
+    """
+    source = subprocess.run(
+        ['git', 'show', f'{commit}:app/ocr.py'], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    tree = ast.parse(source)
+    card_class = next(node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == 'BusinessCardOCR')
+    methods = [node for node in card_class.body if isinstance(node, ast.FunctionDef) and node.name in PARSER_METHODS]
+
+    legacy_class = ast.ClassDef(name='LegacyCardParser', bases=[], keywords=[], body=methods, decorator_list=[])
+    module = ast.fix_missing_locations(ast.Module(body=[legacy_class], type_ignores=[]))
+    namespace = {'re': re, 'logger': logging.getLogger('legacy_parsers')}
+    exec(compile(module, f'{commit}:app/ocr.py', 'exec'), namespace)
+    return namespace['LegacyCardParser']()
+
+
+def load_corpus(path=CORPUS_PATH):
+    """讀取以 --- 分隔的名片原始文字"""
+    with open(path, encoding='utf-8') as f:
+        return [block.strip() for block in f.read().split('---') if block.strip()]
+
+
+def measure(parse, corpus, repeat):
+    """測量解析器處理 repeat 次語料所需的秒數"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in corpus:
+            parse(text)
+    return time.perf_counter() - start
+
+
+def compare(before, after, corpus, repeat, rounds):
+    """新舊解析器交替測量多輪，各取最快的一輪，返回 (舊版秒數, 新版秒數)
+
+    交替執行並取最小值，可降低其他行程與CPU頻率變動造成的雜訊。
+    """
+    before_time = after_time = float('inf')
+    for _ in range(rounds):
+        before_time = min(before_time, measure(before, corpus, repeat))
+        after_time = min(after_time, measure(after, corpus, repeat))
+    return before_time, after_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='名片文字解析器效能基準')
+    parser.add_argument('--repeat', type=int, default=50, help='每輪語料重複次數')
+    parser.add_argument('--rounds', type=int, default=100, help='測量輪數（取最快的一輪）')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    legacy = load_legacy_parser()
+    # 解析器不依賴外部API，略過建構子避免初始化API客戶端
+    current = BusinessCardOCR.__new__(BusinessCardOCR)
+
+    cases = [
+        ('_parse_business_card', legacy._parse_business_card, current._parse_business_card),
+        ('_parse_text_fallback', legacy._parse_text_fallback, current._parse_text_fallback),
+    ]
+
+    lines = sum(len(text.split('\n')) for text in corpus) * args.repeat
+    cards = len(corpus) * args.repeat
+    print(f"語料: {len(corpus)} 張名片, 每輪重複 {args.repeat} 次, 共 {args.rounds} 輪")
+    for name, before, after in cases:
+        before_time, after_time = compare(before, after, corpus, args.repeat, args.rounds)
+        before_rate, after_rate = lines / before_time, lines / after_time
+        changed = sum(1 for text in corpus if before(text) != after(text))
+        print(
+            f"{name}: 舊版 {before_rate:,.0f} 行/秒 ({before_time / cards * 1e6:.1f}µs/張) | "
+            f"新版 {after_rate:,.0f} 行/秒 ({after_time / cards * 1e6:.1f}µs/張) | "
+            f"加速 {after_rate / before_rate:.2f}x | 結果不同的名片 {changed}/{len(corpus)}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""
+名片OCR與客戶開發信系統 - 測試共用設定
+
+在匯入 app 之前將執行期資料目錄指向暫存目錄，並停用背景工作，
+測試不會讀寫專案的 instance 資料夾，也不會呼叫外部API。
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_instance_path = tempfile.mkdtemp(prefix='namecard-tests-')
+os.environ.setdefault('INSTANCE_PATH', _instance_path)
+os.environ.setdefault('OCR_UPLOAD_FOLDER', os.path.join(_instance_path, 'uploads'))
+os.environ.setdefault('OCR_BACKENDS', 'stub')
+os.environ.setdefault('OCR_STUB_LATENCY', 'fixed:0')
+os.environ.setdefault('OCR_CACHE_ENABLED', 'False')
+os.environ.setdefault('OCR_DEDUP_ENABLED', 'False')
+os.environ.setdefault('OCR_JOBS_AUTOSTART', 'False')
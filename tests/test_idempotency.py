@@ -0,0 +1,147 @@
+"""
+Idempotency-Key 測試
+
+以只含一個路由的Flask應用程式與計數用的替代模型測試 idempotent 裝飾器，
+每個測試使用暫存目錄中的獨立冪等鍵資料庫。
+"""
+import threading
+
+import pytest
+from flask import Flask, jsonify, request
+
+from app import idempotency
+from app.idempotency import IdempotencyStore, REPLAYED_HEADER, idempotent
+
+
+class StubModel:
+    """記錄呼叫次數的替代模型，可指定回應狀態碼或暫停直到測試放行"""
+
+    def __init__(self):
+        self.calls = 0
+        self.statuses = []
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def generate(self, prompt):
+        self.calls += 1
+        self.started.set()
+        self.proceed.wait(5)
+        status = self.statuses.pop(0) if self.statuses else 200
+        return {'reply': f'{prompt} #{self.calls}'}, status
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = IdempotencyStore(str(tmp_path / 'idempotency.sqlite3'), wait_seconds=5)
+    monkeypatch.setattr(idempotency, 'idempotency_store', store)
+    return store
+
+
+@pytest.fixture
+def model():
+    return StubModel()
+
+
+@pytest.fixture
+def client(store, model):
+    app = Flask(__name__)
+
+    @app.route('/generate', methods=['POST'])
+    @idempotent
+    def generate():
+        payload, status = model.generate(request.json['prompt'])
+        return jsonify(payload), status
+
+    return app.test_client()
+
+
+def post(client, prompt, key='key-1'):
+    return client.post('/generate', json={'prompt': prompt}, headers={'Idempotency-Key': key})
+
+
+def test_repeated_request_replays_stored_response(client, model):
+    first = post(client, 'hello')
+    second = post(client, 'hello')
+
+    assert model.calls == 1
+    assert first.status_code == second.status_code == 200
+    assert second.get_json() == first.get_json() == {'reply': 'hello #1'}
+    assert REPLAYED_HEADER not in first.headers
+    assert second.headers[REPLAYED_HEADER] == 'true'
+
+
+def test_request_without_key_is_not_deduplicated(client, model):
+    client.post('/generate', json={'prompt': 'hello'})
+    client.post('/generate', json={'prompt': 'hello'})
+    assert model.calls == 2
+
+
+def test_duplicate_waits_for_in_flight_request(client, model, store):
+    model.proceed.clear()
+    responses = {}
+
+    def send(name):
+        responses[name] = post(client, 'hello')
+
+    first = threading.Thread(target=send, args=('first',))
+    first.start()
+    assert model.started.wait(2)
+
+    second = threading.Thread(target=send, args=('second',))
+    second.start()
+    second.join(0.3)
+    # 第二個請求仍在等候第一個請求的結果
+    assert second.is_alive()
+
+    model.proceed.set()
+    first.join(5)
+    second.join(5)
+
+    assert model.calls == 1
+    assert responses['first'].get_json() == responses['second'].get_json() == {'reply': 'hello #1'}
+    assert store.stats()['joined'] == 1
+
+
+def test_same_key_with_different_body_returns_422(client, model):
+    post(client, 'hello')
+    response = post(client, 'goodbye')
+
+    assert response.status_code == 422
+    assert response.get_json()['status'] == 'error'
+    assert model.calls == 1
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_key_is_released_after_retryable_status(client, model, status):
+    model.statuses = [status]
+
+    failed = post(client, 'hello')
+    retried = post(client, 'hello')
+
+    assert failed.status_code == status
+    assert retried.status_code == 200
+    assert REPLAYED_HEADER not in retried.headers
+    assert model.calls == 2
+
+    # 成功的回應之後才會被保存並重播
+    replayed = post(client, 'hello')
+    assert replayed.headers[REPLAYED_HEADER] == 'true'
+    assert model.calls == 2
+
+
+def test_key_is_released_when_handler_raises(store, model):
+    app = Flask(__name__)
+
+    @app.route('/explode', methods=['POST'])
+    @idempotent
+    def explode():
+        model.calls += 1
+        raise RuntimeError('boom')
+
+    client = app.test_client()
+    for _ in range(2):
+        response = client.post('/explode', json={}, headers={'Idempotency-Key': 'key-1'})
+        assert response.status_code == 500
+    assert model.calls == 2
+    assert store.stats()['in_flight'] == 0
@@ -0,0 +1,71 @@
+"""
+工作佇列重試測試
+
+不啟動工作執行緒，直接以 JobStore 取出工作並呼叫 JobQueue._run，
+確認發生錯誤的工作延後重試，未到重試時間前不會再被取出。
+"""
+import pytest
+
+from app.jobs import FAILED, QUEUED, JobQueue, JobStore
+from app.ratelimit import QuotaExceeded
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), max_attempts=3, retry_base=5, retry_max=30)
+    queue.store = JobStore(queue.db_path)
+    return queue
+
+
+def run_next(queue):
+    job = queue.store.claim(queue.lease_seconds)
+    assert job is not None
+    queue._run(job)
+    return job
+
+
+def make_due(queue, job_id):
+    queue.store._conn.execute('UPDATE jobs SET not_before = 0 WHERE id = ?', (job_id,))
+    queue.store._conn.commit()
+
+
+def not_before(queue, job_id):
+    return queue.store._conn.execute('SELECT not_before FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+
+def test_failed_job_is_not_claimed_before_backoff(queue):
+    def handler(payload):
+        raise RuntimeError('暫時性錯誤')
+    queue.register('ocr', handler)
+    job_id = queue.store.create('ocr', {})
+
+    run_next(queue)
+    assert queue.store.get(job_id)['status'] == QUEUED
+    assert queue.store.claim(queue.lease_seconds) is None
+
+    # 模擬等候時間已過
+    make_due(queue, job_id)
+    job = run_next(queue)
+    assert job['attempts'] == 2
+    assert queue.store.get(job_id)['status'] == QUEUED
+
+    make_due(queue, job_id)
+    run_next(queue)
+    assert queue.store.get(job_id)['status'] == FAILED
+
+
+def test_retry_delay_backs_off_exponentially(queue):
+    error = RuntimeError('暫時性錯誤')
+    delays = [queue._retry_delay({'attempts': attempts}, error) for attempts in range(1, 6)]
+    assert delays == [5, 10, 20, 30, 30]
+
+
+def test_quota_exceeded_retries_after_suggested_delay(queue):
+    def handler(payload):
+        raise QuotaExceeded('gemini', 'rpm', 42)
+    queue.register('ocr', handler)
+    job_id = queue.store.create('ocr', {})
+
+    run_next(queue)
+    updated_at = queue.store._conn.execute('SELECT updated_at FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+    assert not_before(queue, job_id) == pytest.approx(updated_at + 42)
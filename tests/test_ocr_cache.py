@@ -0,0 +1,92 @@
+"""
+OCR結果快取測試
+
+以假的Vision與Gemini呼叫取代外部API，確認分級路由的正常結果會寫入快取，
+後端失敗後的降級結果則不寫入快取。
+"""
+import types
+
+import pytest
+
+from app import ocr as ocr_module
+from app.cache import OCRResultCache
+from app.ocr import BusinessCardOCR
+from app.router import RouterStats
+
+IMAGE = b'fake-image-bytes'
+
+# 必要欄位齊全且格式正確，信心分數超過路由門檻
+CONFIDENT_CARD = {
+    'name': '王小明',
+    'title': '業務經理',
+    'company': '未來科技股份有限公司',
+    'phone': '02-2345-6789',
+    'mobile': '0912-345-678',
+    'email': 'ming@example.com',
+    'address': '台北市內湖區瑞光路100號',
+    'website': 'www.example.com',
+    'tax_id': '',
+}
+
+
+@pytest.fixture
+def ocr(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_module, 'OCR_ROUTER_ENABLED', True)
+    monkeypatch.setattr(ocr_module, 'OCR_ROUTER_THRESHOLD', 0.8)
+
+    # 略過建構子避免初始化API客戶端，只設定路由與快取需要的屬性
+    instance = BusinessCardOCR.__new__(BusinessCardOCR)
+    instance.cache = OCRResultCache(str(tmp_path / 'ocr_cache.db'))
+    instance.dedup = None
+    instance.preprocessor = types.SimpleNamespace(fingerprint='test')
+    instance.vision_client = object()
+    instance.gemini_model = object()
+    instance.router_stats = RouterStats()
+    instance.calls = {'vision': 0, 'gemini': 0}
+    instance._prepare_image = lambda content, stats, source: (content, 'image/jpeg')
+    return instance
+
+
+def fake_vision(ocr, card):
+    def process(content, source):
+        ocr.calls['vision'] += 1
+        return dict(card)
+    ocr._process_with_vision_api = process
+
+
+def test_router_cheap_result_is_served_from_cache(ocr):
+    fake_vision(ocr, CONFIDENT_CARD)
+
+    first_stats = {}
+    first = ocr.process_image_bytes(IMAGE, stats=first_stats)
+    assert first_stats['route']['decision'] == 'cheap'
+    assert first_stats['backend'] == 'vision'
+    assert not first_stats.get('degraded')
+
+    second_stats = {}
+    second = ocr.process_image_bytes(IMAGE, stats=second_stats)
+    assert second_stats['cache'] == 'hit'
+    assert second == first
+    assert ocr.calls == {'vision': 1, 'gemini': 0}
+
+
+def test_router_gemini_failure_is_not_cached(ocr):
+    # 缺少公司與電子郵件，路由升級至Gemini
+    fake_vision(ocr, {'name': '王小明', 'phone': '02-2345-6789'})
+
+    def failing_gemini(content, mime_type, source, *args):
+        ocr.calls['gemini'] += 1
+        raise RuntimeError('Gemini unavailable')
+    ocr._process_with_gemini = failing_gemini
+    ocr._process_with_gemini_fields = failing_gemini
+
+    stats = {}
+    result = ocr.process_image_bytes(IMAGE, stats=stats)
+    assert result['name'] == '王小明'
+    assert stats['route']['decision'].endswith('_failed')
+    assert stats['degraded'] is True
+
+    stats = {}
+    ocr.process_image_bytes(IMAGE, stats=stats)
+    assert stats['cache'] == 'miss'
+    assert ocr.calls == {'vision': 2, 'gemini': 2}
@@ -0,0 +1,73 @@
+"""
+名片文字解析器與行分類器測試
+
+以 benchmarks/data/card_texts.txt 的名片語料鎖定兩個解析器的輸出
+（預期結果取自改寫前的解析器），並以逐一比對子字串的方式驗證行分類器。
+"""
+import json
+import os
+
+import pytest
+
+from app.ocr import BusinessCardOCR
+from app.textmatch import (
+    card_classifier, fallback_classifier, label_classifier,
+    ADDRESS, COMPANY, NAME_EXCLUDE, TITLE, WEBSITE_HINT,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_PATH = os.path.join(ROOT, 'benchmarks', 'data', 'card_texts.txt')
+EXPECTED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'card_parser_expected.json')
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        return [block.strip() for block in f.read().split('---') if block.strip()]
+
+
+def load_expected():
+    with open(EXPECTED_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def parser():
+    # 解析器不依賴外部API，略過建構子避免初始化API客戶端
+    return BusinessCardOCR.__new__(BusinessCardOCR)
+
+
+@pytest.mark.parametrize('method', ['_parse_business_card', '_parse_text_fallback'])
+def test_parser_output_matches_corpus(parser, method):
+    corpus = load_corpus()
+    expected = load_expected()[method]
+    assert len(corpus) == len(expected)
+
+    for text, fields in zip(corpus, expected):
+        result = dict(getattr(parser, method)(text))
+        assert result.pop('raw_text') == text
+        assert result == fields
+
+
+@pytest.mark.parametrize('classifier', [card_classifier, fallback_classifier, label_classifier])
+def test_classify_lines_matches_substring_checks(classifier):
+    texts = load_corpus() + [
+        # 關鍵字跨在前一個命中字串的結尾上
+        'wwww.example.com',
+        'WWWwww.example.com',
+        'HoteLtd',
+        'MOBILEngineer',
+        '',
+        '\n\n市\n',
+    ]
+    for text in texts:
+        assert classifier.classify_lines(text) == [classifier._mask_of(line) for line in text.split('\n')]
+
+
+def test_classify_keeps_each_parser_keyword_set():
+    # 名片解析器的電話標籤區分大小寫（不含 Tel），備用解析器不含英文公司與職稱關鍵字
+    assert not card_classifier.classify('Tel: 02-1234-5678') & ~NAME_EXCLUDE
+    assert fallback_classifier.classify('Future AI Co., Ltd.') & COMPANY == 0
+    assert fallback_classifier.classify('HR Manager') & TITLE == 0
+    assert fallback_classifier.classify('內湖區') & ADDRESS == 0
+    assert card_classifier.classify('內湖區') & ADDRESS
+    assert label_classifier.classify('Https://Example.com') & WEBSITE_HINT
@@ -0,0 +1,214 @@
+"""
+Gemini限流器測試
+
+以假時鐘取代 time.monotonic 與 threading.Timer：令牌只在測試推進時鐘時補充，
+等候中的呼叫在測試指定的時間點放行，結果不受機器速度影響。
+"""
+import threading
+import time
+import types
+
+import pytest
+
+from app import ratelimit
+from app.ratelimit import GovernedModel, QuotaExceeded, RateLimiter
+
+
+class FakeTimer:
+    """由假時鐘觸發的計時器"""
+
+    def __init__(self, clock, delay, function):
+        self.clock = clock
+        self.deadline = clock.now + delay
+        self.function = function
+        self.cancelled = False
+        self.daemon = False
+
+    def start(self):
+        self.clock.timers.append(self)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeClock:
+    """手動推進的單調時鐘"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.timers = []
+
+    def monotonic(self):
+        return self.now
+
+    def Timer(self, delay, function):
+        return FakeTimer(self, delay, function)
+
+    def advance(self, seconds):
+        """推進時鐘並依序觸發到期的計時器"""
+        self.now += seconds
+        while True:
+            due = [timer for timer in self.timers if not timer.cancelled and timer.deadline <= self.now]
+            if not due:
+                return
+            timer = min(due, key=lambda t: t.deadline)
+            self.timers.remove(timer)
+            timer.function()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit, 'time', types.SimpleNamespace(monotonic=fake.monotonic))
+    monkeypatch.setattr(ratelimit, 'threading', types.SimpleNamespace(
+        Timer=fake.Timer, Event=threading.Event, Lock=threading.Lock
+    ))
+    return fake
+
+
+def wait_until(condition, timeout=2.0):
+    """等候背景執行緒達到指定狀態（真實時間）"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('等候逾時')
+        time.sleep(0.001)
+
+
+def start_acquire(limiter, tokens, name, granted):
+    """在背景執行緒中等候配額，取得後記錄名稱，並等到佇列長度增加才返回"""
+    waiting = limiter.stats()['waiting']
+    thread = threading.Thread(target=lambda: granted.append((name, limiter.acquire(tokens))), daemon=True)
+    thread.start()
+    wait_until(lambda: limiter.stats()['waiting'] > waiting or any(n == name for n, _ in granted))
+    return thread
+
+
+def test_rpm_limit_grants_in_arrival_order(clock):
+    limiter = RateLimiter('test', rpm=60)
+    # 用完一分鐘的請求配額
+    for _ in range(60):
+        limiter.release(limiter.acquire())
+
+    granted = []
+    threads = [start_acquire(limiter, 1, name, granted) for name in ('a', 'b', 'c')]
+    assert limiter.stats()['waiting'] == 3
+
+    for expected in (['a'], ['a', 'b'], ['a', 'b', 'c']):
+        clock.advance(1.0)
+        wait_until(lambda: len(granted) == len(expected))
+        assert [name for name, _ in granted] == expected
+
+    for thread in threads:
+        thread.join(1)
+
+
+def test_large_request_is_not_overtaken_by_smaller_ones(clock):
+    limiter = RateLimiter('test', tpm=600)
+    limiter.release(limiter.acquire(600))
+
+    granted = []
+    start_acquire(limiter, 300, 'large', granted)
+    start_acquire(limiter, 10, 'small', granted)
+
+    # 補充的令牌已足夠小請求，但必須排在大請求之後
+    clock.advance(1.0)
+    assert limiter.stats()['waiting'] == 2
+
+    clock.advance(29.0)
+    wait_until(lambda: len(granted) == 1)
+    assert granted[0][0] == 'large'
+
+    clock.advance(1.0)
+    wait_until(lambda: len(granted) == 2)
+    assert [name for name, _ in granted] == ['large', 'small']
+
+
+def test_timeout_releases_queue_position_without_leaking_slot(clock):
+    limiter = RateLimiter('test', max_concurrency=1, max_wait=0.01)
+    holder = limiter.acquire()
+
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire()
+
+    stats = limiter.stats()
+    assert (stats['active'], stats['waiting'], stats['timed_out']) == (1, 0, 1)
+
+    limiter.release(holder)
+    waiter = limiter.acquire()
+    assert limiter.stats()['active'] == 1
+    limiter.release(waiter)
+    assert limiter.stats()['active'] == 0
+
+
+def test_grant_racing_timeout_is_kept_and_released_once(clock, monkeypatch):
+    limiter = RateLimiter('test', max_concurrency=1, max_wait=5)
+    holder = limiter.acquire()
+
+    class RacingEvent(threading.Event):
+        """等候逾時的同時配額剛好被放行"""
+
+        def wait(self, timeout=None):
+            limiter.release(holder)
+            return False
+
+    monkeypatch.setattr(ratelimit.threading, 'Event', RacingEvent)
+    waiter = limiter.acquire()
+
+    stats = limiter.stats()
+    assert waiter.granted
+    assert (stats['active'], stats['waiting'], stats['timed_out']) == (1, 0, 0)
+
+    limiter.release(waiter)
+    monkeypatch.setattr(ratelimit.threading, 'Event', threading.Event)
+    limiter.release(limiter.acquire())
+    assert limiter.stats()['active'] == 0
+
+
+def test_full_queue_raises_quota_exceeded_with_retry_after(clock):
+    limiter = RateLimiter('test', rpm=60, max_queue=1)
+    for _ in range(60):
+        limiter.release(limiter.acquire())
+
+    granted = []
+    thread = start_acquire(limiter, 1, 'queued', granted)
+
+    with pytest.raises(QuotaExceeded) as excinfo:
+        limiter.acquire()
+    # 佇列中一個呼叫加上本次呼叫，每秒補充一個請求
+    assert excinfo.value.retry_after == 2
+    assert limiter.stats()['rejected'] == 1
+
+    clock.advance(1.0)
+    thread.join(1)
+    assert [name for name, _ in granted] == ['queued']
+
+
+def test_upstream_quota_error_pauses_limiter(clock):
+    exceptions = pytest.importorskip('google.api_core.exceptions')
+
+    class StubModel:
+        calls = 0
+
+        def generate_content(self, contents, *args, **kwargs):
+            StubModel.calls += 1
+            raise exceptions.ResourceExhausted('quota exhausted')
+
+    limiter = RateLimiter('test', rpm=60, cooldown=30)
+    model = GovernedModel(StubModel(), limiter)
+
+    with pytest.raises(QuotaExceeded) as excinfo:
+        model.generate_content('hello')
+    assert excinfo.value.retry_after == 30
+    assert StubModel.calls == 1
+
+    stats = limiter.stats()
+    assert (stats['active'], stats['throttled'], stats['paused_for']) == (0, 1, 30)
+
+    # 暫停期間的呼叫等到暫停結束才放行
+    granted = []
+    start_acquire(limiter, 1, 'after_pause', granted)
+    clock.advance(29.0)
+    assert limiter.stats()['waiting'] == 1
+    clock.advance(1.0)
+    wait_until(lambda: len(granted) == 1)